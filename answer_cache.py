@@ -0,0 +1,150 @@
+"""
+Semantic answer cache for "Ask Tax Rules".
+
+Rule questions repeat a lot across users (HRA, 80C limits, 44ADA, ...). A
+finished, cited answer is stored with the question's embedding, the persona
+that was loaded when it was asked and a hash of the knowledge PDFs. A later
+question in the same persona whose embedding has cosine similarity of at
+least `SIMILARITY` gets the stored answer back without a model call.
+
+Entries expire after `CACHE_TTL`, the least recently used are evicted past
+`CACHE_MAX_ENTRIES`, and any entry built on an older version of the PDFs is
+ignored and purged. Vectors come from the same embedder as ingest.py
+(`embeddings.get_embedder`), and entries from another embedder never match.
+
+Only standalone, impersonal questions are shared: a question carrying
+rupee amounts ("my salary is 20L, is HRA exempt?") differs from its
+neighbours in exactly what the embedding blurs, and a follow-up ("what about
+seniors?") means something different in every chat, so app.py neither
+stores nor replays either kind (`is_shareable_question`). Section and year
+numbers ("10(13A)", "FY 2024-25") are not amounts. A chat's first question
+is asked with no persona loaded, so app.py also skips storing an answer if
+the model loaded a persona's PDF on the way: it would be replayed under the
+wrong scope.
+
+Each worker keeps the vectors in memory and reloads them whenever the
+table's row count or newest id changes, so answers stored by other workers
+are picked up on the next lookup.
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from embeddings import get_embedder
+from intent_parser import mentions_money
+from knowledge_cache import file_digest
+from retrieval import PERSONA_FILES
+
+CACHE_PATH = os.path.join(".taxguide_cache", "answers.sqlite")
+CACHE_TTL = 30 * 24 * 3600
+CACHE_MAX_ENTRIES = 2000
+SIMILARITY = float(os.getenv("TAXGUIDE_ANSWER_SIMILARITY", "0.92"))
+
+_CITATION = re.compile(r"https?://|\.pdf\b|\bsource\b", re.I)
+
+def knowledge_version(persona=None):
+    """Content hash of the PDFs an answer in `persona` can rely on (all of them when no persona is loaded)."""
+    files = [PERSONA_FILES[persona]] if persona in PERSONA_FILES else sorted(PERSONA_FILES.values())
+    h = hashlib.sha256()
+    for f in files:
+        h.update((file_digest(f) if os.path.exists(f) else f"missing:{f}").encode())
+    return h.hexdigest()[:16]
+
+def is_cacheable(answer):
+    """Only finished, cited answers are worth replaying."""
+    return bool(answer) and bool(_CITATION.search(answer))
+
+def is_shareable_question(question, standalone=True):
+    """A question whose answer may be replayed to other users: the first of its chat and free of rupee amounts."""
+    return standalone and not mentions_money(question)
+
+class AnswerCache:
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, threshold=SIMILARITY):
+        self.ttl, self.max_entries, self.threshold = ttl, max_entries, threshold
+        if path != ":memory:": os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._lock = threading.Lock()
+        self._vectors = None  # {(persona, embedder, version): (ids, matrix)}, loaded lazily
+        self._stamp = None  # (row count, max id) the vectors were loaded at
+        with self._lock, self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS answers (id INTEGER PRIMARY KEY, persona TEXT, embedder TEXT, version TEXT, "
+                "question TEXT, answer TEXT, vector BLOB, created REAL, accessed REAL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS answers_scope ON answers (persona, embedder, version)")
+
+    def _scope(self, persona, embedder):
+        return (persona or "", embedder or get_embedder().key, knowledge_version(persona))
+
+    def _matrix(self, scope):
+        """(ids, normalized float32 matrix) for one scope; caller holds the lock."""
+        stamp = self._db.execute("SELECT COUNT(*), MAX(id) FROM answers").fetchone()
+        if stamp != self._stamp: self._vectors, self._stamp = None, stamp  # another worker wrote or evicted
+        if self._vectors is None: self._vectors = {}
+        if scope not in self._vectors:
+            rows = self._db.execute(
+                "SELECT id, vector FROM answers WHERE persona = ? AND embedder = ? AND version = ? AND created > ?",
+                scope + (time.time() - self.ttl,)).fetchall()
+            ids = np.array([r[0] for r in rows], dtype=np.int64)
+            mat = np.stack([np.frombuffer(r[1], dtype=np.float32) for r in rows]) if rows else np.zeros((0, 0), np.float32)
+            self._vectors[scope] = (ids, mat)
+        return self._vectors[scope]
+
+    def lookup(self, query_vector, persona=None, embedder=None):
+        """{"question", "answer", "score"} for the closest stored question in scope, or None below the threshold."""
+        scope = self._scope(persona, embedder)
+        q = np.asarray(query_vector, dtype=np.float32)
+        q = q / (np.linalg.norm(q) or 1.0)
+        now = time.time()
+        with self._lock, self._db:
+            ids, mat = self._matrix(scope)
+            if not len(ids) or mat.shape[1] != q.shape[0]: return None
+            scores = mat @ q
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold: return None
+            row = self._db.execute("SELECT question, answer, created FROM answers WHERE id = ?", (int(ids[best]),)).fetchone()
+            if row is None or now - row[2] > self.ttl:
+                self._vectors.pop(scope, None)
+                return None
+            self._db.execute("UPDATE answers SET accessed = ? WHERE id = ?", (now, int(ids[best])))
+        return {"question": row[0], "answer": row[1], "score": float(scores[best])}
+
+    def put(self, question, query_vector, answer, persona=None, embedder=None):
+        scope = self._scope(persona, embedder)
+        v = np.asarray(query_vector, dtype=np.float32)
+        v = v / (np.linalg.norm(v) or 1.0)
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute("INSERT INTO answers (persona, embedder, version, question, answer, vector, created, accessed) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", scope + (question, answer, v.tobytes(), now, now))
+            self._evict(now)
+            self._vectors = None
+
+    def _evict(self, now):
+        current = {p: knowledge_version(p or None) for (p,) in self._db.execute("SELECT DISTINCT persona FROM answers")}
+        for persona, version in current.items():
+            self._db.execute("DELETE FROM answers WHERE persona = ? AND version != ?", (persona, version))
+        self._db.execute("DELETE FROM answers WHERE created < ?", (now - self.ttl,))
+        self._db.execute(
+            "DELETE FROM answers WHERE id IN (SELECT id FROM answers ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,))
+
+    def clear(self):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM answers")
+            self._vectors = None
+
+_cache = None
+
+def get_answer_cache():
+    global _cache
+    if _cache is None: _cache = AnswerCache()
+    return _cache
+
+def set_answer_cache(cache):
+    global _cache
+    _cache = cache
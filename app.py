@@ -1,11 +1,23 @@
 import streamlit as st
 import google.generativeai as genai
+import io
 import os
-import time
-import math
-import re
+import tracing
 from dotenv import load_dotenv
-from duckduckgo_search import DDGS
+from engine import CALC_DEFAULTS, calculate, parse_calculate_args, run_calculation, safe_math_eval
+from optimizer import format_plan
+from retrieval import PERSONA_FILES, RETRIEVAL_MARKER, load_index, format_context
+from embeddings import embed_query
+from knowledge_cache import get_uploaded_file, invalidate, is_rejected, set_api_key, warm_cache
+from web_search import search_indian_tax_rules
+from llm_client import stream_message
+from tool_calls import ToolRegistry, needs_followup, format_tool_results
+from chat_context import calc_state_record, set_calc_state, compact_session
+from intent_parser import parse_intent, to_calculate_args
+from answer_cache import get_answer_cache, is_cacheable, is_shareable_question
+from session_store import get_session_store, new_session_id, snapshot
+from capital_gains import compute_capital_gains
+from tax_rules import DEFAULT_FY
 
 # --- 1. CONFIGURATION ---
 st.set_page_config(page_title="TaxGuide AI", page_icon="🇮🇳", layout="centered", initial_sidebar_state="collapsed")
@@ -17,156 +29,164 @@ if not api_key:
     except: st.error("🔑 API Key Missing."); st.stop()
 
 genai.configure(api_key=api_key)
+set_api_key(api_key)  # upload registry entries belong to this key
 
-# --- 2. HELPER: RETRY LOGIC ---
-def send_message_with_retry(chat_session, prompt, retries=3):
-    for i in range(retries):
-        try:
-            return chat_session.send_message(prompt)
-        except Exception as e:
-            if "429" in str(e):
-                time.sleep(2 ** (i + 1))
-                continue
-            else:
-                raise e
-    raise Exception("⚠️ Server busy. Please wait 1 minute.")
+# --- 2. HELPER: RETRY LOGIC & STREAMING ---
+# stream_message lives in llm_client.py: shared rate limiter, jittered backoff.
+TOOL_MARKERS = ["CALCULATE(", "CALCULATE_MATH(", "LOAD(", "SEARCH_WEB("]
+HOLD_BACK = max(map(len, TOOL_MARKERS))  # a marker split across chunks is caught before any of it is shown
+MAX_TOOL_ROUNDS = 3
+
+def tool_call_start(text):
+    """Start of the line holding the first tool call, or None."""
+    hits = [i for i in (text.find(m) for m in TOOL_MARKERS) if i >= 0]
+    return text.rfind("\n", 0, min(hits)) + 1 if hits else None
+
+def stream_reply(chat_session, prompt):
+    """
+    Streams a plain answer into the chat as tokens arrive, holding back the
+    last few characters until they can't be the start of a tool call. From
+    the first tool call on, the reply is collected silently for the
+    dispatcher; only the prose before it is shown and kept in the transcript.
+    Returns (full_text, rendered), rendered False for replies with tool calls.
+    """
+    with tracing.span("model.reply") as sp:
+        chunks = iter(stream_message(chat_session, prompt))
+        reply = {"text": "", "cut": None}
+        def prose():
+            sent = 0
+            for chunk in chunks:
+                reply["text"] += chunk
+                reply["cut"] = tool_call_start(reply["text"])
+                end = len(reply["text"]) - HOLD_BACK if reply["cut"] is None else reply["cut"]
+                if end > sent:
+                    yield reply["text"][sent:end]
+                    sent = end
+                if reply["cut"] is not None: return
+            if len(reply["text"]) > sent: yield reply["text"][sent:]
+        pieces = prose()
+        head = next((p for p in pieces if p.strip()), None)  # no bubble for a reply that is only tool calls
+        shown = ""
+        if head is not None:
+            def rest():
+                yield head
+                yield from pieces
+            with st.chat_message("assistant", avatar="🤖"):
+                shown = st.write_stream(rest())
+        text = reply["text"] + "".join(chunks)
+        if reply["cut"] is not None:
+            sp.set(tool_call=True)
+            shown = TOOLS.strip(shown) if shown else ""
+        if shown: st.session_state.transcript.append({"role": "assistant", "text": shown})
+        return text, reply["cut"] is None
 
 # --- 3. KNOWLEDGE LOADER & SEARCH ENGINE ---
-@st.cache_resource
 def get_pdf_file(filename):
-    if os.path.exists(filename):
-        try:
-            f = genai.upload_file(path=filename, display_name=filename)
-            while f.state.name == "PROCESSING": time.sleep(1); f = genai.get_file(f.name)
-            return f
-        except: return None
-    return None
+    # Disk registry keyed by content hash: reuses the remote copy across restarts until it nears expiry
+    return get_uploaded_file(filename)
 
-def inject_knowledge(persona_type):
-    if persona_type == "SALARY": return get_pdf_file("salary_rules.pdf")
-    elif persona_type == "BUSINESS": return get_pdf_file("freelancer_rules.pdf")
-    elif persona_type == "CAPITAL_GAINS": return get_pdf_file("capital_gains.pdf")
-    return None
+@st.cache_resource
+def start_knowledge_warmup():
+    # Once per server process: upload/revalidate the persona PDFs off the request path
+    return warm_cache(list(PERSONA_FILES.values()))
 
-def search_indian_tax_rules(query):
-    """
-    Performs a live web search restricted to Indian Income Tax context.
-    """
-    try:
-        # Force "India" context to prevent US/Global answers
-        safe_query = f"{query} India Income Tax Act rules latest"
-        results = DDGS().text(safe_query, max_results=3)
-        if not results:
-            return "No specific Indian tax ruling found online."
-        
-        summary = "Search Results:\n"
-        for res in results:
-            summary += f"- {res['title']}: {res['body']} (Source: {res['href']})\n"
-        return summary
+start_knowledge_warmup()
+
+def inject_knowledge(persona_type):
+    filename = PERSONA_FILES.get(persona_type)
+    return get_pdf_file(filename) if filename else None
+
+def is_file_part(part):
+    return (isinstance(part, dict) and "file_data" in part) or bool(getattr(getattr(part, "file_data", None), "file_uri", ""))
+
+def has_file_part(history):
+    return any(is_file_part(p) for m in history for p in (m["parts"] if isinstance(m, dict) else m.parts))
+
+def with_live_file(history, persona, stale=False):
+    """`history` with its PDF parts pointing at the live upload of `persona`'s PDF (re-uploaded first if `stale`); None if unavailable."""
+    filename = PERSONA_FILES.get(persona)
+    if not filename: return None
+    if stale: invalidate(filename)
+    fresh = inject_knowledge(persona)
+    if not fresh: return None
+    out = []
+    for m in history:
+        role, parts = (m["role"], m["parts"]) if isinstance(m, dict) else (m.role, list(m.parts))
+        out.append({"role": role, "parts": [fresh if is_file_part(p) else p for p in parts]})
+    return out
+
+def reply_with_knowledge(chat_session, prompt):
+    """stream_reply, re-uploading the PDF once if the API rejects its registered copy (expired, deleted, other project)."""
+    try: return stream_reply(chat_session, prompt)
     except Exception as e:
-        return f"Search Error: {str(e)}"
+        if not (is_rejected(e) and has_file_part(chat_session.history)): raise
+        history = with_live_file(chat_session.history, st.session_state.loaded_persona, stale=True)
+        if history is None: raise
+        chat_session.history = history
+        return stream_reply(chat_session, prompt)
 
-# --- 4. CALCULATOR ENGINES ---
+@st.cache_resource
+def get_knowledge_index():
+    # Memory-mapped, so every session/worker shares one copy of the embeddings
+    try: return load_index()
+    except Exception: return None
+
+def retrieve_context(query, persona=None, k=4, index=None, query_vector=None):
+    """Top-k rule chunks for `query` from the local index ('' if unavailable)."""
+    index = index or get_knowledge_index()
+    if index is None or not len(index): return ""
+    try: return format_context(index.search(query_vector if query_vector is not None else embed_query(query), k=k, persona=persona))
+    except Exception: return ""
+
+def cached_answer(query, persona):
+    """(query_vector, hit) from the semantic answer cache; the vector is reused for retrieval."""
+    try: query_vector = embed_query(query)
+    except Exception: return None, None
+    with tracing.span("answer_cache.lookup") as sp:
+        try: hit = get_answer_cache().lookup(query_vector, persona)
+        except Exception: hit = None
+        sp.set(cache="hit" if hit else "miss", score=round(hit["score"], 3) if hit else None)
+    return query_vector, hit
 
-def safe_math_eval(expression):
-    try:
-        if ":" in expression: expression = expression.split(":")[-1]
-        if "=" in expression: expression = expression.split("=")[-1]
-        expression = expression.lower().strip()
-        expression = expression.replace("\n", " ").replace("\t", " ") 
-        expression = expression.replace("`", "").replace("₹", "")       
-        expression = expression.replace("%", "*0.01").replace("^", "**")     
-        expression = re.sub(r'(\d),(\d)', r'\1\2', expression)
-        allowed = set("0123456789+-*/()., <>=abcdefhilmnorstuwx")
-        if not set(expression).issubset(allowed): return "Error: Unsafe characters"
-        safe_dict = {"min": min, "max": max, "abs": abs, "round": round, "int": int, "float": float, "pow": pow, "ceil": math.ceil, "floor": math.floor}
-        result = eval(expression, {"__builtins__": None}, safe_dict)
-        if isinstance(result, (int, float)): return f"{int(result):,}"
-        return str(result)
-    except Exception as e: return f"Error ({e})"
-
-def calculate_hra_exemption(basic_annual, rent_annual, hra_received_annual, metro=True):
-    cond1 = hra_received_annual
-    cond2 = rent_annual - (0.10 * basic_annual)
-    cond3 = (0.50 if metro else 0.40) * basic_annual
-    exemption = max(0, min(cond1, cond2, cond3))
-    return int(exemption)
-
-def calculate_tax_detailed(age, salary, business_income, rent_paid, hra_received, inv_80c, med_80d, home_loan, nps, edu_loan, donations, savings_int, other_deductions, custom_basic=0):
-    std_deduction_new = 75000; std_deduction_old = 50000
-    
-    basic = 0
-    if custom_basic > 0:
-        if custom_basic < 100: basic = salary * (custom_basic / 100.0)
-        else: basic = custom_basic
-    else:
-        basic = salary * 0.50 
-
-    final_hra_received = hra_received
-    if hra_received == 0:
-        final_hra_received = basic * 0.40
-
-    final_rent = rent_paid
-    if rent_paid > 0 and rent_paid < (salary * 0.15):
-        final_rent = rent_paid * 12 
-
-    hra_exemption = calculate_hra_exemption(basic, final_rent, final_hra_received, metro=True) 
-    
-    limit_80tta = 50000 if age >= 60 else 10000
-    deduction_80tta = min(savings_int, limit_80tta)
-    
-    deductions_old = (
-        std_deduction_old + hra_exemption + min(inv_80c, 150000) + med_80d + 
-        min(home_loan, 200000) + min(nps, 50000) + edu_loan + 
-        donations + deduction_80tta + other_deductions
-    )
-    
-    net_old = max(0, (salary + business_income * 0.5) - deductions_old)
-    net_new = max(0, (salary + business_income * 0.5) - std_deduction_new)
-
-    bd_new = compute_tax_breakdown(net_new, age, "new")
-    bd_old = compute_tax_breakdown(net_old, age, "old")
-    
-    return {
-        "new": {"breakdown": bd_new, "net": net_new},
-        "old": {
-            "breakdown": bd_old, 
-            "net": net_old, 
-            "deductions": {
-                "std": std_deduction_old, "hra": hra_exemption, "80c": min(inv_80c, 150000), 
-                "med80d": med_80d, "home_loan": min(home_loan, 200000), "nps": min(nps, 50000),
-                "80e": edu_loan, "80g": donations, "80tta": deduction_80tta, "other": other_deductions
-            }, 
-            "assumptions": {"basic": basic, "rent_annual": final_rent, "hra_received": final_hra_received}
-        }
-    }
-
-def compute_tax_breakdown(income, age, regime):
-    tax = 0
-    if regime == "new":
-        t = income
-        if t > 2400000: tax += (t-2400000)*0.30; t=2400000
-        if t > 2000000: tax += (t-2000000)*0.25; t=2000000
-        if t > 1600000: tax += (t-1600000)*0.20; t=1600000
-        if t > 1200000: tax += (t-1200000)*0.15; t=1200000
-        if t > 800000:  tax += (t-800000)*0.10;  t=800000
-        if t > 400000:  tax += (t-400000)*0.05
-    else:
-        limit = 500000 if age >= 80 else (300000 if age >= 60 else 250000)
-        t = income
-        if t > 1000000: tax += (t-1000000)*0.30; t=1000000
-        if t > 500000:  tax += (t-500000)*0.20;  t=500000
-        if t > limit:   tax += (t-limit)*0.05
-
-    surcharge = 0
-    if income > 5000000:
-        rate = 0.10 if income <= 10000000 else 0.15
-        if income > 20000000: rate = 0.25
-        if regime == "old" and income > 50000000: rate = 0.37
-        surcharge = tax * rate
-    
-    cess = (tax + surcharge) * 0.04
-    return {"base": int(tax), "surcharge": int(surcharge), "cess": int(cess), "total": int(tax + surcharge + cess)}
+# --- 4. CALCULATOR ENGINES ---
+# Calculators live in engine.py (headless, shared with service.py).
+
+@st.cache_data(max_entries=32, show_spinner="Matching trades FIFO...")
+def capital_gains_summary(data, fy):
+    # Streams the ledger; cached per file content, so reruns don't re-read it
+    return compute_capital_gains(io.TextIOWrapper(io.BytesIO(data), encoding="utf-8-sig", newline=""), fy)
+
+# --- 4b. TOOLS (run off the script thread; no st.* calls in here) ---
+
+def tool_calculate(args, ctx):
+    return run_calculation(parse_calculate_args(args), gains=ctx.get("gains"))
+
+def tool_math(args, ctx):
+    res = safe_math_eval(args)
+    return {"output": f"Math Result: {res}. State this exact number.", "data": res}
+
+def tool_search(args, ctx):
+    return {"output": f"Search Result: {search_indian_tax_rules(args)}. Summarize strictly for India and cite source.", "data": args}
+
+def tool_load(args, ctx):
+    persona = args.strip().strip("'\"").upper()
+    index = ctx["index"]
+    if ctx["mode"] == "rules" and index is not None and index.has_persona(persona):
+        # Indexed persona: inject matching chunks instead of uploading the whole PDF
+        ctx_text = retrieve_context(ctx["prompt"], persona, index=index, query_vector=ctx.get("query_vector"))
+        return {"output": f"Context loaded.{RETRIEVAL_MARKER}:\n{ctx_text}\n\nAnswer based on these excerpts and cite the source.", "data": {"persona": persona, "kind": "chunks"}}
+    if ctx["loaded_persona"] == persona:
+        return {"output": "Context already loaded. Answer based on this PDF.", "data": {"persona": persona, "kind": "loaded"}}
+    f = inject_knowledge(persona)
+    if f:
+        return {"output": "Context loaded. Answer based on this PDF.", "data": {"persona": persona, "kind": "pdf", "file": f}}
+    return {"output": f"PDF missing. Use SEARCH_WEB for '{ctx['prompt']}' instead.", "data": {"persona": persona, "kind": "missing"}}
+
+TOOLS = ToolRegistry()
+TOOLS.register("CALCULATE", tool_calculate, followup=False, description="Full New vs Old regime calculation")
+TOOLS.register("CALCULATE_MATH", tool_math, description="Arithmetic spot check")
+TOOLS.register("SEARCH_WEB", tool_search, description="Indian tax rules web search")
+TOOLS.register("LOAD", tool_load, description="Load persona knowledge")
 
 # --- 5. THE UNIFIED BRAIN (MERGED PROMPT) ---
 
@@ -175,10 +195,10 @@ You are "TaxGuide AI", an expert strictly in **Indian Income Tax (Act 1961)**.
 
 **MODE 1: THE HELPFUL CALCULATOR**
 1. **Trigger:** If user gives Salary (e.g., "15L"), output `CALCULATE(...)` IMMEDIATELY.
-2. **Post-Calc Action:** After the tool runs, you will receive "CALCULATION_DONE".
-3. **The Audit:** Analyze the inputs. If defaults (zeros) were used for `rent`, `inv80c` (PF/PPF), or `home_loan`, politely suggest them.
-   - *Example:* "I noticed you haven't included 80C investments. You can save tax on up to ₹1.5L. Do you have PF or LIC?"
+2. **Post-Calc Action:** The app shows the result plus a deterministic "Optimization Plan" (80C, NPS, 80D, Home Loan top-ups and the regime break-even).
+3. **Follow-ups:** The latest calculation is kept as a `CALC_STATE: {...}` record (inputs, taxes, optimization plan). Use it to answer follow-up questions; only call `CALCULATE(...)` again if inputs change.
    - *Tone:* Helpful consultant, not aggressive interrogator.
+4. **Capital Gains:** If the user uploaded a trade ledger, `CALCULATE(...)` already includes its STCG/LTCG tax (111A/112A/112, FIFO). Never estimate capital gains tax yourself.
 
 **MODE 2: THE KNOWLEDGE EXPERT**
 1. **Trigger:** If user asks a rule question (e.g., "Is tuition taxable?").
@@ -192,24 +212,103 @@ You are "TaxGuide AI", an expert strictly in **Indian Income Tax (Act 1961)**.
 
 **TOOLS:**
 - `CALCULATE(...)`: For tax computation.
+- `CALCULATE_MATH(expression)`: For arithmetic spot checks. Helpers: min, max, round, ceil, floor, `slab_tax(income, 'new'|'old', age)`, `tax(income, 'new'|'old', age)`, `hra_exemption(basic, rent, hra_received)`.
 - `SEARCH_WEB(query)`: Search Google/DDG for Indian rules.
 - `LOAD(...)`: Load PDF knowledge.
+- You may output several tool calls in one reply, one per line (e.g. `LOAD(SALARY)` and `SEARCH_WEB(...)` together). All results come back in one "Tool Results:" message.
 
 **OUTPUT FORMAT:**
 [Direct Answer / Action]
 """
 
-# --- 6. UI SETUP ---
-if "chat_started" not in st.session_state:
+# --- 6. SESSIONS (shared store, so any worker/replica can serve the chat) ---
+def new_chat(history):
+    model = genai.GenerativeModel('gemini-2.0-flash', system_instruction=sys_instruction_unified)
+    return model.start_chat(history=history)
+
+def save_session():
+    with tracing.span("session.save"):
+        state = snapshot(st.session_state.chat_session.history, st.session_state.transcript,
+                         mode=st.session_state.mode, loaded_persona=st.session_state.loaded_persona,
+                         capital_gains=st.session_state.capital_gains)
+        try: get_session_store().save(st.session_state.sid, state)
+        except Exception as e: st.toast(f"⚠️ Session not saved: {e}")
+
+def restore_session(sid):
+    """Rebuild the chat from the store (after a restart or on another replica). False if unknown."""
+    try: state = get_session_store().load(sid)
+    except Exception: state = None
+    if not state: return False
+    history, persona = state["history"], state.get("loaded_persona")
+    if persona and has_file_part(history):
+        history = with_live_file(history, persona) or history  # remote file URIs expire; the upload registry has the live one
+    transcript = []
+    for item in state["transcript"]:
+        if item.get("kind") == "calc":
+            # A record that no longer replays (older format, stray keys) is dropped, not allowed to break the page
+            try: item = dict(item, res=calculate({k: v for k, v in item["d"].items() if k in CALC_DEFAULTS}, plan=False, gains=item.get("gains")))
+            except Exception: continue
+        transcript.append(item)
+    st.session_state.update(chat_started=True, mode=state.get("mode"), loaded_persona=persona, capital_gains=state.get("capital_gains"),
+                            chat_session=new_chat(history), transcript=transcript)
+    return True
+
+# --- 6b. DEBUG SIDEBAR (TAXGUIDE_DEBUG=1 or ?debug=1) ---
+def render_trace_sidebar(trace):
+    """Where the last turn's time went (span tree from tracing.py), plus p50/p95 for this server process."""
+    with st.sidebar:
+        st.markdown("### ⏱️ Last Turn")
+        if not trace:
+            st.caption("Send a message to see where the time goes.")
+            return
+        b = tracing.turn_breakdown(trace)
+        c1, c2 = st.columns(2)
+        c1.metric("Total", f"{b['total_ms']:,.0f} ms")
+        c2.metric("Model", f"{b['model_ms']:,.0f} ms")
+        c1.metric("Retry Sleep", f"{b['retry_sleep_ms']:,.0f} ms")
+        c2.metric("Tools", f"{b['tools_ms']:,.0f} ms")
+        c1.metric("PDF Upload", f"{b['upload_ms']:,.0f} ms")
+        c2.metric("Rendering", f"{b['render_ms']:,.0f} ms")
+        st.caption(f"Tokens {b['prompt_tokens']:,} in / {b['output_tokens']:,} out · cache {b['cache_hits']} hit / {b['cache_misses']} miss · "
+                   f"queued {b['queue_ms']:,.0f} ms on the rate limiter")
+        rows = list(tracing.flatten(trace))
+        st.table({
+            "Span": ["· " * depth + n["name"] for depth, n in rows],
+            "Start ms": [f"{n['at_ms']:,.1f}" for _, n in rows],
+            "ms": [f"{n['ms']:,.1f}" for _, n in rows],
+            "Details": [", ".join(f"{k}={v}" for k, v in n["attrs"].items() if v not in (None, "")) for _, n in rows],
+        })
+        with st.expander("p50 / p95 (this process)"):
+            summary = tracing.metrics.summary()
+            st.table({
+                "Span": list(summary),
+                "Count": [r["count"] for r in summary.values()],
+                "p50 ms": [f"{r['p50_ms']:,.1f}" for r in summary.values()],
+                "p95 ms": [f"{r['p95_ms']:,.1f}" for r in summary.values()],
+            })
+
+# --- 7. UI SETUP ---
+debug = os.getenv("TAXGUIDE_DEBUG") == "1" or st.query_params.get("debug") == "1"
+sid = st.query_params.get("sid") or new_session_id()
+st.query_params["sid"] = sid
+if "chat_started" not in st.session_state or st.session_state.get("sid") != sid:
+    st.session_state.sid = sid
     st.session_state.chat_started = False
     st.session_state.chat_session = None
     st.session_state.loaded_persona = None
+    st.session_state.mode = None
+    st.session_state.transcript = []  # what the UI shows; the model history is compacted separately
+    st.session_state.capital_gains = None
+    restore_session(sid)
 
 col1, col2 = st.columns([5, 1])
 with col1: st.markdown("### 🇮🇳 TaxGuide AI")
 with col2: 
     if st.button("🔄", help="Reset App"):
+        try: get_session_store().delete(sid)
+        except Exception: pass
         st.session_state.clear()
+        st.query_params.clear()
         st.rerun()
 
 if not st.session_state.chat_started:
@@ -218,134 +317,190 @@ if not st.session_state.chat_started:
     with c1:
         if st.button("💰 Calculate My Tax", use_container_width=True):
             st.session_state.chat_started = True
-            model = genai.GenerativeModel('gemini-2.0-flash', system_instruction=sys_instruction_unified)
-            st.session_state.chat_session = model.start_chat(history=[])
-            st.session_state.chat_session.history.append({"role": "model", "parts": ["Hi! Let's start with the basics. What is your **Annual Salary**?"]})
+            st.session_state.mode = "calculate"
+            st.session_state.chat_session = new_chat([{"role": "model", "parts": ["Hi! Let's start with the basics. What is your **Annual Salary**?"]}])
+            st.session_state.transcript = [{"role": "assistant", "text": "Hi! Let's start with the basics. What is your **Annual Salary**?"}]
+            save_session()
             st.rerun()
     with c2:
         if st.button("📚 Ask Tax Rules", use_container_width=True):
             st.session_state.chat_started = True
-            model = genai.GenerativeModel('gemini-2.0-flash', system_instruction=sys_instruction_unified)
-            st.session_state.chat_session = model.start_chat(history=[])
-            st.session_state.chat_session.history.append({"role": "model", "parts": ["Hi! I can explain Indian Tax Rules. What's your question?"]})
+            st.session_state.mode = "rules"
+            st.session_state.chat_session = new_chat([{"role": "model", "parts": ["Hi! I can explain Indian Tax Rules. What's your question?"]}])
+            st.session_state.transcript = [{"role": "assistant", "text": "Hi! I can explain Indian Tax Rules. What's your question?"}]
+            save_session()
             st.rerun()
 
 else:
+    # One trace per rerun; only reruns that carry a new message are exported
+    turn = tracing.start_trace("chat.turn", mode=st.session_state.mode)
+
     def render_message(text, role, avatar):
         with st.chat_message(role, avatar=avatar):
             st.markdown(text)
 
-    for msg in st.session_state.chat_session.history:
-        text = ""
-        if isinstance(msg, dict):
-            parts = msg.get("parts", []); text = parts[0] if parts else ""
-            role_label = msg.get("role")
-        else:
-            text = msg.parts[0].text if msg.parts else ""
-            role_label = msg.role
-        
-        role_icon = "👤" if role_label == "user" else "🤖"
-        if text and not any(x in text for x in ["CALCULATE(", "CALCULATE_MATH(", "LOAD(", "SEARCH_WEB(", "Result:", "CALCULATION_DONE"]):
-            render_message(text, role_label, role_icon)
+    def say(text):
+        render_message(text, "assistant", "🤖")
+        st.session_state.transcript.append({"role": "assistant", "text": text})
+
+    def render_tax_analysis(d, res):
+        tn, to = res['new']['breakdown']['total'], res['old']['breakdown']['total']
+        winner, savings = ("New", to-tn) if tn < to else ("Old", tn-to)
+
+        with st.chat_message("assistant", avatar="🤖"):
+            st.subheader("📊 Tax Analysis")
+            c1, c2, c3 = st.columns(3)
+            c1.metric("New Regime Tax", f"₹{tn:,}")
+            c2.metric("Old Regime Tax", f"₹{to:,}")
+            c3.metric("Savings", f"₹{savings:,}", delta_color="normal" if winner=="New Regime" else "inverse")
+            
+            if winner == "New Regime":
+                st.success(f"🏆 **Recommendation: New Regime** saves you **₹{savings:,}**")
+            else:
+                st.info(f"🏆 **Recommendation: Old Regime** saves you **₹{savings:,}**")
+
+            st.markdown("### 🧾 Detailed Breakdown")
+            
+            other_total = (res['old']['deductions']['80e'] + res['old']['deductions']['80g'] + res['old']['deductions']['80tta'] + res['old']['deductions']['other'])
+            table_data = {
+                "Item": ["Gross Salary", "HRA Exemption ", "Standard Deduction", "80C (PF/LIC/PPF) ", "NPS (80CCD) ", "Home Loan Interest ", "Health Ins (80D)", "Other (Edu/Donations/Int)", "Taxable Income", "Net Tax Payable"],
+                "New Regime": [f"₹{d['salary']:,}", "₹0", "₹75,000", "₹0", "₹0", "₹0", "₹0", "₹0", f"₹{res['new']['net']:,}", f"₹{tn:,}"],
+                "Old Regime": [f"₹{d['salary']:,}", f"₹{res['old']['deductions']['hra']:,}", "₹50,000", f"₹{res['old']['deductions']['80c']:,}", f"₹{res['old']['deductions']['nps']:,}", f"₹{res['old']['deductions']['home_loan']:,}", f"₹{res['old']['deductions']['med80d']:,}", f"₹{other_total:,}", f"₹{res['old']['net']:,}", f"₹{to:,}"]
+            }
+            st.table(table_data)
+            
+            st.caption(f"*Calculated based on Basic: ₹{res['old']['assumptions']['basic']:,} & HRA Received: ₹{res['old']['assumptions']['hra_received']:,}*")
+            if "capital_gains" in res:
+                g = res["capital_gains"]
+                st.caption(f"*Includes capital gains: tax at special rates ₹{res['new']['breakdown']['capital_gains_tax']:,} (New) / ₹{res['old']['breakdown']['capital_gains_tax']:,} (Old), "
+                           f"slab-rate gains ₹{g['slab_income']:,}, 112A exemption used ₹{g['exemption_112a_used']:,}*")
+
+    if st.session_state.mode == "calculate":
+        with st.expander("📈 Trade ledger (capital gains)", expanded=st.session_state.capital_gains is not None):
+            ledger = st.file_uploader("Broker trade CSV: date, symbol, buy/sell, quantity, price", type=["csv"])
+            if ledger is not None:
+                try: st.session_state.capital_gains = capital_gains_summary(ledger.getvalue(), DEFAULT_FY)
+                except ValueError as e: st.error(f"Could not read the ledger: {e}")
+            g = st.session_state.capital_gains
+            if g:
+                k = g["by_kind"]
+                st.caption(f"{g['sales']:,} sales matched FIFO · STCG 111A ₹{k['stcg_111a']:,} · LTCG 112A ₹{k['ltcg_112a']:,} · "
+                           f"LTCG 112 ₹{k['ltcg_112']:,} · slab-rate ₹{k['stcg_slab'] + k['intraday']:,}. Included in every calculation from now on.")
+
+    with tracing.span("render.transcript", items=len(st.session_state.transcript)):
+        for item in st.session_state.transcript:
+            if item.get("kind") == "calc":
+                render_tax_analysis(item["d"], item["res"])
+            else:
+                render_message(item["text"], item["role"], "👤" if item["role"] == "user" else "🤖")
+
+    def apply_tool_result(r):
+        """Render a tool result and apply its session-state effects (script thread only)."""
+        name, data = r["name"], r.get("data")
+        with tracing.span(f"render.{name}"):
+            if r.get("error"):
+                st.toast(f"⚠️ {name} failed: {r['error']}", icon="⚠️")
+            elif name == "SEARCH_WEB":
+                st.toast(f"🌐 Searching Indian Rules: {data}", icon="🔍")
+            elif name == "CALCULATE_MATH":
+                st.toast(f"🧮 Computed: {data}", icon="✅")
+            elif name == "LOAD":
+                persona = data["persona"]
+                if data["kind"] == "pdf":
+                    hist = st.session_state.chat_session.history[:-1]
+                    hist.append({"role": "user", "parts": [data["file"], "Context Loaded."]})
+                    hist.append({"role": "model", "parts": ["Context received."]})
+                    st.session_state.chat_session.history = hist  # same session, no model rebuild
+                if data["kind"] == "missing":
+                    st.toast("⚠️ PDF not found. Checking Web...", icon="🌐")
+                else:
+                    st.session_state.loaded_persona = persona
+                    st.toast(f"📚 Loaded: {persona}", icon="✅")
+            elif name == "CALCULATE":
+                render_tax_analysis(data["d"], data["res"])
+                st.session_state.transcript.append({"role": "assistant", "kind": "calc", "d": data["d"], "res": data["res"], "gains": data["res"].get("capital_gains")})
+                # --- THE "HELPFUL" NUDGE (deterministic, no model call) ---
+                say(format_plan(data["plan"]))
+                # The model keeps one structured record instead of prose results
+                set_calc_state(st.session_state.chat_session.history, calc_state_record(data["d"], data["res"], data["plan"]))
 
     if prompt := st.chat_input("Ex: Salary 15L... or Is tuition reimbursement taxable?"):
         st.chat_message("user", avatar="👤").markdown(prompt)
+        st.session_state.transcript.append({"role": "user", "text": prompt})
         
         with st.spinner("Processing..."):
             try:
-                response = send_message_with_retry(st.session_state.chat_session, prompt)
-                text = response.text
-                
-                # --- TOOL 1: WEB SEARCH ---
-                if "SEARCH_WEB(" in text:
-                    query = text.split("SEARCH_WEB(")[1][:-1]
-                    st.toast(f"🌐 Searching Indian Rules: {query}", icon="🔍")
-                    search_result = search_indian_tax_rules(query)
-                    final_res = send_message_with_retry(st.session_state.chat_session, f"Search Result: {search_result}. Summarize strictly for India and cite source.")
-                    render_message(final_res.text, "assistant", "🤖")
-
-                # --- TOOL 2: MATH SPOT CHECK ---
-                elif "CALCULATE_MATH(" in text:
-                    expr = text.split("CALCULATE_MATH(")[1][:-1]
-                    res = safe_math_eval(expr)
-                    st.toast(f"🧮 Computed: {res}", icon="✅")
-                    send_message_with_retry(st.session_state.chat_session, f"Math Result: {res}. State this exact number.")
-                    text = st.session_state.chat_session.history[-1].parts[0].text
-                    render_message(text, "assistant", "🤖")
-
-                # --- TOOL 3: LOAD KNOWLEDGE ---
-                elif "LOAD(" in text:
-                    persona = text.split("LOAD(")[1].split(")")[0]
-                    if st.session_state.loaded_persona != persona:
-                        f = inject_knowledge(persona)
-                        if f:
-                            hist = st.session_state.chat_session.history[:-1]
-                            hist.append({"role": "user", "parts": [f, "Context Loaded."]})
-                            hist.append({"role": "model", "parts": ["Context received."]}); 
-                            model = genai.GenerativeModel('gemini-2.0-flash', system_instruction=sys_instruction_unified)
-                            st.session_state.chat_session = model.start_chat(history=hist)
-                            st.session_state.loaded_persona = persona
-                            st.toast(f"📚 Loaded: {persona}", icon="✅")
-                            final_res = send_message_with_retry(st.session_state.chat_session, "Context loaded. Answer based on this PDF.")
-                            render_message(final_res.text, "assistant", "🤖")
-                        else:
-                            st.toast("⚠️ PDF not found. Checking Web...", icon="🌐")
-                            fallback_res = send_message_with_retry(st.session_state.chat_session, f"PDF missing. Use SEARCH_WEB for '{prompt}' instead.")
-                            if "SEARCH_WEB(" in fallback_res.text:
-                                query = fallback_res.text.split("SEARCH_WEB(")[1][:-1]
-                                res = search_indian_tax_rules(query)
-                                final = send_message_with_retry(st.session_state.chat_session, f"Search Result: {res}")
-                                render_message(final.text, "assistant", "🤖")
-
-                # --- TOOL 4: FULL CALCULATOR ---
-                elif "CALCULATE(" in text:
-                    params = text.split("CALCULATE(")[1].split(")")[0]
-                    d = {"age":30, "salary":0, "business":0, "rent":0, "hra_received":0, "inv80c":0, "med80d":0, "basic":0, "home_loan":0, "nps":0, "edu_loan":0, "donations":0, "savings_int":0, "other":0}
-                    for p in params.split(","):
-                        if "=" in p:
-                            k, v = p.split("=")
-                            vc = ''.join(filter(str.isdigit, v))
-                            if vc: d[k.strip()] = int(vc)
-                    
-                    res = calculate_tax_detailed(
-                        d['age'], d['salary'], d['business'], d['rent'], d['hra_received'],
-                        d['inv80c'], d['med80d'], d['home_loan'], d['nps'],
-                        d['edu_loan'], d['donations'], d['savings_int'], d['other'], d['basic']
-                    )
-                    tn, to = res['new']['breakdown']['total'], res['old']['breakdown']['total']
-                    winner, savings = ("New", to-tn) if tn < to else ("Old", tn-to)
-
-                    with st.chat_message("assistant", avatar="🤖"):
-                        st.subheader("📊 Tax Analysis")
-                        c1, c2, c3 = st.columns(3)
-                        c1.metric("New Regime Tax", f"₹{tn:,}")
-                        c2.metric("Old Regime Tax", f"₹{to:,}")
-                        c3.metric("Savings", f"₹{savings:,}", delta_color="normal" if winner=="New Regime" else "inverse")
-                        
-                        if winner == "New Regime":
-                            st.success(f"🏆 **Recommendation: New Regime** saves you **₹{savings:,}**")
-                        else:
-                            st.info(f"🏆 **Recommendation: Old Regime** saves you **₹{savings:,}**")
-
-                        st.markdown("### 🧾 Detailed Breakdown")
-                        
-                        other_total = (res['old']['deductions']['80e'] + res['old']['deductions']['80g'] + res['old']['deductions']['80tta'] + res['old']['deductions']['other'])
-                        table_data = {
-                            "Item": ["Gross Salary", "HRA Exemption ", "Standard Deduction", "80C (PF/LIC/PPF) ", "NPS (80CCD) ", "Home Loan Interest ", "Health Ins (80D)", "Other (Edu/Donations/Int)", "Taxable Income", "Net Tax Payable"],
-                            "New Regime": [f"₹{d['salary']:,}", "₹0", "₹75,000", "₹0", "₹0", "₹0", "₹0", "₹0", f"₹{res['new']['net']:,}", f"₹{tn:,}"],
-                            "Old Regime": [f"₹{d['salary']:,}", f"₹{res['old']['deductions']['hra']:,}", "₹50,000", f"₹{res['old']['deductions']['80c']:,}", f"₹{res['old']['deductions']['nps']:,}", f"₹{res['old']['deductions']['home_loan']:,}", f"₹{res['old']['deductions']['med80d']:,}", f"₹{other_total:,}", f"₹{res['old']['net']:,}", f"₹{to:,}"]
-                        }
-                        st.table(table_data)
-                        
-                        st.caption(f"*Calculated based on Basic: ₹{res['old']['assumptions']['basic']:,} & HRA Received: ₹{res['old']['assumptions']['hra_received']:,}*")
-
-                    st.session_state.chat_session.history.append({"role": "model", "parts": [f"Result shown: New={tn}, Old={to}"]})
-
-                    # --- THE "HELPFUL" NUDGE TRIGGER ---
-                    audit_response = send_message_with_retry(st.session_state.chat_session, "CALCULATION_DONE. Suggest optimizations (Rent, 80C, Home Loan) politely if missing, but do not force.")
-                    render_message(audit_response.text, "assistant", "🤖")
-
+                # --- CONTEXT BUDGET: drop old tool traffic / fold old turns before sending ---
+                with tracing.span("context.compact"):
+                    st.session_state.context_stats = compact_session(st.session_state.chat_session)
+
+                # --- FAST PATH: plain inputs like "Salary 15L, rent 25k" need no model call ---
+                intent = parse_intent(prompt) if st.session_state.get("mode") == "calculate" else None
+                # --- ANSWER CACHE: repeat rule questions are replayed without a model call ---
+                # (only for a chat's first question without amounts: others depend on who is asking)
+                asked_persona = st.session_state.loaded_persona
+                standalone = sum(item["role"] == "user" for item in st.session_state.transcript) == 1
+                shareable = st.session_state.get("mode") == "rules" and is_shareable_question(prompt, standalone)
+                query_vector, hit = cached_answer(prompt, asked_persona) if shareable else (None, None)
+                if intent and intent["confident"]:
+                    d = dict(CALC_DEFAULTS, **intent["fields"])
+                    st.session_state.chat_session.history.append({"role": "user", "parts": [prompt]})
+                    args = to_calculate_args(intent["fields"])
+                    apply_tool_result(dict(name="CALCULATE", args=args, raw=f"CALCULATE({args})", followup=False, **run_calculation(d, gains=st.session_state.capital_gains)))
+                    st.session_state.setdefault("round_trips", []).append(0)
+                    turn.set(path="fast_path", round_trips=0)
+                    st.caption("⚡ Parsed locally · 0 model round trips this turn")
+                elif hit:
+                    st.session_state.chat_session.history.append({"role": "user", "parts": [prompt]})
+                    st.session_state.chat_session.history.append({"role": "model", "parts": [hit["answer"]]})
+                    say(hit["answer"])
+                    st.session_state.setdefault("round_trips", []).append(0)
+                    turn.set(path="answer_cache", round_trips=0)
+                    st.caption(f"📎 Answered from cache (similarity {hit['score']:.2f}) · 0 model round trips this turn")
                 else:
-                    render_message(text, "assistant", "🤖")
-
-            except Exception as e: st.error(f"Error: {e}")
\ No newline at end of file
+                    # --- RAG: attach only the matching rule chunks in "Ask Tax Rules" mode ---
+                    model_prompt = prompt
+                    if st.session_state.get("mode") == "rules":
+                        ctx = retrieve_context(prompt, asked_persona, query_vector=query_vector)
+                        if ctx: model_prompt = f"{prompt}{RETRIEVAL_MARKER} (cite these before searching the web):\n{ctx}"
+
+                    text, shown = reply_with_knowledge(st.session_state.chat_session, model_prompt)
+                    round_trips = 1
+
+                    # --- TOOLS: run every call in the reply, send all results back in one message ---
+                    calls = TOOLS.parse(text)
+                    while calls and round_trips <= MAX_TOOL_ROUNDS:
+                        tool_ctx = {"prompt": prompt, "mode": st.session_state.get("mode"), "loaded_persona": st.session_state.loaded_persona, "index": get_knowledge_index(), "query_vector": query_vector, "gains": st.session_state.capital_gains}
+                        with tracing.span("tools", calls=len(calls)):
+                            results = TOOLS.run(calls, tool_ctx)
+                        for r in results:
+                            apply_tool_result(r)
+                        if not needs_followup(results):
+                            break
+                        text, shown = reply_with_knowledge(st.session_state.chat_session, format_tool_results(results))
+                        round_trips += 1
+                        calls = TOOLS.parse(text)
+
+                    if not shown and not calls and TOOLS.strip(text):
+                        say(TOOLS.strip(text))
+                    elif calls and round_trips > MAX_TOOL_ROUNDS:
+                        # Out of rounds with calls still pending: show what the model said (prose before its
+                        # first call line was already streamed) instead of a blank turn
+                        rest = TOOLS.strip(text[tool_call_start(text) or 0:])
+                        say((rest + "\n\n" if rest else "") + "⚠️ I couldn't complete the lookup this time. Please ask again or rephrase the question.")
+                    # Cached under the persona it was asked with; an answer built on a persona LOADed this turn isn't general
+                    if shareable and st.session_state.loaded_persona == asked_persona and query_vector is not None and not calls and is_cacheable(text):
+                        try: get_answer_cache().put(prompt, query_vector, text, asked_persona)
+                        except Exception: pass
+                    st.session_state.setdefault("round_trips", []).append(round_trips)
+                    turn.set(path="model", round_trips=round_trips, context_tokens=st.session_state.context_stats["tokens"])
+                    st.caption(f"🔁 {round_trips} model round trip{'s' if round_trips > 1 else ''} this turn · ~{st.session_state.context_stats['tokens']:,} context tokens")
+
+            except Exception as e:
+                turn.set(error=str(e)[:200])
+                st.error(f"Error: {e}")
+        save_session()
+
+    trace = tracing.end_trace(turn, export=bool(prompt))
+    if trace: st.session_state.last_trace = trace
+    if debug: render_trace_sidebar(st.session_state.get("last_trace"))
\ No newline at end of file
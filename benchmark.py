@@ -0,0 +1,441 @@
+"""
+Benchmarks and regression checks for the calculators, retrieval and chat turns.
+
+    python benchmark.py                  # golden values + micro-benchmarks, compared with the stored baseline
+    python benchmark.py --e2e            # also full chat turns through the Streamlit app (fake Gemini/DDGS)
+    python benchmark.py --save-baseline  # record this machine's numbers as the new baseline
+
+Three layers:
+
+- Golden values (`golden_tax.json`): hand-checked regime totals,
+  capital-gains ledgers (111A, 112A and its exemption, the surcharge cap,
+  and the deduction plan with slab-rate gains),
+  CALCULATE_MATH results and CALCULATE argument strings (Indian comma
+  grouping). `engine.calculate`, the vectorized `calculate_batch`,
+  `evaluate` and `parse_calculate_args` must all reproduce them exactly.
+- Micro-benchmarks: tax breakdown, single/batch calculation, expression
+  evaluation (cold and cached), intent parsing, vector search, the tool
+  dispatcher and the Gemini call layer (`send_message_with_retry`,
+  `stream_message`), each reported as throughput plus p50/p95 latency.
+- End-to-end turns: app.py runs under `streamlit.testing` in a scratch
+  directory, with `fakes.FakeGenAI` and `fakes.FakeSearchBackend` injecting
+  latency and 429s, so turn latency, model calls per turn and retry cost are
+  measured without a network or an API key.
+
+Results are compared with `benchmark_baseline.json`; a benchmark whose
+throughput drops more than --threshold (default 30%) below its baseline fails
+the run (exit code 1), as does any golden mismatch. `llm.retry_429` and the
+end-to-end turns are timed through randomized back-off sleeps, fake network
+latency and Streamlit reruns, so they are compared but reported for
+information only ("info" in the report) and never fail the run. Baselines
+are machine specific: re-record them on the machine that runs the check.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import engine
+import fakes
+import llm_client
+from intent_parser import parse_intent
+from tax_engine import compute_tax_breakdown
+from tool_calls import ToolRegistry, format_tool_results
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+GOLDEN_PATH = os.path.join(HERE, "golden_tax.json")
+BASELINE_PATH = os.path.join(HERE, "benchmark_baseline.json")
+DEFAULT_THRESHOLD = 0.30
+
+# --- 1. GOLDEN VALUES ---
+
+def check_golden(path=GOLDEN_PATH):
+    """List of mismatch messages (empty when every golden value is reproduced)."""
+    with open(path, encoding="utf-8") as f: golden = json.load(f)
+    failures, fields = [], ("base", "surcharge", "cess", "total")
+    for case in golden["tax"]:
+        res = engine.calculate(case["inputs"], fy=case["fy"], plan=False)
+        for regime in ("new", "old"):
+            got = {k: res[regime]["breakdown"][k] for k in fields}
+            if got != case[regime]: failures.append(f"calculate {case['fy']} '{case['name']}' {regime}: expected {case[regime]}, got {got}")
+    try:
+        for fy in sorted({c["fy"] for c in golden["tax"]}):
+            cases = [c for c in golden["tax"] if c["fy"] == fy]
+            for case, row in zip(cases, engine.calculate_batch([c["inputs"] for c in cases], fy)):
+                for regime in ("new", "old"):
+                    got = {k: row[f"{regime}_{k}"] for k in fields}
+                    if got != case[regime]: failures.append(f"calculate_batch {fy} '{case['name']}' {regime}: expected {case[regime]}, got {got}")
+    except ImportError as e:
+        print(f"⚠️ Skipping batch golden check ({e})", file=sys.stderr)
+    from capital_gains import compute_capital_gains
+    for case in golden.get("capital_gains", []):
+        gains = compute_capital_gains(case["ledger"], case["fy"])
+        if gains["exemption_112a_used"] != case["exemption_112a_used"]:
+            failures.append(f"capital_gains '{case['name']}': expected 112A exemption {case['exemption_112a_used']}, got {gains['exemption_112a_used']}")
+        res = engine.calculate(case["inputs"], fy=case["fy"], plan=False, gains=gains)
+        for regime in ("new", "old"):
+            got = {k: res[regime]["breakdown"][k] for k in case[regime]}
+            if got != case[regime]: failures.append(f"capital_gains '{case['name']}' {regime}: expected {case[regime]}, got {got}")
+        if "plan" in case:
+            plan = engine.calculate(case["inputs"], fy=case["fy"], gains=gains)["plan"]
+            got = {k: plan[k] for k in case["plan"]}
+            if got != case["plan"]: failures.append(f"capital_gains '{case['name']}' plan: expected {case['plan']}, got {got}")
+    for case in golden["math"]:
+        try: got = engine.evaluate(case["expression"])
+        except Exception as e: got = f"{type(e).__name__}: {e}"
+        if not isinstance(got, (int, float)) or abs(got - case["result"]) > 1e-6:
+            failures.append(f"math '{case['expression']}': expected {case['result']}, got {got}")
+    for case in golden.get("calculate_args", []):
+        got = {k: v for k, v in engine.parse_calculate_args(case["args"]).items() if v != engine.CALC_DEFAULTS[k]}
+        if got != case["inputs"]: failures.append(f"calculate_args '{case['args']}': expected {case['inputs']}, got {got}")
+    try:
+        failures += _check_compaction()
+    except ImportError as e:
+        print(f"⚠️ Skipping context compaction check ({e})", file=sys.stderr)
+    return failures
+
+def _check_compaction():
+    """Compacted chat histories must keep user and model turns alternating at any budget."""
+    from chat_context import compact_history, roles_alternate, set_calc_state, CALC_STATE_PREFIX
+    history = []
+    for i in range(12):
+        history.append({"role": "user", "parts": [f"Question {i} about HRA and 80C limits " * 5]})
+        if i % 3 == 0:
+            history.append({"role": "model", "parts": [f"Let me check. CALCULATE(salary={i}00000)"]})
+            history.append({"role": "user", "parts": ["Tool Results: " + "x " * 80]})
+            set_calc_state(history, {"turn": i})
+        history.append({"role": "model", "parts": [f"Answer {i}: " + "words " * 60]})
+    failures = []
+    for budget in (100, 400, 1200, 4000):
+        out, _ = compact_history(history, budget)
+        if not roles_alternate(out): failures.append(f"compact_history budget={budget}: roles don't alternate: {[m['role'] for m in out]}")
+        if sum(str(p).startswith(CALC_STATE_PREFIX) for m in out for p in m["parts"]) != 1:
+            failures.append(f"compact_history budget={budget}: expected exactly one CALC_STATE part")
+        again, _ = compact_history(out, budget)
+        if not roles_alternate(again): failures.append(f"compact_history budget={budget}: roles don't alternate after a second pass")
+    return failures
+
+# --- 2. MEASUREMENT ---
+
+def _percentile(samples, q):
+    s = sorted(samples)
+    return s[min(len(s) - 1, int(q * len(s)))] if s else 0.0
+
+def measure(name, fn, items=1, unit="ops/s", min_time=0.2, repeat=5, **extra):
+    """
+    Call `fn` repeatedly; throughput is the best of `repeat` rounds (`items`
+    units per call), latency percentiles over all calls. An untimed round
+    first warms caches and the CPU clock.
+    """
+    deadline = time.perf_counter() + min_time
+    while time.perf_counter() < deadline: fn()
+    best, samples = 0.0, []
+    for _ in range(repeat):
+        spent = calls = 0
+        while spent < min_time or calls < 3:
+            t = time.perf_counter(); fn(); dt = time.perf_counter() - t
+            spent += dt; calls += 1; samples.append(dt)
+        best = max(best, calls * items / spent)
+    return dict(extra, name=name, rate=best, unit=unit, p50_ms=_percentile(samples, 0.5) * 1e3, p95_ms=_percentile(samples, 0.95) * 1e3, n=len(samples))
+
+def latency_result(name, samples, **extra):
+    """Result for work that is timed externally, e.g. one chat turn per sample (throughput from the median, which is steadier)."""
+    return dict(extra, name=name, rate=1 / _percentile(samples, 0.5), unit="turns/s",
+                p50_ms=_percentile(samples, 0.5) * 1e3, p95_ms=_percentile(samples, 0.95) * 1e3, n=len(samples))
+
+class _cycle:
+    def __init__(self, items): self.items, self.i = items, 0
+    def __call__(self):
+        self.i = (self.i + 1) % len(self.items)
+        return self.items[self.i]
+
+# --- 3. MICRO-BENCHMARKS ---
+
+_INCOMES = [i * 37_500 for i in range(1, 400)]
+_INPUTS = [{"salary": 600_000 + 45_000 * i, "rent": 15_000 + 500 * (i % 40), "inv80c": 10_000 * (i % 16), "med80d": 2_500 * (i % 10), "age": 25 + i % 60}
+           for i in range(200)]
+_EXPRESSIONS = ["1.5L * 30%", "min(1,50,000, 2L) + 50000", "slab_tax(15L, 'old')", "tax(12.5L, 'new')", "hra_exemption(6L, 3L, 2.4L)",
+                "round((18L - 75000) * 0.04)", "max(0, 9.5L - 2.5L) * 5%", "old_tax(11L) - new_tax(11L)"]
+_MESSAGES = ["Salary 15L, rent 25k", "My CTC is 18 lakh, 80C 1.5L, health insurance 25000", "salary=12,00,000 hra 3L rent 20000/month",
+             "Is tuition reimbursement taxable?", "Income 2.4Cr, age 62, NPS 50k", "basic 40% salary 30L rent 50k"]
+
+def bench_calc(opts):
+    income = _cycle(_INCOMES)
+    yield measure("calc.compute_tax_breakdown", lambda: compute_tax_breakdown(income(), 30, "old"), **opts.timing)
+    inputs = _cycle(_INPUTS)
+    yield measure("calc.calculate", lambda: engine.calculate(inputs(), plan=False), **opts.timing)
+    rows = _cycle([engine.normalize_inputs(i) for i in _INPUTS])
+    yield measure("calc.run_calculation", lambda: engine.run_calculation(rows()), **opts.timing)
+    batch = [_INPUTS[i % len(_INPUTS)] for i in range(opts.batch_rows)]
+    try: engine.calculate_batch(batch[:1])  # loads NumPy
+    except ImportError: return
+    yield measure("calc.batch", lambda: engine.calculate_batch(batch), items=len(batch), unit="rows/s", **opts.timing)
+
+def bench_math(opts):
+    from expr_eval import compile_expression
+    expr = _cycle(_EXPRESSIONS)
+    def cold():
+        compile_expression.cache_clear()
+        engine.evaluate(expr())
+    yield measure("math.evaluate_cold", cold, **opts.timing)
+    yield measure("math.evaluate_cached", lambda: engine.evaluate(expr()), **opts.timing)
+    yield measure("math.safe_math_eval", lambda: engine.safe_math_eval(expr()), **opts.timing)
+
+def bench_parse(opts):
+    msg = _cycle(_MESSAGES)
+    yield measure("parse.intent", lambda: parse_intent(msg()), **opts.timing)
+
+def _synthetic_index(prefix, n, dim=768, seed=0):
+    import numpy as np
+    from retrieval import write_index
+    rng = np.random.default_rng(seed)
+    personas = ("SALARY", "BUSINESS", "CAPITAL_GAINS")
+    docs = [f"Synthetic rule chunk {i} about section {i % 300} of the Income Tax Act." for i in range(n)]
+    write_index(prefix, docs, rng.standard_normal((n, dim), dtype=np.float32),
+                [{"source": "synthetic.pdf", "page": i // 10 + 1, "persona": personas[i % 3]} for i in range(n)])
+
+def bench_retrieval(opts):
+    try: import numpy as np
+    except ImportError: return
+    from retrieval import VectorIndex
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as tmp:  # Windows keeps the memory-mapped file open
+        prefix = os.path.join(tmp, "index")
+        _synthetic_index(prefix, opts.index_size)
+        index = VectorIndex(prefix)
+        queries = _cycle(list(np.random.default_rng(1).standard_normal((64, 768), dtype=np.float32)))
+        yield measure("retrieval.search", lambda: index.search(queries(), k=4), index_size=len(index), **opts.timing)
+        yield measure("retrieval.search_persona", lambda: index.search(queries(), k=4, persona="SALARY"), index_size=len(index), **opts.timing)
+
+def _unthrottled(fn):
+    """Run `fn` with the shared Gemini rate limiter opened up, so benchmarks measure the client, not the quota."""
+    saved = llm_client.request_bucket, llm_client.token_bucket
+    llm_client.request_bucket = llm_client.TokenBucket(1e12, 1e12)
+    llm_client.token_bucket = llm_client.TokenBucket(1e15, 1e15)
+    try: return fn()
+    finally: llm_client.request_bucket, llm_client.token_bucket = saved
+
+def bench_tools(opts):
+    import web_search
+    from web_search import SearchCache, search_indian_tax_rules
+    web_search.set_search_backend(fakes.FakeSearchBackend())
+    web_search.set_search_cache(SearchCache(":memory:"))
+    registry = ToolRegistry()
+    registry.register("CALCULATE", lambda a, ctx: engine.run_calculation(engine.parse_calculate_args(a)), followup=False)
+    registry.register("CALCULATE_MATH", lambda a, ctx: {"output": f"Math Result: {engine.safe_math_eval(a)}", "data": a})
+    registry.register("SEARCH_WEB", lambda a, ctx: {"output": search_indian_tax_rules(a), "data": a})
+    reply = ("Let me check both.\nSEARCH_WEB(tuition reimbursement taxable India Income Tax)\n"
+             "CALCULATE_MATH(min(1,50,000, 2L) * 30%)\nCALCULATE(salary=1500000, rent=25000, inv80c=50000)")
+    yield measure("tools.parse_run", lambda: format_tool_results(registry.run(registry.parse(reply))), **opts.timing)
+
+    genai = fakes.FakeGenAI()
+    chat = genai.GenerativeModel("gemini-2.0-flash").start_chat([])
+    def send():
+        llm_client.send_message_with_retry(chat, "Is tuition reimbursement taxable?")
+        del chat.history[:]
+    def stream():
+        "".join(llm_client.stream_message(chat, "Is tuition reimbursement taxable?"))
+        del chat.history[:]
+    yield _unthrottled(lambda: measure("llm.send_message_with_retry", send, **opts.timing))
+    yield _unthrottled(lambda: measure("llm.stream_message", stream, **opts.timing))
+
+    # 429 handling: the cost is the backoff sleeps, scaled down by --retry-base (no server hint, so no fixed floor)
+    flaky = fakes.FakeGenAI(rate_limit_rate=opts.rate_limit_rate, retry_hint=None, seed=opts.seed)
+    chat = flaky.GenerativeModel("gemini-2.0-flash").start_chat([])
+    def retried():
+        try: llm_client.send_message_with_retry(chat, "Is tuition reimbursement taxable?")
+        except llm_client.RateLimitError: pass
+        del chat.history[:]
+    with _retry_scale(opts):
+        result = _unthrottled(lambda: measure("llm.retry_429", retried, min_time=opts.timing["min_time"], repeat=1))
+    yield dict(result, rate_limited=flaky.rate_limited, model_calls=flaky.calls, informational=True)  # real jittered sleeps
+
+class _retry_scale:
+    """Scale llm_client's backoff so 429 scenarios finish in seconds, with a seeded jitter."""
+    def __init__(self, opts): self.opts = opts
+    def __enter__(self):
+        self.saved = llm_client.BASE_DELAY, llm_client.MAX_DELAY
+        llm_client.BASE_DELAY, llm_client.MAX_DELAY = self.opts.retry_base, self.opts.retry_base * 30
+        llm_client._cooldown_until = 0.0
+        random.seed(self.opts.seed)
+    def __exit__(self, *exc):
+        llm_client.BASE_DELAY, llm_client.MAX_DELAY = self.saved
+        llm_client._cooldown_until = 0.0
+
+SUITES = {"calc": bench_calc, "math": bench_math, "parse": bench_parse, "retrieval": bench_retrieval, "tools": bench_tools}
+
+# --- 4. END-TO-END CHAT TURNS ---
+
+_TOPICS = ["tuition reimbursement", "leave encashment", "gratuity", "meal coupons", "notice period recovery", "ESOP allotment",
+           "relocation allowance", "gift vouchers", "club membership", "company car", "mobile bill reimbursement", "LTA",
+           "interest free loan", "children education allowance", "uniform allowance", "retrenchment compensation",
+           "VRS payout", "pension commutation", "sweat equity", "professional tax", "bonus arrears", "internet allowance"]
+
+def _scratch_dir(index_size):
+    """Temp working directory with the persona PDFs and a small stub-embedded index, so caches never touch the real ones."""
+    from embeddings import StubEmbedder
+    from retrieval import PERSONA_FILES, write_index
+    tmp = tempfile.mkdtemp(prefix="taxguide-bench-")
+    for name in PERSONA_FILES.values():
+        if os.path.exists(os.path.join(HERE, name)): shutil.copy(os.path.join(HERE, name), tmp)
+    docs, meta = [], []
+    for i in range(index_size):
+        topic, persona = _TOPICS[i % len(_TOPICS)], ("SALARY", "BUSINESS", "CAPITAL_GAINS")[i % 3]
+        docs.append(f"{topic.title()}: treatment under the Income Tax Act, section {10 + i % 90}, for {persona.lower()} taxpayers (chunk {i}).")
+        meta.append({"source": "salary_rules.pdf", "page": i // 5 + 1, "persona": persona})
+    write_index(os.path.join(tmp, "knowledge_index"), docs, StubEmbedder().embed(docs), meta)
+    return tmp
+
+def _scenarios(turns):
+    """(name, start button, prompts, new chat per turn); the answer cache only serves a chat's first question."""
+    turns = max(2, turns)
+    return [
+        ("e2e.calc_fast_path", 0, [f"Salary {10 + i}L, rent {20 + i}k" for i in range(turns)], False),
+        ("e2e.calc_model", 0, [f"I earn about {10 + i} lakh a year, how much tax do I pay?" for i in range(turns)], False),
+        ("e2e.rules_tools", 1, [f"Is {_TOPICS[i % len(_TOPICS)]} taxable for salaried employees?" for i in range(turns)], False),
+        ("e2e.rules_cached", 1, [f"Is {_TOPICS[0]} taxable for salaried employees?"] * turns, True),
+        ("e2e.rules_429", 1, [f"How is {_TOPICS[i % len(_TOPICS)]} treated in the ITR for a new joiner?" for i in range(turns)], False),
+    ]
+
+def _start_chat(button):
+    from streamlit.testing.v1 import AppTest
+    at = _unthrottled(lambda: AppTest.from_file(os.path.join(HERE, "app.py"), default_timeout=60).run())
+    at.button[1 + button].click()
+    _unthrottled(at.run)
+    return at
+
+def bench_e2e(opts):
+    """Time full app turns (script rerun, tool calls, rendering) with fake backends. Needs streamlit."""
+    try: import streamlit.testing.v1  # noqa: F401  (AppTest, used by _start_chat)
+    except ImportError as e:
+        print(f"⚠️ Skipping end-to-end benchmarks ({e})", file=sys.stderr)
+        return
+    genai = fakes.install_fake_genai(latency=opts.model_latency, chunk_latency=opts.chunk_latency, retry_hint=None, seed=opts.seed)
+    search = fakes.FakeSearchBackend(latency=opts.search_latency, seed=opts.seed)
+    import web_search
+    web_search.set_search_backend(search)
+    os.environ.setdefault("GEMINI_API_KEY", "offline-benchmark")
+    os.environ["TAXGUIDE_EMBEDDER"] = "stub"
+    cwd, tmp = os.getcwd(), _scratch_dir(opts.e2e_index_size)
+    os.chdir(tmp)
+    if HERE not in sys.path: sys.path.insert(0, HERE)
+    try:
+        with _retry_scale(opts):
+            for name, button, prompts, fresh in _scenarios(opts.turns):
+                if name == "e2e.rules_429": genai.faults.rate_limit_rate = search.faults.rate_limit_rate = opts.rate_limit_rate
+                at = _start_chat(button)
+                samples = []
+                for i, prompt in enumerate(prompts):
+                    if fresh and i: at = _start_chat(button)  # untimed
+                    if i == 1: calls, limited, searches, search_limited = genai.calls, genai.rate_limited, search.calls, search.rate_limited  # turn 0 warms caches, untimed
+                    at.chat_input[0].set_value(prompt)
+                    t = time.perf_counter(); _unthrottled(at.run); dt = time.perf_counter() - t
+                    if i: samples.append(dt)
+                    if at.exception or at.error:
+                        raise RuntimeError(f"{name}: turn '{prompt}' failed: {[e.value for e in at.exception] or [e.value for e in at.error]}")
+                genai.faults.rate_limit_rate = search.faults.rate_limit_rate = 0.0
+                yield latency_result(name, samples, model_calls_per_turn=round((genai.calls - calls) / len(samples), 2),
+                                     rate_limited=genai.rate_limited - limited, searches=search.calls - searches,
+                                     search_rate_limited=search.rate_limited - search_limited, informational=True)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp, ignore_errors=True)
+
+# --- 5. BASELINES & REPORT ---
+
+def machine():
+    return {"python": platform.python_version(), "platform": platform.platform(terse=True), "processor": platform.machine(), "cpus": os.cpu_count()}
+
+def load_baseline(path=BASELINE_PATH):
+    try:
+        with open(path, encoding="utf-8") as f: return json.load(f)
+    except (OSError, ValueError): return None
+
+def save_baseline(results, path=BASELINE_PATH, previous=None):
+    merged = dict((previous or {}).get("results", {}))  # keep entries for suites not run this time
+    merged.update({r["name"]: {"rate": round(r["rate"], 2), "unit": r["unit"]} for r in results})
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"machine": machine(), "recorded": time.strftime("%Y-%m-%d"), "results": dict(sorted(merged.items()))}, f, indent=2)
+        f.write("\n")
+
+def compare(results, baseline, threshold):
+    """Annotate results with their ratio to the baseline; returns the names that regressed past `threshold`."""
+    regressions, known = [], (baseline or {}).get("results", {})
+    for r in results:
+        base = known.get(r["name"])
+        if not base or not base.get("rate"): continue
+        r["vs_baseline"] = r["rate"] / base["rate"]
+        if r["vs_baseline"] < 1 - threshold and not r.get("informational"): regressions.append(r["name"])
+    return regressions
+
+def _rate(v):
+    return f"{v:,.0f}" if v >= 100 else f"{v:,.2f}"
+
+def format_report(results):
+    lines = [f"{'benchmark':<30} {'throughput':>16} {'p50 ms':>9} {'p95 ms':>9} {'vs base':>8}"]
+    for r in results:
+        ratio = f"{r['vs_baseline']:.2f}x" if "vs_baseline" in r else "-"
+        if r.get("informational"): ratio = f"{ratio} info"
+        lines.append(f"{r['name']:<30} {_rate(r['rate']):>9} {r['unit']:<6} {r['p50_ms']:>9.3f} {r['p95_ms']:>9.3f} {ratio:>8}")
+        notes = {k: v for k, v in r.items() if k not in ("name", "rate", "unit", "p50_ms", "p95_ms", "n", "vs_baseline", "informational")}
+        if notes: lines.append(" " * 4 + ", ".join(f"{k}={v}" for k, v in notes.items()))
+    return "\n".join(lines)
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="TaxGuide benchmarks: golden values, micro-benchmarks and end-to-end chat turns.")
+    p.add_argument("--only", help=f"Comma-separated suites ({', '.join(SUITES)}, e2e); default: all micro suites")
+    p.add_argument("--e2e", action="store_true", help="Also run end-to-end chat turns (needs streamlit)")
+    p.add_argument("--check", action="store_true", help="Only verify the golden values")
+    p.add_argument("--golden", default=GOLDEN_PATH)
+    p.add_argument("--baseline", default=BASELINE_PATH)
+    p.add_argument("--save-baseline", action="store_true", help="Write this run's throughput as the new baseline")
+    p.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Allowed throughput drop vs baseline (default: 0.30)")
+    p.add_argument("--quick", action="store_true", help="Fewer, shorter rounds (noisier)")
+    p.add_argument("--json", help="Also write the results to this file")
+    p.add_argument("--batch-rows", type=int, default=20_000)
+    p.add_argument("--index-size", type=int, default=20_000, help="Chunks in the synthetic retrieval index")
+    p.add_argument("--turns", type=int, default=12, help="Chat turns per end-to-end scenario (the first is an untimed warm-up)")
+    p.add_argument("--model-latency", type=float, default=0.05, help="Fake Gemini time to first token (s)")
+    p.add_argument("--chunk-latency", type=float, default=0.002, help="Fake Gemini delay between streamed chunks (s)")
+    p.add_argument("--search-latency", type=float, default=0.05, help="Fake DDGS latency per query (s)")
+    p.add_argument("--rate-limit-rate", type=float, default=0.3, help="Share of calls answered with a 429 in the rate-limit scenarios")
+    p.add_argument("--retry-base", type=float, default=0.02, help="Backoff base delay (s) while benchmarking; production uses llm_client.BASE_DELAY")
+    p.add_argument("--seed", type=int, default=0)
+    opts = p.parse_args(argv)
+    opts.timing = {"min_time": 0.05, "repeat": 2} if opts.quick else {"min_time": 0.2, "repeat": 5}
+    opts.e2e_index_size = 300
+
+    failures = check_golden(opts.golden)
+    for f in failures: print(f"❌ {f}", file=sys.stderr)
+    if not failures: print("✅ Golden values match", file=sys.stderr)
+    if opts.check: return 1 if failures else 0
+
+    suites = opts.only.split(",") if opts.only else list(SUITES) + (["e2e"] if opts.e2e else [])
+    runners = dict(SUITES, e2e=bench_e2e)
+    unknown = [s for s in suites if s not in runners]
+    if unknown: p.error(f"Unknown suite(s): {', '.join(unknown)}")
+    results = []
+    for suite in suites:
+        for r in runners[suite](opts):
+            results.append(r)
+            print(f"  {r['name']}: {_rate(r['rate'])} {r['unit']}", file=sys.stderr)
+
+    baseline = load_baseline(opts.baseline)
+    regressions = [] if opts.save_baseline else compare(results, baseline, opts.threshold)
+    print(format_report(results))
+    if opts.json:
+        with open(opts.json, "w", encoding="utf-8") as f: json.dump({"machine": machine(), "results": results}, f, indent=2)
+    if opts.save_baseline:
+        save_baseline(results, opts.baseline, baseline)
+        print(f"💾 Baseline written to {opts.baseline}", file=sys.stderr)
+    elif baseline and baseline.get("machine") != machine():
+        print(f"⚠️ Baseline was recorded on {baseline.get('machine')}; numbers may not be comparable", file=sys.stderr)
+    for name in regressions: print(f"❌ {name} regressed more than {opts.threshold:.0%} against the baseline", file=sys.stderr)
+    return 1 if failures or regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
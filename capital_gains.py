@@ -0,0 +1,299 @@
+"""
+Deterministic capital-gains engine for broker trade ledgers.
+
+A ledger (CSV with date, symbol, buy/sell, quantity, price and optionally
+charges and asset type) is streamed row by row. Buys are pushed onto a
+per-security FIFO queue kept in typed arrays; sells consume the oldest lots.
+Each matched piece is classified by holding period and asset type:
+
+- listed equity / equity MFs: <= 12 months -> STCG u/s 111A, else LTCG u/s 112A
+- debt MFs (Section 50AA): always short term, taxed at slab rates
+- other assets: <= 24 months -> STCG at slab rates, else LTCG u/s 112
+- same-day buy and sell (intraday) -> speculative income at slab rates
+
+Only running totals and currently open lots are held, so memory depends on
+open positions, not on ledger length. After the year, losses are set off
+(long-term losses only against long-term gains), the 112A exemption is applied
+and `tax_with_gains` folds the result into each regime's tax.
+
+Not modelled: grandfathering of pre-2018 equity, indexation, F&O, and loss
+carry-forward from earlier years (losses left over are reported).
+
+    python capital_gains.py tradebook.csv --fy 2025-26 --inputs "salary=15L"
+"""
+import argparse
+import csv
+import datetime
+import json
+import re
+import sys
+from array import array
+from bisect import bisect_right
+from functools import lru_cache
+
+from tax_rules import DEFAULT_FY, get_capital_gains_rules, get_rule_table, slab_tax, apply_rebate, surcharge_rate
+
+EPS = 1e-9
+
+# Header synonyms seen in Indian broker exports (normalized to lower_snake)
+COLUMNS = {
+    "date": ["trade_date", "date", "execution_date", "transaction_date", "order_execution_time"],
+    "symbol": ["symbol", "tradingsymbol", "scrip", "scrip_name", "isin", "instrument", "security", "stock"],
+    "side": ["side", "trade_type", "buy_sell", "transaction_type", "type", "action"],
+    "qty": ["quantity", "qty", "units"],
+    "price": ["price", "trade_price", "rate", "avg_price", "nav"],
+    "value": ["amount", "value", "trade_value", "net_amount"],
+    "charges": ["charges", "total_charges", "brokerage", "fees"],
+    "asset_type": ["asset_type", "asset_class", "segment", "category"],
+}
+SIDES = {"buy": "buy", "b": "buy", "purchase": "buy", "sell": "sell", "s": "sell", "sale": "sell", "redemption": "sell", "redeem": "sell"}
+ASSET_TYPES = {
+    "equity": "equity", "eq": "equity", "stock": "equity", "shares": "equity", "etf": "equity", "equity_mf": "equity", "equity_fund": "equity",
+    "debt": "debt", "debt_mf": "debt", "debt_fund": "debt", "liquid": "debt", "bond_fund": "debt",
+    "other": "other", "gold": "other", "unlisted": "other", "bond": "other", "property": "other", "reit": "other", "invit": "other",
+}
+KINDS = ("stcg_slab", "stcg_111a", "ltcg_112a", "ltcg_112", "intraday")
+_DATE_FORMATS = ("%Y-%m-%d", "%d-%m-%Y", "%d/%m/%Y", "%d-%b-%Y", "%d %b %Y", "%Y/%m/%d", "%d-%m-%y", "%d/%m/%y")
+
+def _norm(name):
+    return re.sub(r"[^a-z0-9]+", "_", name.strip().lower()).strip("_")
+
+# --- 1. PARSING HELPERS ---
+
+@lru_cache(maxsize=8192)
+def parse_day(text):
+    """Date string -> proleptic ordinal. Accepts ISO, DD-MM-YYYY, DD/MM/YYYY, DD-Mon-YYYY (time suffix ignored)."""
+    text = text.strip()
+    for candidate in dict.fromkeys((text, text.split("T")[0], text.split(" ")[0])):
+        for fmt in _DATE_FORMATS:
+            try: return datetime.datetime.strptime(candidate, fmt).toordinal()
+            except ValueError: pass
+    raise ValueError(f"Unrecognised date '{text}'")
+
+@lru_cache(maxsize=8192)
+def long_term_after(day, months):
+    """Last day a lot bought on `day` is still short term ('not more than N months')."""
+    d = datetime.date.fromordinal(day)
+    y, m = divmod(d.month - 1 + months, 12)
+    y, m = d.year + y, m + 1
+    for dd in (d.day, 30, 29, 28):
+        try: return datetime.date(y, m, dd).toordinal()
+        except ValueError: pass
+
+def fy_bounds(fy):
+    start = int(fy[:4])
+    return datetime.date(start, 4, 1).toordinal(), datetime.date(start + 1, 3, 31).toordinal()
+
+def _float(v):
+    return float(v.replace(",", "").strip()) if v and v.strip() else 0.0
+
+# --- 2. FIFO LOT QUEUES ---
+
+class LotQueue:
+    """Open buy lots for one security, oldest first, in parallel typed arrays with a moving head."""
+    __slots__ = ("qty", "cost", "day", "head")
+
+    def __init__(self):
+        self.qty, self.cost, self.day, self.head = array("d"), array("d"), array("l"), 0
+
+    def push(self, qty, unit_cost, day):
+        self.qty.append(qty); self.cost.append(unit_cost); self.day.append(day)
+
+    def take(self, qty):
+        """Consume `qty` units FIFO; returns ([(units, unit_cost, buy_day), ...], units still unmatched)."""
+        pieces, head, n = [], self.head, len(self.qty)
+        while qty > EPS and head < n:
+            units = min(qty, self.qty[head])
+            pieces.append((units, self.cost[head], self.day[head]))
+            self.qty[head] -= units; qty -= units
+            if self.qty[head] <= EPS: head += 1
+        self.head = head
+        if head > 64 and head * 2 > n:  # drop consumed lots so the arrays only hold open positions
+            del self.qty[:head]; del self.cost[:head]; del self.day[:head]
+            self.head = 0
+        return pieces, max(0.0, qty)
+
+    def __len__(self):
+        return len(self.qty) - self.head
+
+# --- 3. STREAMING ENGINE ---
+
+class CapitalGainsEngine:
+    def __init__(self, fy=DEFAULT_FY, default_asset="equity", on_match=None):
+        self.fy, self.rules = fy, get_capital_gains_rules(fy)
+        self.start, self.end = fy_bounds(fy)
+        self.default_asset = ASSET_TYPES[_norm(default_asset)]
+        self.on_match = on_match  # optional callback(dict) per matched lot, e.g. to write a realized-gains report
+        self._rate_days = [parse_day(d) for d, _ in self.rules["rates"]]
+        self.queues = {}
+        self.net = {}        # {(kind, rate): net gain} for sales inside the FY
+        self.unmatched = {}  # {symbol: units sold without a matching buy}
+        self.last_day = {}
+        self.rows = self.sales = 0
+
+    def _rates(self, day):
+        return self.rules["rates"][max(0, bisect_right(self._rate_days, day) - 1)][1]
+
+    def feed(self, symbol, side, qty, price, day, charges=0.0, asset=None):
+        self.rows += 1
+        if qty <= 0: return
+        if day < self.last_day.get(symbol, day):
+            raise ValueError(f"Ledger is not in date order for {symbol}; sort it by trade date first")
+        self.last_day[symbol] = day
+        queue = self.queues.get(symbol)
+        if queue is None: queue = self.queues[symbol] = LotQueue()
+        if side == "buy":
+            queue.push(qty, price + charges / qty, day)
+            return
+        proceeds = price - charges / qty
+        pieces, left = queue.take(qty)
+        if left > EPS: self.unmatched[symbol] = self.unmatched.get(symbol, 0.0) + left
+        if not self.start <= day <= self.end: return
+        self.sales += 1
+        asset = asset or self.default_asset
+        rates = self._rates(day)
+        for units, unit_cost, buy_day in pieces:
+            if buy_day == day: kind, rate = "intraday", None
+            elif asset == "debt": kind, rate = "stcg_slab", None
+            elif asset == "equity":
+                if day > long_term_after(buy_day, self.rules["equity_months"]): kind = "ltcg_112a"
+                else: kind = "stcg_111a"
+                rate = rates[kind]
+            elif day > long_term_after(buy_day, self.rules["other_months"]): kind, rate = "ltcg_112", rates["ltcg_112"]
+            else: kind, rate = "stcg_slab", None
+            gain = units * (proceeds - unit_cost)
+            self.net[(kind, rate)] = self.net.get((kind, rate), 0.0) + gain
+            if self.on_match:
+                self.on_match({"symbol": symbol, "units": units, "buy_date": datetime.date.fromordinal(buy_day).isoformat(),
+                               "sell_date": datetime.date.fromordinal(day).isoformat(), "cost": units * unit_cost,
+                               "proceeds": units * proceeds, "gain": gain, "kind": kind})
+
+    def summary(self):
+        return summarize(self.net, self.rules, fy=self.fy, rows=self.rows, sales=self.sales,
+                         unmatched=self.unmatched, open_lots=sum(len(q) for q in self.queues.values()))
+
+def summarize(net, rules, **extra):
+    """Set off losses, apply the 112A exemption and split gains into slab-rate income and special-rate items."""
+    pool = {k: v for k, v in net.items() if v > 0}
+    st_loss = -sum(v for (k, _), v in net.items() if v < 0 and k in ("stcg_slab", "stcg_111a"))
+    lt_loss = -sum(v for (k, _), v in net.items() if v < 0 and k in ("ltcg_112a", "ltcg_112"))
+    spec_loss = -sum(v for (k, _), v in net.items() if v < 0 and k == "intraday")  # only speculative gains can absorb it
+
+    def absorb(loss, kinds):
+        # Highest-taxed gains first; slab-rate gains count as the highest
+        for key in sorted((k for k in pool if k[0] in kinds), key=lambda k: -(k[1] if k[1] is not None else 1.0)):
+            used = min(loss, pool[key]); pool[key] -= used; loss -= used
+        return loss
+
+    lt_loss = absorb(lt_loss, ("ltcg_112", "ltcg_112a"))
+    st_loss = absorb(st_loss, ("stcg_slab", "stcg_111a", "ltcg_112", "ltcg_112a"))
+
+    exemption = rules["exemption_112a"]
+    for key in sorted((k for k in pool if k[0] == "ltcg_112a"), key=lambda k: -k[1]):
+        used = min(exemption, pool[key]); pool[key] -= used; exemption -= used
+
+    by_kind = {k: 0.0 for k in KINDS}
+    for (kind, _), v in net.items(): by_kind[kind] += v
+    special = [{"kind": k, "rate": r, "amount": round(v)} for (k, r), v in sorted(pool.items(), key=lambda i: (i[0][0], -(i[0][1] or 0))) if r is not None and v > 0.5]
+    return dict(extra,
+        by_kind={k: round(v) for k, v in by_kind.items()},
+        slab_income=round(sum(v for (k, r), v in pool.items() if r is None)),
+        special=special,
+        exemption_112a_used=round(rules["exemption_112a"] - exemption),
+        carry_forward={"short_term": round(st_loss), "long_term": round(lt_loss), "speculative": round(spec_loss)},
+        special_surcharge_cap=rules["special_surcharge_cap"])
+
+# --- 4. LEDGER STREAMING ---
+
+def iter_ledger(lines):
+    """Yield (symbol, side, qty, price, day, charges, asset) from CSV lines (any iterable of strings)."""
+    reader = csv.reader(lines)
+    header = [_norm(h) for h in next(reader)]
+    idx = {}
+    for field, names in COLUMNS.items():
+        idx[field] = next((header.index(n) for n in names if n in header), None)
+    missing = [f for f in ("date", "symbol", "side", "qty") if idx[f] is None]
+    if missing or (idx["price"] is None and idx["value"] is None):
+        raise ValueError(f"Ledger needs columns for {', '.join(missing or ['price'])}; found: {', '.join(header)}")
+    i_date, i_sym, i_side, i_qty, i_price, i_value, i_chg, i_asset = (idx[k] for k in ("date", "symbol", "side", "qty", "price", "value", "charges", "asset_type"))
+    for row in reader:
+        if not row or not row[i_date].strip(): continue
+        side = SIDES.get(row[i_side].strip().lower())
+        if side is None: raise ValueError(f"Unknown trade side '{row[i_side]}'")
+        qty = abs(_float(row[i_qty]))
+        price = _float(row[i_price]) if i_price is not None else (abs(_float(row[i_value])) / qty if qty else 0.0)
+        asset = ASSET_TYPES.get(_norm(row[i_asset])) if i_asset is not None and row[i_asset].strip() else None
+        yield (row[i_sym].strip().upper(), side, qty, price, parse_day(row[i_date]),
+               abs(_float(row[i_chg])) if i_chg is not None else 0.0, asset)
+
+def compute_capital_gains(lines, fy=DEFAULT_FY, default_asset="equity", on_match=None):
+    """Stream a ledger (open file or iterable of CSV lines) and return the year's capital gains summary."""
+    engine = CapitalGainsEngine(fy, default_asset, on_match)
+    for trade in iter_ledger(lines):
+        engine.feed(*trade)
+    return engine.summary()
+
+# --- 5. TAX WITH GAINS ---
+
+def tax_with_gains(net_income, gains, age, regime, fy=DEFAULT_FY):
+    """
+    Breakdown for one regime with capital gains folded in. Slab-rate gains add
+    to normal income; special-rate gains first absorb any unused basic
+    exemption (highest rate first), then pay their own rate. The 87A rebate is
+    tested on total income but only reduces slab tax, and surcharge on
+    special-rate tax is capped at 15%.
+    """
+    table = get_rule_table(fy, regime, age)
+    normal = net_income + gains["slab_income"]
+    special = sorted(gains["special"], key=lambda s: -s["rate"])
+    total_income = normal + sum(s["amount"] for s in special)
+
+    shortfall = max(0, table["thresholds"][1] - normal) if len(table["thresholds"]) > 1 else 0
+    special_tax = 0.0
+    for s in special:
+        used = min(shortfall, s["amount"]); shortfall -= used
+        special_tax += (s["amount"] - used) * s["rate"]
+
+    normal_tax = apply_rebate(table, total_income, slab_tax(table, normal))
+    rate = surcharge_rate(table, total_income)
+    surcharge = normal_tax * rate + special_tax * min(rate, gains["special_surcharge_cap"])
+    tax = normal_tax + special_tax
+    cess = (tax + surcharge) * table["cess"]
+    return {"base": int(tax), "surcharge": int(surcharge), "cess": int(cess), "total": int(tax + surcharge + cess),
+            "capital_gains_tax": int(special_tax)}
+
+def calculate_with_gains(res, gains, age, fy=DEFAULT_FY):
+    """`calculate_tax_detailed` result with each regime's breakdown recomputed to include `gains`."""
+    out = {regime: dict(res[regime], breakdown=tax_with_gains(res[regime]["net"], gains, age, regime, fy)) for regime in ("new", "old")}
+    out["capital_gains"] = gains
+    return out
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="FIFO capital gains from a broker trade ledger (CSV), with regime comparison.")
+    p.add_argument("ledger", help="CSV with date, symbol, side (buy/sell), quantity, price [, charges, asset_type]")
+    p.add_argument("--fy", default=DEFAULT_FY, help=f"Financial year (default: {DEFAULT_FY})")
+    p.add_argument("--asset-type", default="equity", choices=["equity", "debt", "other"], help="Asset type when the ledger has no such column")
+    p.add_argument("--inputs", default="", help='Other income/deductions in CALCULATE form, e.g. "salary=15L, inv80c=1.5L"')
+    p.add_argument("--realized", help="Write every matched lot to this CSV")
+    args = p.parse_args(argv)
+
+    report = writer = None
+    if args.realized:
+        report = open(args.realized, "w", newline="", encoding="utf-8")
+        writer = csv.DictWriter(report, ["symbol", "units", "buy_date", "sell_date", "cost", "proceeds", "gain", "kind"])
+        writer.writeheader()
+    try:
+        with open(args.ledger, newline="", encoding="utf-8-sig") as f:
+            gains = compute_capital_gains(f, args.fy, args.asset_type, writer.writerow if writer else None)
+    finally:
+        if report: report.close()
+    out = {"capital_gains": gains}
+    if args.inputs:
+        from engine import calculate, parse_calculate_args
+        result = calculate(parse_calculate_args(args.inputs), fy=args.fy, plan=False, gains=gains)
+        out["tax"] = {r: result[r]["breakdown"] for r in ("new", "old")}
+    json.dump(out, sys.stdout, indent=2)
+    print()
+
+if __name__ == "__main__":
+    main()
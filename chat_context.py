@@ -0,0 +1,160 @@
+"""
+Bounded model context for a chat session.
+
+The model-facing history is kept separate from what the UI shows, so it can be
+compacted freely:
+- every message gets a token estimate (`message_tokens`),
+- tool traffic (tool calls, "Tool Results:", search/math results, retrieval
+  excerpts) older than the recent window is dropped or stripped first,
+- if the history is still over budget, the oldest turns are folded into a
+  one-line summary of what the user asked,
+- calculator state lives in a single structured CALC_STATE record that is
+  replaced, not appended, on every calculation,
+- neighbouring turns left with the same role are merged, so user and model
+  turns still alternate.
+Uploaded PDF parts are pinned and never dropped.
+"""
+import json
+import os
+
+from llm_client import estimate_tokens
+from retrieval import RETRIEVAL_MARKER
+
+CONTEXT_BUDGET = int(os.getenv("TAXGUIDE_CONTEXT_TOKENS", "8000"))
+KEEP_RECENT = 6                 # messages always kept verbatim (about three exchanges)
+FILE_PART_TOKENS = 2000         # rough cost of an attached PDF
+CALC_STATE_PREFIX = "CALC_STATE: "
+SUMMARY_PREFIX = "Earlier in this chat (summary): "
+
+_TOOL_PREFIXES = ("Tool Results:", "Search Result:", "Math Result:", "Result shown:", "Optimization Plan:", "CALCULATION_DONE", "PDF missing.")
+_TOOL_CALLS = ("CALCULATE(", "CALCULATE_MATH(", "SEARCH_WEB(", "LOAD(")
+
+# --- 1. MESSAGE HELPERS ---
+
+def _role_parts(msg):
+    if isinstance(msg, dict): return msg.get("role"), list(msg.get("parts", []))
+    return msg.role, list(msg.parts)
+
+def _part_text(part):
+    if isinstance(part, str): return part
+    if isinstance(part, dict): return part.get("text")
+    text = getattr(part, "text", None)
+    return text if text else None
+
+def message_text(msg):
+    _, parts = _role_parts(msg)
+    return "\n".join(t for t in (_part_text(p) for p in parts) if t)
+
+def has_file(msg):
+    _, parts = _role_parts(msg)
+    return any(_part_text(p) is None for p in parts)
+
+def _tagged(part, prefix):
+    return (_part_text(part) or "").startswith(prefix)
+
+def message_tokens(msg):
+    _, parts = _role_parts(msg)
+    return sum(estimate_tokens(t) if t is not None else FILE_PART_TOKENS for t in (_part_text(p) for p in parts))
+
+def context_tokens(history):
+    return sum(message_tokens(m) for m in history)
+
+def is_tool_traffic(msg):
+    text = message_text(msg).strip()
+    if not text or has_file(msg): return False
+    if text.startswith(_TOOL_PREFIXES): return True
+    role, _ = _role_parts(msg)
+    # A model turn that is nothing but tool calls
+    return role == "model" and text.startswith(_TOOL_CALLS) and all(l.strip().startswith(_TOOL_CALLS) for l in text.splitlines() if l.strip())
+
+# --- 2. CALCULATOR STATE ---
+
+def calc_state_record(d, res, plan):
+    """Compact structured summary of the latest calculation for the model."""
+    record = {
+        "inputs": {k: v for k, v in d.items() if v and not (k == "age" and v == 30)},
+        "tax": {"new": res["new"]["breakdown"]["total"], "old": res["old"]["breakdown"]["total"]},
+        "taxable": {"new": res["new"]["net"], "old": res["old"]["net"]},
+        "plan": {"best_regime": plan["best_regime"], "extra_investment": plan["invest"],
+                 "allocation": {k: v for k, v in plan["allocation"].items() if v},
+                 "old_after_plan": plan["optimized"]["old"],
+                 "breakeven_extra_deductions": plan["breakeven"]["extra_deductions_needed"], "breakeven_reachable": plan["breakeven"]["reachable"]},
+    }
+    if "capital_gains" in res:
+        record["capital_gains"] = {"by_kind": res["capital_gains"]["by_kind"], "special_rate_tax": {r: res[r]["breakdown"]["capital_gains_tax"] for r in ("new", "old")}}
+    return record
+
+def set_calc_state(history, record):
+    """Replace any previous CALC_STATE part with `record` (appended as a model turn)."""
+    out = []
+    for role, parts in map(_role_parts, history):
+        rest = [p for p in parts if not _tagged(p, CALC_STATE_PREFIX)]
+        if len(rest) == len(parts): out.append({"role": role, "parts": parts})
+        elif rest: out.append({"role": role, "parts": rest})
+    history[:] = out
+    history.append({"role": "model", "parts": [CALC_STATE_PREFIX + json.dumps(record, separators=(",", ":"))]})
+
+# --- 3. COMPACTION ---
+
+def roles_alternate(history):
+    """True if no two neighbouring turns share a role (the API rejects such a history)."""
+    roles = [_role_parts(m)[0] for m in history]
+    return all(a != b for a, b in zip(roles, roles[1:]))
+
+def _merge_same_role(msgs):
+    out = []
+    for m in msgs:
+        if out and out[-1]["role"] == m["role"]:
+            out[-1] = {"role": m["role"], "parts": out[-1]["parts"] + m["parts"]}
+        else: out.append(m)
+    return out
+
+def compact_history(history, budget=CONTEXT_BUDGET, keep_recent=KEEP_RECENT):
+    """Return (new_history, stats). Never drops the last `keep_recent` messages, file parts or CALC_STATE."""
+    msgs = [{"role": r, "parts": p} for r, p in map(_role_parts, history)]
+    before = context_tokens(msgs)
+    cut = max(0, len(msgs) - keep_recent)
+    old, recent = msgs[:cut], msgs[cut:]
+
+    # 1) drop old tool traffic, strip old retrieval excerpts
+    kept = []
+    for m in old:
+        if is_tool_traffic(m): continue
+        if not has_file(m):
+            text = message_text(m)
+            if RETRIEVAL_MARKER in text:
+                m = {"role": m["role"], "parts": [text.split(RETRIEVAL_MARKER)[0]]}
+        kept.append(m)
+
+    # 2) still over budget: fold oldest plain turns into a summary line
+    def pinned(m):
+        return has_file(m) or any(_tagged(p, CALC_STATE_PREFIX) or _tagged(p, SUMMARY_PREFIX) for p in m["parts"])
+    asked = []
+    while kept and context_tokens(kept) + context_tokens(recent) > budget:
+        i = next((i for i, m in enumerate(kept) if not pinned(m)), None)
+        if i is None: break
+        m = kept.pop(i)
+        if m["role"] == "user":
+            asked.append(message_text(m).strip().replace("\n", " ")[:80])
+    if asked:
+        # The previous summary may have been merged into a neighbouring user turn: take out just its part
+        prev = next(((i, p) for i, m in enumerate(kept) for p in m["parts"] if _tagged(p, SUMMARY_PREFIX)), None)
+        if prev is not None:
+            i, part = prev
+            rest = [p for p in kept[i]["parts"] if p is not part]
+            if rest: kept[i] = {"role": kept[i]["role"], "parts": rest}
+            else: del kept[i]
+            asked.insert(0, _part_text(part)[len(SUMMARY_PREFIX):].removeprefix("user asked about: "))
+        kept.insert(0, {"role": "user", "parts": [SUMMARY_PREFIX + "user asked about: " + "; ".join(asked)[-600:]]})
+
+    # 3) dropped and folded turns can leave two user (or model) turns side by side
+    out = _merge_same_role(kept + recent)
+    stats = {"messages": len(out), "tokens": context_tokens(out), "tokens_before": before, "dropped": len(msgs) - len(out)}
+    return out, stats
+
+def compact_session(chat_session, budget=CONTEXT_BUDGET):
+    """Compact a live ChatSession in place (via its history setter). Returns stats."""
+    history, stats = compact_history(chat_session.history, budget)
+    if stats["tokens"] < stats["tokens_before"] or stats["dropped"]:
+        chat_session.history = history
+    return stats
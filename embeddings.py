@@ -0,0 +1,69 @@
+"""
+Pluggable embedding backends shared by ingestion, retrieval and caching.
+
+- "gemini": Google's embedding model (google.generativeai is imported lazily).
+- "stub":   deterministic hashed bag-of-words vectors for offline tests and
+            benchmarks; no network, same text always gives the same vector.
+
+Pick one with `get_embedder("stub")` or the TAXGUIDE_EMBEDDER env variable.
+"""
+import hashlib
+import math
+import os
+import re
+import time
+
+import tracing
+
+EMBED_MODEL = "models/embedding-001"
+EMBED_DIM = 768
+
+class GeminiEmbedder:
+    name = "gemini"
+
+    def __init__(self, model=EMBED_MODEL):
+        self.model = model
+        self.key = f"gemini:{model}"
+
+    def embed(self, texts, task_type="retrieval_document"):
+        import google.generativeai as genai
+        result = genai.embed_content(model=self.model, content=list(texts), task_type=task_type)
+        return result["embedding"]
+
+class StubEmbedder:
+    name = "stub"
+
+    def __init__(self, dim=EMBED_DIM, latency=0.0):
+        self.dim = dim
+        self.latency = latency
+        self.key = f"stub:{dim}"
+
+    def _vector(self, text):
+        v = [0.0] * self.dim
+        for tok in re.findall(r"[a-z0-9]+", text.lower()):
+            h = int.from_bytes(hashlib.blake2b(tok.encode(), digest_size=8).digest(), "little")
+            v[h % self.dim] += 1.0 if (h >> 32) & 1 else -1.0
+        norm = math.sqrt(sum(x * x for x in v)) or 1.0
+        return [x / norm for x in v]
+
+    def embed(self, texts, task_type="retrieval_document"):
+        if self.latency: time.sleep(self.latency)
+        return [self._vector(t) for t in texts]
+
+BACKENDS = {"gemini": GeminiEmbedder, "stub": StubEmbedder}
+_default = {}
+
+def get_embedder(name=None):
+    name = name or os.getenv("TAXGUIDE_EMBEDDER", "gemini")
+    if name not in _default:
+        try: _default[name] = BACKENDS[name]()
+        except KeyError: raise ValueError(f"Unknown embedding backend '{name}'. Choose from: {', '.join(BACKENDS)}")
+    return _default[name]
+
+def embed_query(text):
+    embedder = get_embedder()
+    with tracing.span("embed.query", backend=embedder.name):
+        return embedder.embed([text], task_type="retrieval_query")[0]
+
+def embed_document(text):
+    return get_embedder().embed([text], task_type="retrieval_document")[0]
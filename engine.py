@@ -0,0 +1,101 @@
+"""
+Headless TaxGuide engine: the calculators without Streamlit, Gemini or an API key.
+
+    import engine
+    engine.calculate({"salary": "15L", "rent": 25000})
+    engine.calculate_batch([{"salary": 1500000}, {"salary": 900000, "age": 62}])
+
+Importing this module only loads the standard library and the pure-Python
+rule modules (a few milliseconds). NumPy and the vectorized batch engine are
+imported on the first `calculate_batch` call. app.py (the Streamlit UI) and
+service.py (the HTTP service) are both clients of these functions.
+"""
+import re
+
+from expr_eval import evaluate
+from intent_parser import parse_amount, parse_intent
+from optimizer import optimize_deductions, format_plan
+from tax_engine import calculate_tax_detailed
+from tax_rules import DEFAULT_FY
+
+CALC_DEFAULTS = {"age":30, "salary":0, "business":0, "rent":0, "hra_received":0, "inv80c":0, "med80d":0, "basic":0, "home_loan":0, "nps":0, "edu_loan":0, "donations":0, "savings_int":0, "other":0}
+
+# --- 1. INPUTS ---
+
+_ARG_SPLIT = re.compile(r",\s*(?=[A-Za-z_]\w*\s*=)")  # only commas that start the next key, so "15,00,000" stays whole
+
+def parse_calculate_args(params):
+    d = dict(CALC_DEFAULTS)
+    for p in _ARG_SPLIT.split(params):
+        if "=" in p:
+            k, v = p.split("=", 1)
+            amount = parse_amount(v)  # keeps units: "15L", "1.2 Cr", "₹1,50,000"
+            k = k.strip()
+            # Only known inputs: the result is persisted and replayed through `calculate`, which rejects the rest
+            if amount is not None and k in CALC_DEFAULTS: d[k] = amount
+    return d
+
+def normalize_inputs(inputs):
+    """CALCULATE-style dict with defaults filled in; amounts may be numbers or strings like '15L'. Raises ValueError."""
+    d = dict(CALC_DEFAULTS)
+    for k, v in inputs.items():
+        if k not in CALC_DEFAULTS: raise ValueError(f"Unknown input '{k}'. Expected: {', '.join(CALC_DEFAULTS)}")
+        if v is None or v == "": continue
+        if isinstance(v, str):
+            amount = parse_amount(v)
+            if amount is None: raise ValueError(f"Could not read an amount from {k}={v!r}")
+            v = amount
+        elif isinstance(v, bool) or not isinstance(v, (int, float)):
+            raise ValueError(f"{k} must be a number")
+        d[k] = v
+    return d
+
+def _args(d):
+    return (
+        d['age'], d['salary'], d['business'], d['rent'], d['hra_received'],
+        d['inv80c'], d['med80d'], d['home_loan'], d['nps'],
+        d['edu_loan'], d['donations'], d['savings_int'], d['other'], d['basic']
+    )
+
+# --- 2. CALCULATIONS ---
+
+def _with_gains(res, d, gains, fy):
+    if not gains: return res
+    from capital_gains import calculate_with_gains  # only loaded when a trade ledger is in play
+    return calculate_with_gains(res, gains, d["age"], fy)
+
+def run_calculation(d, fy=DEFAULT_FY, gains=None):
+    """CALCULATE tool result: a short line for the model plus the full data for the UI."""
+    res = _with_gains(calculate_tax_detailed(*_args(d), fy=fy), d, gains, fy)
+    plan = optimize_deductions(*_args(d), fy=fy, gains=gains)
+    tn, to = res['new']['breakdown']['total'], res['old']['breakdown']['total']
+    return {"output": f"Result shown: New={tn}, Old={to}", "data": {"d": d, "res": res, "plan": plan}}
+
+def calculate(inputs, fy=DEFAULT_FY, plan=True, gains=None):
+    """New vs Old regime comparison (and the deduction plan) for one taxpayer; `gains` is a capital_gains summary."""
+    d = normalize_inputs(inputs)
+    out = {"inputs": d, "fy": fy, **_with_gains(calculate_tax_detailed(*_args(d), fy=fy), d, gains, fy)}
+    if plan: out["plan"] = optimize_deductions(*_args(d), fy=fy, gains=gains)
+    return out
+
+def optimize(inputs, budget=None, fy=DEFAULT_FY, gains=None):
+    plan = optimize_deductions(*_args(normalize_inputs(inputs)), budget=budget, fy=fy, gains=gains)
+    return dict(plan, summary=format_plan(plan))
+
+def safe_math_eval(expression):
+    # Restricted AST evaluator with a compiled-expression LRU (expr_eval.py); no eval()
+    try:
+        result = evaluate(expression)
+        if isinstance(result, (int, float)): return f"{int(result):,}"
+        return str(result)
+    except Exception as e: return f"Error ({e})"
+
+def calculate_batch(rows, fy=DEFAULT_FY):
+    """Vectorized regime comparison for many taxpayers; one output dict per input row, in order."""
+    from batch_tax import calculate_tax_columns  # NumPy loads here, not on import
+    rows = [normalize_inputs(r) for r in rows]
+    if not rows: return []
+    out = calculate_tax_columns({k: [r[k] for r in rows] for k in CALC_DEFAULTS}, fy)
+    names, values = list(out), [out[k].tolist() for k in out]
+    return [dict(zip(names, vals)) for vals in zip(*values)]
+
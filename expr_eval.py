@@ -0,0 +1,131 @@
+"""
+Restricted arithmetic evaluator behind CALCULATE_MATH(...).
+
+An expression is parsed once into a Python AST, checked against a whitelist
+(numbers, + - * / // % **, comparisons, and calls to the helpers in
+FUNCTIONS), then compiled into nested closures. Compiled forms are kept in an
+LRU keyed by the normalized text, so repeat expressions skip parsing.
+
+Limits stop hostile input from burning CPU: the text length, the number of
+AST nodes, the size of any exponent, and the magnitude of intermediate powers
+are all capped.
+"""
+import ast
+import math
+import operator
+import re
+from functools import lru_cache
+
+from intent_parser import UNITS
+from tax_engine import calculate_hra_exemption, compute_tax_breakdown
+from tax_rules import DEFAULT_FY, get_rule_table, slab_tax as _slab_tax
+
+MAX_LENGTH = 500
+MAX_NODES = 200
+MAX_EXPONENT = 64
+MAX_MAGNITUDE = 1e30
+CACHE_SIZE = 512
+
+class ExpressionError(ValueError):
+    pass
+
+# --- 1. HELPERS ---
+
+def _regime(regime):
+    regime = {0: "new", 1: "old"}.get(regime, regime)
+    if regime not in ("new", "old"): raise ExpressionError("regime must be 'new' or 'old'")
+    return regime
+
+def slab_tax(income, regime="new", age=30):
+    """Slab tax before rebate, surcharge and cess."""
+    return _slab_tax(get_rule_table(DEFAULT_FY, _regime(regime), age), income)
+
+def income_tax(income, regime="new", age=30):
+    """Total tax (rebate, surcharge and cess included) on taxable `income`."""
+    return compute_tax_breakdown(income, age, _regime(regime))["total"]
+
+def hra_exemption(basic, rent, hra_received, metro=1):
+    """Section 10(13A) exemption from annual basic, rent paid and HRA received."""
+    return calculate_hra_exemption(basic, rent, hra_received, metro=bool(metro))
+
+def _pow(base, exp):
+    if abs(exp) > MAX_EXPONENT: raise ExpressionError(f"Exponent too large (max {MAX_EXPONENT})")
+    if base and exp * math.log10(abs(base)) > math.log10(MAX_MAGNITUDE): raise ExpressionError("Result too large")
+    return base ** exp
+
+FUNCTIONS = {
+    "min": min, "max": max, "abs": abs, "round": round, "int": int, "float": float, "pow": _pow,
+    "ceil": math.ceil, "floor": math.floor,
+    "slab_tax": slab_tax, "tax": income_tax, "new_tax": lambda income: income_tax(income, "new"),
+    "old_tax": lambda income, age=30: income_tax(income, "old", age), "hra_exemption": hra_exemption,
+}
+
+# --- 2. NORMALIZATION ---
+
+_GROUPED = re.compile(r"(?<![\d.,])\d{1,3}(?:,\d{2,3})+(?!\d)")  # 1,50,000 / 150,000 but not 150000,200000
+_UNIT = re.compile(r"(\d+(?:\.\d+)?)\s*(crores?|cr|lakhs?|lacs?|lac|l|k)\b")
+
+def normalize(expression):
+    """Same clean-up the chat expects: drop labels, ₹ and digit commas; % means /100, ^ means power; 1.5L -> 150000."""
+    if ":" in expression: expression = expression.split(":")[-1]
+    if "=" in expression and not re.search(r"[<>!=]=", expression): expression = expression.split("=")[-1]
+    expression = expression.lower().strip()
+    expression = expression.replace("\n", " ").replace("\t", " ").replace("`", "").replace("₹", "")
+    expression = _GROUPED.sub(lambda m: m.group(0).replace(",", ""), expression)
+    expression = _UNIT.sub(lambda m: f"({m.group(1)}*{UNITS[m.group(2)]})", expression)
+    return expression.replace("%", "*0.01").replace("^", "**")
+
+# --- 3. COMPILER ---
+
+_BINOPS = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv,
+           ast.FloorDiv: operator.floordiv, ast.Mod: operator.mod, ast.Pow: _pow}
+_UNARY = {ast.UAdd: operator.pos, ast.USub: operator.neg}
+_COMPARE = {ast.Lt: operator.lt, ast.LtE: operator.le, ast.Gt: operator.gt, ast.GtE: operator.ge,
+            ast.Eq: operator.eq, ast.NotEq: operator.ne}
+
+def _compile(node, in_call=False):
+    if isinstance(node, ast.Expression):
+        return _compile(node.body)
+    if isinstance(node, ast.Constant):
+        value = node.value
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)) or (isinstance(value, str) and not in_call):
+            raise ExpressionError(f"Unsupported value {value!r}")
+        return lambda: value
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINOPS:
+        op, left, right = _BINOPS[type(node.op)], _compile(node.left), _compile(node.right)
+        return lambda: op(left(), right())
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY:
+        op, operand = _UNARY[type(node.op)], _compile(node.operand)
+        return lambda: op(operand())
+    if isinstance(node, ast.Compare) and all(type(o) in _COMPARE for o in node.ops):
+        ops = [_COMPARE[type(o)] for o in node.ops]
+        operands = [_compile(node.left)] + [_compile(c) for c in node.comparators]
+        def compare():
+            values = [f() for f in operands]
+            return all(op(a, b) for op, a, b in zip(ops, values, values[1:]))
+        return compare
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in FUNCTIONS and not node.keywords:
+        fn, args = FUNCTIONS[node.func.id], [_compile(a, in_call=True) for a in node.args]
+        def call():
+            try: return fn(*[a() for a in args])
+            except TypeError as e: raise ExpressionError(f"{node.func.id}(): {e}")
+        return call
+    if isinstance(node, ast.Name):
+        raise ExpressionError(f"Unknown name '{node.id}'")
+    raise ExpressionError(f"Unsupported syntax: {type(node).__name__}")
+
+@lru_cache(maxsize=CACHE_SIZE)
+def compile_expression(expression):
+    """Validated, compiled closure for a normalized expression (raises ExpressionError)."""
+    if len(expression) > MAX_LENGTH: raise ExpressionError(f"Expression too long (max {MAX_LENGTH} characters)")
+    try: tree = ast.parse(expression, mode="eval")
+    except SyntaxError as e: raise ExpressionError(f"Invalid expression: {e.msg}")
+    if sum(1 for _ in ast.walk(tree)) > MAX_NODES: raise ExpressionError(f"Expression too complex (max {MAX_NODES} nodes)")
+    return _compile(tree)
+
+def evaluate(expression):
+    """Evaluate a chat-style expression, e.g. 'Tax: 1.5L * 30%' -> 45000.0."""
+    result = compile_expression(normalize(expression))()
+    if isinstance(result, (int, float)) and not isinstance(result, bool) and abs(result) > MAX_MAGNITUDE:
+        raise ExpressionError("Result too large")
+    return result
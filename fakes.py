@@ -0,0 +1,189 @@
+"""
+Deterministic offline stand-ins for Gemini and DuckDuckGo (benchmarks, demos).
+
+- `FakeGenAI` mimics the parts of `google.generativeai` the app uses:
+  configure, GenerativeModel(...).start_chat(history).send_message(prompt,
+  stream=...), upload_file / get_file and embed_content. Replies come from a
+  `responder(prompt) -> text` callable (the default plays a plausible
+  tool-using model).
+- `FakeSearchBackend` replaces DDGS behind `web_search.set_search_backend`.
+
+Both inject configurable latency and rate limits. A rate-limited call raises
+`ResourceExhausted` (a 429 carrying a "retry in Ns" hint, as Gemini does) or
+`RatelimitException` (as DDGS does). The random generators are seeded, so a
+run with the same settings always sees the same failures.
+
+    import fakes
+    fakes.install_fake_genai(latency=0.3, rate_limit_rate=0.1)  # before app/llm_client use genai
+"""
+import datetime
+import random
+import re
+import sys
+import threading
+import time
+import types
+
+from embeddings import StubEmbedder
+from intent_parser import parse_amount, parse_intent, to_calculate_args
+
+class ResourceExhausted(Exception):
+    """Gemini's 429 (google.api_core.exceptions.ResourceExhausted)."""
+    code = 429
+
+class RatelimitException(Exception):
+    """DDGS's rate-limit error."""
+
+class _Faults:
+    def __init__(self, latency, jitter, rate_limit_rate, seed, chunk_latency=0.0):
+        self.latency, self.jitter, self.rate_limit_rate, self.chunk_latency = latency, jitter, rate_limit_rate, chunk_latency
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay(self, base=None):
+        base = self.latency if base is None else base
+        with self._lock: extra = self._rng.uniform(0, self.jitter) if self.jitter else 0.0
+        if base + extra > 0: time.sleep(base + extra)
+
+    def limited(self):
+        if not self.rate_limit_rate: return False
+        with self._lock: return self._rng.random() < self.rate_limit_rate
+
+# --- 1. MODEL REPLIES ---
+
+_SALARY = re.compile(r"\b(salary|earn|income|ctc|package)\b", re.I)
+
+def default_responder(prompt):
+    """Plays the tool protocol: calculator inputs -> CALCULATE, rule questions -> LOAD + SEARCH_WEB, tool results -> answer."""
+    text = prompt if isinstance(prompt, str) else " ".join(p for p in prompt if isinstance(p, str))
+    if text.startswith("Tool Results:"):
+        sources = re.findall(r"\(Source: ([^)]+)\)", text) or ["salary_rules.pdf"]
+        return ("Based on the rules, this is taxable as a perquisite under Section 17(2) of the Income Tax Act, "
+                "and it is added to your salary income for the year. " * 3 + f"Source: {sources[0]}")
+    question = text.split("\n\n---\n")[0]
+    fields = parse_intent(question)["fields"]
+    if fields.get("salary"):
+        return f"CALCULATE({to_calculate_args(fields)})"
+    amount = parse_amount(question) if _SALARY.search(question) else None
+    if amount:
+        return f"CALCULATE(salary={int(amount)})"
+    return f"LOAD(SALARY)\nSEARCH_WEB({question.strip().rstrip('?')} India Income Tax)"
+
+# --- 2. FAKE google.generativeai ---
+
+class FakeResponse:
+    def __init__(self, text, prompt_tokens, chunk_size, faults):
+        self.text = text
+        self._chunk_size, self._faults = chunk_size, faults
+        self.usage_metadata = types.SimpleNamespace(prompt_token_count=prompt_tokens, candidates_token_count=max(1, len(text) // 4),
+                                                    total_token_count=prompt_tokens + max(1, len(text) // 4))
+
+    def __iter__(self):
+        for i in range(0, len(self.text), self._chunk_size):
+            if i: self._faults.delay(self._faults.chunk_latency)
+            yield types.SimpleNamespace(text=self.text[i:i + self._chunk_size])
+
+class FakeChatSession:
+    def __init__(self, genai, history):
+        self._genai = genai
+        self.history = list(history or [])
+
+    def send_message(self, content, stream=False):
+        g = self._genai
+        g.faults.delay()  # time to first token
+        with g._lock: g.calls += 1
+        if g.faults.limited():
+            with g._lock: g.rate_limited += 1
+            hint = f" Please retry in {g.retry_hint}s." if g.retry_hint is not None else ""
+            raise ResourceExhausted(f"429 Resource has been exhausted (e.g. check quota).{hint}")
+        reply = g.responder(content)
+        parts = content if isinstance(content, list) else [content]
+        prompt_tokens = sum(len(str(m)) for m in self.history) // 4 + sum(len(p) // 4 if isinstance(p, str) else 258 for p in parts)
+        self.history += [{"role": "user", "parts": parts}, {"role": "model", "parts": [reply]}]
+        response = FakeResponse(reply, prompt_tokens, g.chunk_size, g.faults)
+        if not stream:
+            for _ in response: pass  # a blocking call pays the whole generation time
+        return response
+
+class FakeModel:
+    def __init__(self, genai, model_name, system_instruction=None, **kwargs):
+        self._genai, self.model_name, self.system_instruction = genai, model_name, system_instruction
+
+    def start_chat(self, history=None):
+        return FakeChatSession(self._genai, history)
+
+class FakeGenAI(types.ModuleType):
+    """
+    Module-shaped fake of google.generativeai; counters (calls, rate_limited,
+    uploads) are for reports. retry_hint=None sends 429s without a retry hint.
+    """
+
+    def __init__(self, responder=default_responder, latency=0.0, jitter=0.0, chunk_latency=0.0, chunk_size=16,
+                 rate_limit_rate=0.0, retry_hint=0.05, upload_latency=0.0, seed=0):
+        super().__init__("google.generativeai")
+        self.responder, self.chunk_size, self.retry_hint = responder, chunk_size, retry_hint
+        self.faults = _Faults(latency, jitter, rate_limit_rate, seed, chunk_latency)
+        self.upload_faults = _Faults(upload_latency, 0.0, 0.0, seed)
+        self._embedder = StubEmbedder()
+        self._files = {}
+        self._lock = threading.Lock()
+        self.calls = self.rate_limited = self.uploads = 0
+        self.GenerativeModel = lambda model_name, **kw: FakeModel(self, model_name, **kw)
+
+    def configure(self, **kwargs):
+        pass
+
+    def upload_file(self, path, display_name=None, mime_type="application/pdf"):
+        self.upload_faults.delay()
+        with self._lock:
+            self.uploads += 1
+            name = f"files/fake-{self.uploads}"
+            self._files[name] = types.SimpleNamespace(
+                name=name, uri=f"https://fake.invalid/{name}", mime_type=mime_type, display_name=display_name or path,
+                state=types.SimpleNamespace(name="ACTIVE"),
+                expiration_time=datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=48))
+        return self._files[name]
+
+    def get_file(self, name):
+        try: return self._files[name]
+        except KeyError: raise LookupError(f"404 File {name} not found")
+
+    def embed_content(self, model, content, task_type="retrieval_document"):
+        texts = [content] if isinstance(content, str) else list(content)
+        vectors = self._embedder.embed(texts, task_type)
+        return {"embedding": vectors[0] if isinstance(content, str) else vectors}
+
+def install_fake_genai(**kwargs):
+    """Register a FakeGenAI as `google.generativeai` (so `import google.generativeai` gets it) and return it."""
+    fake = FakeGenAI(**kwargs)
+    google = sys.modules.get("google")
+    if google is None:
+        try: import google
+        except ImportError:
+            google = types.ModuleType("google"); google.__path__ = []
+            sys.modules["google"] = google
+    google.generativeai = fake
+    sys.modules["google.generativeai"] = fake
+    return fake
+
+# --- 3. FAKE SEARCH ---
+
+class FakeSearchBackend:
+    """DDGS stand-in for `web_search.set_search_backend`: same result shape, canned Indian-tax snippets."""
+    name = "fake"
+
+    def __init__(self, latency=0.0, jitter=0.0, rate_limit_rate=0.0, seed=0):
+        self.faults = _Faults(latency, jitter, rate_limit_rate, seed)
+        self._lock = threading.Lock()  # web_search fans query variants out over threads
+        self.calls = self.rate_limited = 0
+
+    def text(self, query, max_results=3):
+        self.faults.delay()
+        with self._lock: self.calls += 1
+        if self.faults.limited():
+            with self._lock: self.rate_limited += 1
+            raise RatelimitException(f"https://duckduckgo.com/ 202 Ratelimit for '{query}'")
+        slug = re.sub(r"[^a-z0-9]+", "-", query.lower()).strip("-")[:60]
+        return [{"title": f"Income Tax Department: {query[:40]} ({i + 1})",
+                 "body": "Perquisites provided by an employer are taxable as salary under Section 17(2) unless specifically exempt.",
+                 "href": f"https://incometax.gov.in/iec/foportal/help/{slug}-{i + 1}"} for i in range(max_results)]
@@ -1,39 +1,166 @@
-import google.generativeai as genai
-import numpy as np
+"""
+Builds the local knowledge index (knowledge_index.json and the .npy / .jsonl it names) from the rule PDFs.
+
+    python ingest.py                      # all persona PDFs, Gemini embeddings
+    python ingest.py --backend stub       # offline, deterministic vectors
+    python ingest.py salary_rules.pdf --workers 8 --batch-size 64
+
+Text is pulled straight from the PDFs and chunked per section heading. Chunks
+whose content hash is already in the index are not re-embedded, and every
+finished batch is appended to a checkpoint file, so a crashed run resumes
+where it stopped.
+"""
+import argparse
+import hashlib
+import json
 import os
-import pickle
-
-# 1. SETUP API
-# Paste your actual key here!
-API_KEY = "KEY_REMOVED_FOR_SECURITY"
-genai.configure(api_key=API_KEY)
-
-# 2. LOAD DATA
-print("Loading tax rules...")
-with open("tax_rules.txt", "r") as f:
-    text = f.read()
-
-# 3. CHUNK DATA
-# Simple splitter: splits by paragraphs (double newlines)
-documents = text.split("\n\n")
-print(f"Split into {len(documents)} chunks.")
-
-# 4. EMBED DATA (The "Memory")
-print("Creating embeddings...")
-embeddings = []
-for doc in documents:
-    # Get the embedding vector for each chunk
-    result = genai.embed_content(
-        model="models/embedding-001",
-        content=doc,
-        task_type="retrieval_document"
-    )
-    embeddings.append(result['embedding'])
-
-# 5. SAVE TO DISK
-# We save the text and the math vectors together
-with open("manual_memory.pkl", "wb") as f:
-    pickle.dump({"docs": documents, "vectors": embeddings}, f)
-
-
-print("✅ Success! Memory created in 'manual_memory.pkl'")
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from embeddings import get_embedder
+from retrieval import DEFAULT_INDEX, PERSONA_FILES, index_files, write_index
+
+MAX_CHUNK_CHARS = 1200
+_TRAILING_WORDS = {"a", "an", "the", "of", "to", "for", "and", "or", "in", "on", "by", "with", "during", "shall", "be", "is", "as"}
+
+# --- 1. EXTRACT & CHUNK ---
+
+def extract_pages(path):
+    """[(page_number, text), ...] for a PDF or plain-text file."""
+    if not path.lower().endswith(".pdf"):
+        with open(path, encoding="utf-8") as f:
+            return [(1, f.read())]
+    from pypdf import PdfReader
+    return [(i + 1, page.extract_text() or "") for i, page in enumerate(PdfReader(path).pages)]
+
+def _is_heading(line, prev):
+    if not line or len(line) > 80 or len(line.split()) > 10: return False
+    if line[-1] in ".,;:" or not line[0].isupper(): return False
+    if line.startswith("[") or line[0].isdigit() or re.search(r"\bRs\b|\d,\d", line): return False
+    if line.split()[-1].lower() in _TRAILING_WORDS or line.startswith(("Thus", "Correct answer")): return False
+    # Wrapped sentence fragments follow a line that did not end a sentence.
+    return line.isupper() or not prev or prev[-1] in ".:;)"
+
+def chunk_document(path, persona=None, max_chars=MAX_CHUNK_CHARS):
+    """Split a document into section-aware chunks with source/page/section metadata."""
+    source = os.path.basename(path)
+    sections, heading, buf, page_of_buf, prev = [], "", [], 1, ""
+    for page, text in extract_pages(path):
+        for raw in text.splitlines():
+            line = re.sub(r"\s+", " ", raw).strip()
+            if not line: continue
+            if _is_heading(line, prev):
+                if buf: sections.append((heading, page_of_buf, " ".join(buf)))
+                heading, buf, page_of_buf = line, [], page
+            else:
+                if not buf: page_of_buf = page
+                buf.append(line)
+            prev = line
+    if buf: sections.append((heading, page_of_buf, " ".join(buf)))
+
+    chunks = []
+    for heading, page, body in sections:
+        sentences = re.split(r"(?<=[.;:])\s+", body)
+        part = ""
+        for s in sentences:
+            if part and len(part) + len(s) > max_chars:
+                chunks.append((heading, page, part)); part = ""
+            part = f"{part} {s}".strip()
+        if part: chunks.append((heading, page, part))
+
+    return [
+        {"text": f"{heading}\n{body}" if heading else body, "source": source, "persona": persona, "page": page, "section": heading}
+        for heading, page, body in chunks
+    ]
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+# --- 2. EMBED (batched, bounded pool, backoff) ---
+
+def _is_rate_limited(e):
+    return "429" in str(e) or type(e).__name__ in ("ResourceExhausted", "TooManyRequests")
+
+def embed_with_backoff(embedder, texts, retries=6, base_delay=1.0):
+    for attempt in range(retries):
+        try:
+            return embedder.embed(texts, task_type="retrieval_document")
+        except Exception as e:
+            if not _is_rate_limited(e) or attempt == retries - 1: raise
+            time.sleep(base_delay * 2 ** attempt * random.uniform(0.5, 1.5))
+
+def _load_existing(prefix, embedder_key):
+    """hash -> vector for chunks already embedded by the same backend (index + checkpoint)."""
+    known, files = {}, index_files(prefix)
+    if files:
+        import numpy as np
+        matrix = np.load(files[0], mmap_mode="r")
+        with open(files[1], encoding="utf-8") as f:
+            for row, line in enumerate(f):
+                meta = json.loads(line)
+                if meta.get("hash") and meta.get("embedder") == embedder_key:
+                    known[meta["hash"]] = matrix[row].tolist()
+    ckpt = prefix + ".ckpt.jsonl"
+    if os.path.exists(ckpt):
+        with open(ckpt, encoding="utf-8") as f:
+            for line in f:
+                try: rec = json.loads(line)
+                except ValueError: continue  # torn last line from a crash
+                if rec.get("embedder") == embedder_key: known[rec["hash"]] = rec["vector"]
+    return known
+
+def ingest(paths, prefix=DEFAULT_INDEX, backend=None, workers=4, batch_size=32, log=print):
+    """Chunk `paths`, embed only unseen chunks and rewrite the index. Returns (total, embedded) counts."""
+    embedder = get_embedder(backend)
+    personas = {f: p for p, f in PERSONA_FILES.items()}
+    chunks = []
+    for path in paths:
+        doc_chunks = chunk_document(path, personas.get(os.path.basename(path)))
+        log(f"📄 {path}: {len(doc_chunks)} chunks")
+        chunks += doc_chunks
+
+    for c in chunks:
+        c["hash"] = content_hash(c["text"]); c["embedder"] = embedder.key
+    vectors = _load_existing(prefix, embedder.key)
+    todo = list({c["hash"]: c for c in chunks if c["hash"] not in vectors}.values())
+    log(f"🧠 {len({c['hash'] for c in chunks}) - len(todo)} cached, {len(todo)} to embed with '{embedder.name}'")
+
+    ckpt = prefix + ".ckpt.jsonl"
+    batches = [todo[i:i + batch_size] for i in range(0, len(todo), batch_size)]
+    with open(ckpt, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(embed_with_backoff, embedder, [c["text"] for c in b]): b for b in batches}
+        for fut in as_completed(futures):
+            batch = futures[fut]
+            for c, vec in zip(batch, fut.result()):
+                vectors[c["hash"]] = vec
+                out.write(json.dumps({"hash": c["hash"], "embedder": embedder.key, "vector": vec}) + "\n")
+            out.flush()
+
+    write_index(prefix, [c["text"] for c in chunks], [vectors[c["hash"]] for c in chunks],
+                [{k: v for k, v in c.items() if k != "text"} for c in chunks])
+    os.remove(ckpt)
+    return len(chunks), len(todo)
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Build the TaxGuide knowledge index from rule PDFs.")
+    p.add_argument("files", nargs="*", default=list(PERSONA_FILES.values()))
+    p.add_argument("--index", default=DEFAULT_INDEX, help="Index path prefix")
+    p.add_argument("--backend", default=None, help="Embedding backend: gemini | stub (default: $TAXGUIDE_EMBEDDER or gemini)")
+    p.add_argument("--workers", type=int, default=4)
+    p.add_argument("--batch-size", type=int, default=32)
+    args = p.parse_args(argv)
+
+    if (args.backend or os.getenv("TAXGUIDE_EMBEDDER", "gemini")) == "gemini":
+        import google.generativeai as genai
+        from dotenv import load_dotenv
+        load_dotenv()
+        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+
+    t = time.perf_counter()
+    total, embedded = ingest(args.files, args.index, args.backend, args.workers, args.batch_size)
+    print(f"✅ Success! {total} chunks indexed ({embedded} newly embedded) in {time.perf_counter() - t:.1f}s -> {args.index}.json")
+
+if __name__ == "__main__":
+    main()
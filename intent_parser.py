@@ -0,0 +1,167 @@
+"""
+Local fast path for plain calculator input such as
+
+    Salary 15L, rent 25k/month, 80C 1.5L, NPS 50,000
+
+Amounts understand Indian notation (₹/Rs, 15,00,000, k, L/lakh, Cr) and an
+optional period (per month / per annum). Field names are matched through a
+synonym table onto the CALCULATE keys. `parse_intent` only reports
+`confident` when every word was understood, every amount was paired with a
+field and there is a salary or business income; anything else (questions,
+unknown words, conflicting values) goes to the LLM as before.
+"""
+import re
+
+UNITS = {"k": 1_000, "thousand": 1_000, "l": 100_000, "lac": 100_000, "lacs": 100_000, "lakh": 100_000, "lakhs": 100_000,
+         "cr": 10_000_000, "crore": 10_000_000, "crores": 10_000_000}
+
+# Longest phrase wins, so "basic salary" beats "salary" and "business income" beats "income"
+FIELD_SYNONYMS = {
+    "salary": ["gross salary", "annual salary", "salary", "ctc", "package", "income"],
+    "business": ["business income", "business", "freelance income", "freelancing", "freelance", "professional income", "consulting income", "44ada"],
+    "rent": ["rent paid", "house rent", "rent"],
+    "hra_received": ["hra received", "hra"],
+    "inv80c": ["section 80c", "80c", "ppf", "elss", "epf", "pf", "lic", "life insurance"],
+    "med80d": ["section 80d", "80d", "health insurance", "mediclaim", "medical insurance"],
+    "basic": ["basic salary", "basic pay", "basic"],
+    "home_loan": ["home loan interest", "home loan", "housing loan interest", "housing loan", "24b"],
+    "nps": ["80ccd(1b)", "80ccd", "nps"],
+    "edu_loan": ["education loan interest", "education loan", "edu loan", "80e"],
+    "donations": ["donations", "donation", "80g"],
+    "savings_int": ["savings account interest", "savings interest", "savings int", "80tta", "80ttb"],
+    "other": ["other deductions", "other"],
+    "age": ["years old", "yrs old", "aged", "age"],
+}
+ADDITIVE = {"inv80c", "med80d", "donations", "other"}  # "PPF 50k, ELSS 1L" add up
+
+PERIODS = {
+    "monthly": ["per month", "a month", "/month", "/mo", "p.m.", "pm", "monthly", "every month"],
+    "annual": ["per annum", "per year", "a year", "/year", "/yr", "p.a.", "pa", "annually", "annual", "yearly"],
+}
+
+FILLER = {"my", "is", "i", "am", "have", "pay", "paid", "and", "the", "of", "a", "an", "in", "with", "also", "per",
+          "invest", "invested", "investment", "investments", "me", "rs", "inr", "under", "section", "total", "plus",
+          "tax", "calculate", "compute", "for", "it", "its", "about", "around", "approx", "approximately", "to", "on"}
+
+_AMOUNT = r"(?:₹|rs\.?|inr)?\s*(\d+(?:,\d+)*(?:\.\d+)?)\s*(%|crores?|cr|lakhs?|lacs?|lac|l|k|thousand)?(?![\w])"
+
+def _phrase(p):
+    body = re.escape(p).replace(r"\ ", r"\s+")
+    return (r"(?<![\w])" if p[0].isalnum() else "") + body + (r"(?![\w])" if p[-1].isalnum() else "")
+
+_FIELD_OF = {p: k for k, ps in FIELD_SYNONYMS.items() for p in ps}
+_PERIOD_OF = {p: k for k, ps in PERIODS.items() for p in ps}
+_FIELD_RE = "|".join(_phrase(p) for p in sorted(_FIELD_OF, key=len, reverse=True))
+_PERIOD_RE = "|".join(_phrase(p) for p in sorted(_PERIOD_OF, key=len, reverse=True))
+_TOKEN = re.compile(
+    rf"(?P<field>{_FIELD_RE})"
+    rf"|(?P<period>{_PERIOD_RE})"
+    rf"|(?P<amount>{_AMOUNT})"
+    r"|(?P<word>[a-z][a-z']*)"
+    r"|(?P<question>\?)")
+
+# --- 1. AMOUNTS ---
+
+def parse_amount(text):
+    """'15L' -> 1500000, '₹1,50,000' -> 150000, '1.2 Cr' -> 12000000, '50%' -> 50. None if no amount."""
+    m = re.search(_AMOUNT, str(text).lower())
+    if not m: return None
+    value = float(m.group(1).replace(",", ""))
+    unit = m.group(2)
+    if unit and unit != "%": value *= UNITS[unit]
+    return int(round(value))
+
+# Rupee values only: a currency sign, a unit, Indian/Western comma grouping or 5+ digits.
+# Section and year numbers ("10(13A)", "80C", "FY 2024-25") don't count.
+_MONEY = re.compile(
+    r"(?:₹|(?<![a-z])(?:rs\.?|inr)\s*)\d"
+    r"|\d(?:\.\d+)?\s*(?:crores?|cr|lakhs?|lacs?|lac|l|k|thousand)(?![\w])"
+    r"|(?<![\d,])\d{1,3}(?:,\d{2,3})+(?![\d])"
+    r"|\d{5,}")
+
+def mentions_money(text):
+    """True if `text` states a rupee amount ('20L', '₹8,00,000', 'rs 5000', '150000')."""
+    return bool(_MONEY.search(str(text).lower()))
+
+# --- 2. INTENT ---
+
+def _tokens(text):
+    for m in _TOKEN.finditer(text.lower()):
+        kind = m.lastgroup
+        if kind == "field": yield "field", _FIELD_OF[re.sub(r"\s+", " ", m.group(kind))]
+        elif kind == "period": yield "period", _PERIOD_OF[re.sub(r"\s+", " ", m.group(kind))]
+        elif kind == "amount":
+            unit = re.search(_AMOUNT, m.group(kind)).group(2)
+            yield "amount", (parse_amount(m.group(kind)), unit)
+        else: yield kind, m.group(kind)
+
+def _engine_rent(annual, salary):
+    """`calculate_tax_detailed` treats rent below 15% of salary as monthly; hand it a value it reads back as `annual`."""
+    if annual >= salary * 0.15: return annual
+    return annual // 12 if annual % 12 == 0 else annual / 12
+
+def parse_intent(text):
+    """
+    {"fields": {CALCULATE key: value}, "confident": bool, "reason": str}.
+    Values are annual rupees, except rent with no stated period (left to the
+    engine's monthly/annual rule), basic given as a percentage and age.
+    """
+    pairs, problems = [], []
+    pending_field = pending_amount = pending_period = None
+
+    for kind, val in _tokens(text):
+        if kind == "question": problems.append("question")
+        elif kind == "word":
+            if val not in FILLER: problems.append(f"unknown word '{val}'")
+        elif kind == "period":
+            if pairs and pairs[-1]["period"] is None and pending_field is None and pending_amount is None:
+                pairs[-1]["period"] = val  # "rent 25k per month"
+            else:
+                pending_period = val  # "monthly rent 25k"
+        elif kind == "field":
+            if pending_amount is not None:  # "15L salary"
+                pairs.append({"field": val, "amount": pending_amount, "period": pending_period})
+                pending_amount = pending_period = None
+            else:
+                if pending_field is not None and pending_field != val: problems.append(f"no amount for {pending_field}")
+                pending_field = val
+        elif kind == "amount":
+            if pending_field is not None:
+                pairs.append({"field": pending_field, "amount": val, "period": pending_period})
+                pending_field = pending_period = None
+            elif pending_amount is not None:
+                problems.append("amount without a field")
+            else:
+                pending_amount = val
+    if pending_field is not None: problems.append(f"no amount for {pending_field}")
+    if pending_amount is not None: problems.append("amount without a field")
+
+    fields, periods = {}, {}
+    for p in pairs:
+        key, (value, unit), period = p["field"], p["amount"], p["period"]
+        if key == "age":
+            if unit or not 18 <= value <= 120: problems.append("odd age"); continue
+        elif unit == "%":
+            if key != "basic" or not 0 < value < 100: problems.append(f"percentage for {key}"); continue
+        elif period == "monthly" and key != "rent":
+            value *= 12
+        if key in fields and key not in ADDITIVE:
+            if fields[key] != value: problems.append(f"two values for {key}")
+            continue
+        if key in ("rent", "salary"): periods[key] = period
+        fields[key] = fields.get(key, 0) + value
+
+    salary = fields.get("salary", 0)
+    if "rent" in fields and periods["rent"] is not None:
+        annual = fields["rent"] * 12 if periods["rent"] == "monthly" else fields["rent"]
+        fields["rent"] = _engine_rent(annual, salary)
+    if salary and periods.get("salary") is None and salary < 100_000:
+        problems.append("salary looks monthly")  # "salary 80k": ask rather than guess
+    if not (fields.get("salary") or fields.get("business")):
+        problems.append("no salary or business income")
+
+    return {"fields": fields, "confident": not problems, "reason": "; ".join(dict.fromkeys(problems))}
+
+def to_calculate_args(fields):
+    """Render parsed fields in the CALCULATE(...) argument format."""
+    return ", ".join(f"{k}={v}" for k, v in fields.items())
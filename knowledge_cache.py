@@ -0,0 +1,140 @@
+"""
+Persistent registry of knowledge PDFs uploaded to the Gemini File API.
+
+Entries are keyed by a fingerprint of the API key plus the file's content
+hash and survive process restarts, so a new server reuses the remote copy
+instead of uploading and polling again, while a rotated key or another
+project never gets URIs it cannot read. Remote files expire server-side
+(48h); entries are refreshed lazily when they get close to expiry or when a
+periodic revalidation finds them gone. Between revalidations, a request the
+API rejects (`is_rejected`) should `invalidate` the entry and ask again.
+`warm_cache` uploads the persona PDFs in a background thread at startup.
+"""
+import datetime
+import hashlib
+import json
+import os
+import threading
+import time
+
+import tracing
+
+REGISTRY_PATH = os.path.join(".taxguide_cache", "uploads.json")
+DEFAULT_TTL = 48 * 3600        # Gemini File API retention
+EXPIRY_MARGIN = 2 * 3600       # re-upload this long before the remote copy expires
+REVALIDATE_AFTER = 3600        # confirm the remote file still exists at most hourly
+
+_lock = threading.Lock()
+_inflight = {}                 # content hash -> Lock, so warmup and a user request share one upload
+_hash_memo = {}                # (path, mtime, size) -> content hash
+_api_key = os.getenv("GEMINI_API_KEY", "")
+
+# --- 1. REGISTRY ---
+
+def _load_registry(path=REGISTRY_PATH):
+    try:
+        with open(path, encoding="utf-8") as f: return json.load(f)
+    except (OSError, ValueError): return {}
+
+def _save_entry(digest, entry, path=REGISTRY_PATH):
+    with _lock:
+        reg = _load_registry(path)
+        if entry is None: reg.pop(digest, None)
+        else: reg[digest] = entry
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f: json.dump(reg, f, indent=1)
+        os.replace(tmp, path)
+
+def file_digest(filename):
+    st = os.stat(filename)
+    key = (os.path.abspath(filename), st.st_mtime, st.st_size)
+    if key not in _hash_memo:
+        h = hashlib.sha256()
+        with open(filename, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""): h.update(block)
+        _hash_memo[key] = h.hexdigest()
+    return _hash_memo[key]
+
+def set_api_key(api_key):
+    """The key genai is configured with; registry entries are scoped to it."""
+    global _api_key
+    _api_key = api_key or ""
+
+def _entry_key(digest):
+    account = hashlib.sha256(_api_key.encode()).hexdigest()[:12]
+    return f"{account}:{digest}"
+
+def as_part(entry):
+    """Prompt part referencing the remote file; building it needs no network call."""
+    return {"file_data": {"mime_type": entry["mime_type"], "file_uri": entry["uri"]}}
+
+# --- 2. UPLOAD / REVALIDATE ---
+
+def _upload(filename):
+    import google.generativeai as genai
+    with tracing.span("knowledge.upload_file", file=os.path.basename(filename)):
+        f = genai.upload_file(path=filename, display_name=os.path.basename(filename))
+    delay = 0.5
+    with tracing.span("knowledge.poll", file=os.path.basename(filename)) as sp:
+        while f.state.name == "PROCESSING":
+            time.sleep(delay); sp.add("polls", 1).add("sleep_s", delay); delay = min(delay * 2, 4)
+            f = genai.get_file(f.name)
+    if f.state.name != "ACTIVE":
+        raise RuntimeError(f"Upload of {filename} ended in state {f.state.name}")
+    expiry = getattr(f, "expiration_time", None)
+    expires_at = expiry.timestamp() if isinstance(expiry, datetime.datetime) else time.time() + DEFAULT_TTL
+    now = time.time()
+    return {"name": f.name, "uri": f.uri, "mime_type": f.mime_type, "display_name": os.path.basename(filename),
+            "expires_at": expires_at, "validated_at": now}
+
+def _still_active(entry):
+    import google.generativeai as genai
+    try: return genai.get_file(entry["name"]).state.name == "ACTIVE"
+    except Exception: return False
+
+def get_uploaded_file(filename, registry=REGISTRY_PATH):
+    """Prompt part for `filename`, uploading only if no live remote copy is registered. None if missing/failed."""
+    if not os.path.exists(filename): return None
+    key = _entry_key(file_digest(filename))
+    with _lock:
+        lock = _inflight.setdefault(key, threading.Lock())
+    with tracing.span("knowledge.get_file", file=os.path.basename(filename)) as sp:
+        waited = time.perf_counter()
+        with lock:
+            sp.set(lock_wait_s=round(time.perf_counter() - waited, 4))  # e.g. waiting for the warm-up upload
+            entry = _load_registry(registry).get(key)
+            now = time.time()
+            if entry and entry["expires_at"] - EXPIRY_MARGIN > now:
+                if now - entry.get("validated_at", 0) < REVALIDATE_AFTER:
+                    sp.set(cache="hit", source="registry")
+                    return as_part(entry)
+                if _still_active(entry):
+                    entry["validated_at"] = now; _save_entry(key, entry, registry)
+                    sp.set(cache="hit", source="revalidated")
+                    return as_part(entry)
+            sp.set(cache="miss", source="upload")
+            try:
+                entry = _upload(filename)
+            except Exception as e:
+                sp.set(error=str(e)[:200])
+                return None
+            _save_entry(key, entry, registry)
+            return as_part(entry)
+
+def is_rejected(e):
+    """True for API errors meaning a file URI is no longer usable (expired, deleted, another project's)."""
+    text = str(e).lower()
+    return (getattr(e, "code", None) in (403, 404) or type(e).__name__ in ("NotFound", "PermissionDenied")
+            or ("file" in text and any(w in text for w in ("not found", "not exist", "permission", "expired"))))
+
+def invalidate(filename, registry=REGISTRY_PATH):
+    """Forget the remote copy (e.g. after the API rejects it) so the next call re-uploads."""
+    if os.path.exists(filename):
+        _save_entry(_entry_key(file_digest(filename)), None, registry)
+
+def warm_cache(filenames, registry=REGISTRY_PATH):
+    """Upload/revalidate `filenames` on a daemon thread so no user request pays for it."""
+    t = threading.Thread(target=lambda: [get_uploaded_file(f, registry) for f in filenames], name="knowledge-warmup", daemon=True)
+    t.start()
+    return t
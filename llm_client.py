@@ -0,0 +1,165 @@
+"""
+Gemini call layer: process-wide rate limiting, jittered retries and streaming.
+
+Every chat session in the server process draws from the same two token
+buckets (requests/min and tokens/min), so sessions queue briefly instead of
+all hitting the quota at once. On a 429 the server's retry hint (if any) is
+honoured and a shared cool-down makes other sessions wait it out too, rather
+than retrying in lockstep.
+
+Each call records a span (tracing.py) with one child per attempt, the time
+spent queued on the buckets, 429s, back-off sleep and token usage.
+"""
+import os
+import random
+import re
+import threading
+import time
+
+import tracing
+
+REQUESTS_PER_MIN = int(os.getenv("TAXGUIDE_RPM", "15"))
+TOKENS_PER_MIN = int(os.getenv("TAXGUIDE_TPM", "1000000"))
+MAX_RETRIES = 5
+BASE_DELAY = 1.0
+MAX_DELAY = 30.0
+
+class RateLimitError(Exception):
+    pass
+
+# --- 1. TOKEN BUCKETS ---
+
+class TokenBucket:
+    def __init__(self, capacity, per_second):
+        self.capacity, self.per_second = float(capacity), float(per_second)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.per_second)
+        self.updated = now
+
+    def acquire(self, n=1, timeout=None):
+        """Block until `n` tokens are available (a request larger than capacity waits for a full bucket)."""
+        n = min(n, self.capacity)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= n:
+                    self.tokens -= n
+                    return True
+                wait = (n - self.tokens) / self.per_second
+            if deadline is not None and time.monotonic() + wait > deadline: return False
+            time.sleep(min(wait, 1.0))
+
+    def debit(self, n):
+        """Charge usage discovered after the fact (may drive the bucket negative)."""
+        with self.lock:
+            self._refill()
+            self.tokens -= n
+
+request_bucket = TokenBucket(REQUESTS_PER_MIN, REQUESTS_PER_MIN / 60.0)
+token_bucket = TokenBucket(TOKENS_PER_MIN, TOKENS_PER_MIN / 60.0)
+_cooldown_until = 0.0
+_cooldown_lock = threading.Lock()
+
+def estimate_tokens(text):
+    return max(1, len(text) // 4) if isinstance(text, str) else 258  # file/image parts
+
+def _wait_for_slot(prompt):
+    """Block for the shared cool-down and both buckets; returns the seconds spent waiting."""
+    started = time.monotonic()
+    delay = _cooldown_until - started
+    if delay > 0: time.sleep(delay)
+    request_bucket.acquire(1)
+    token_bucket.acquire(estimate_tokens(prompt))
+    return time.monotonic() - started
+
+# --- 2. RETRY POLICY ---
+
+def is_rate_limited(e):
+    code = getattr(e, "code", None)
+    return code == 429 or type(e).__name__ in ("ResourceExhausted", "TooManyRequests") or "429" in str(e)
+
+def retry_hint(e):
+    """Server-suggested wait in seconds, from RetryInfo or 'retry in Ns' text, else None."""
+    m = re.search(r"retry_delay\s*\{\s*seconds:\s*(\d+)", str(e)) or re.search(r"retry (?:in|after) ([\d.]+)\s*s", str(e), re.I)
+    return float(m.group(1)) if m else None
+
+def backoff_delay(attempt, hint=None):
+    # Full jitter; a server hint sets the floor
+    delay = random.uniform(0, min(MAX_DELAY, BASE_DELAY * 2 ** (attempt + 1)))
+    return max(delay, hint + random.uniform(0, 1)) if hint else delay
+
+def _note_rate_limit(delay):
+    global _cooldown_until
+    with _cooldown_lock:
+        _cooldown_until = max(_cooldown_until, time.monotonic() + delay)
+
+def _record_usage(response, prompt, sp=tracing.NOOP):
+    usage = getattr(response, "usage_metadata", None)
+    total = getattr(usage, "total_token_count", 0) if usage else 0
+    if total: token_bucket.debit(max(0, total - estimate_tokens(prompt)))
+    if usage: sp.set(prompt_tokens=getattr(usage, "prompt_token_count", 0) or 0, output_tokens=getattr(usage, "candidates_token_count", 0) or 0)
+
+def _backoff(sp, attempt, e, retries):
+    """After a 429: record it on the call's span and sleep before the next attempt (not after the last one)."""
+    delay = backoff_delay(attempt, retry_hint(e))
+    _note_rate_limit(delay)  # other sessions still wait it out
+    sp.add("rate_limited", 1)
+    if attempt + 1 >= retries: return
+    sp.add("retry_sleep_s", round(delay, 3))
+    time.sleep(delay)
+
+# --- 3. CALLS ---
+
+def send_message_with_retry(chat_session, prompt, retries=MAX_RETRIES):
+    with tracing.span("llm.send") as sp:
+        for i in range(retries):
+            sp.add("queue_s", round(_wait_for_slot(prompt), 4))
+            attempt = sp.child("llm.attempt", attempt=i + 1)
+            try:
+                response = chat_session.send_message(prompt)
+                attempt.finish(status="ok")
+                _record_usage(response, prompt, sp)
+                return response
+            except Exception as e:
+                attempt.finish(status="rate_limited" if is_rate_limited(e) else "error")
+                if not is_rate_limited(e): raise
+                _backoff(sp, i, e, retries)
+        raise RateLimitError("⚠️ Server busy. Please wait 1 minute.")
+
+def stream_message(chat_session, prompt, retries=MAX_RETRIES):
+    """Yield response text chunks as they arrive. Retries only before the first chunk."""
+    # Not made current: the span must not leak into the caller's context between yields
+    sp = tracing.start("llm.stream")
+    consumer = 0.0  # time the caller spent between chunks (rendering), not waiting on the model
+    try:
+        for i in range(retries):
+            sp.add("queue_s", round(_wait_for_slot(prompt), 4))
+            attempt = sp.child("llm.attempt", attempt=i + 1)
+            started = False
+            try:
+                response = chat_session.send_message(prompt, stream=True)
+                for chunk in response:
+                    try: text = chunk.text
+                    except ValueError: text = ""  # non-text parts
+                    if text:
+                        if not started: attempt.set(ttft_s=round(attempt.duration, 4))
+                        started = True
+                        t = time.perf_counter()
+                        yield text
+                        consumer += time.perf_counter() - t
+                attempt.finish(status="ok")
+                _record_usage(response, prompt, sp)
+                return
+            except Exception as e:
+                attempt.finish(status="rate_limited" if is_rate_limited(e) else "error")
+                if started or not is_rate_limited(e): raise
+                _backoff(sp, i, e, retries)
+        raise RateLimitError("⚠️ Server busy. Please wait 1 minute.")
+    finally:
+        sp.finish(consumer_s=round(consumer, 4))
@@ -0,0 +1,187 @@
+"""
+Deterministic deduction optimizer built on `calculate_tax_detailed`.
+
+Tax in each regime is a monotone, piecewise-linear function of taxable income
+whose breakpoints are the slab thresholds, the 87A rebate limit and the
+surcharge tiers. Instead of scanning a grid, we invert that function segment by
+segment to find (a) the income at which old-regime tax reaches zero and (b) the
+income at which the old regime ties the new one. Every old-regime deduction
+lowers taxable income rupee for rupee, so the optimal plan is simply "deduct
+up to the first of: budget, section headroom, or the lowest-tax point".
+
+With a capital gains summary, every total comes from
+`capital_gains.tax_with_gains` (slab-rate gains on top of the taxable income,
+special-rate gains, rebate and surcharge on total income). That total is
+still monotone in taxable income, so the two points are found by bisection.
+"""
+import math
+from bisect import bisect_right
+
+from tax_engine import calculate_tax_detailed, compute_tax_breakdown
+from tax_rules import DEFAULT_FY, get_rule_table, slab_tax, apply_rebate, surcharge_rate
+
+# Order in which spare cash is allocated. Each rupee saves the same tax, so the
+# order only reflects how easy the instrument is to top up.
+SECTIONS = [
+    ("80c", "80C (PF/PPF/ELSS/LIC)"),
+    ("nps", "80CCD(1B) NPS"),
+    ("med80d", "80D Health Insurance"),
+    ("home_loan", "24(b) Home Loan Interest"),
+]
+# Sections funded from spare cash. Home-loan interest is an existing cost to
+# claim, not something to invest, so it is filled last and outside `budget`.
+INVESTABLE = ("80c", "nps", "med80d")
+
+# --- 1. PIECEWISE-LINEAR INVERSION ---
+
+def _continuous_total(table, income):
+    tax = apply_rebate(table, income, slab_tax(table, income))
+    return (tax + tax * surcharge_rate(table, income)) * (1 + table["cess"])
+
+def _breakpoints(table):
+    points = set(table["thresholds"]) | set(table["surcharge_thresholds"]) | {0, table["rebate"]["limit"]}
+    if table["rebate"]["marginal_relief"]:
+        # Where slab tax meets (income - limit) the relief stops binding.
+        limit = table["rebate"]["limit"]
+        for thr, rate, cum in zip(table["thresholds"], table["rates"], table["cum"]):
+            if rate < 1:
+                x = (cum - thr * rate + limit) / (1 - rate)
+                if x > limit: points.add(x)
+    return sorted(points)
+
+def max_income_for_tax(target, age=30, regime="old", fy=DEFAULT_FY):
+    """Largest whole-rupee taxable income whose total tax (with cess) is <= target, or None."""
+    table = get_rule_table(fy, regime, age)
+    total = lambda x: compute_tax_breakdown(x, age, regime, fy)["total"]
+    if total(0) > target: return None
+    points = _breakpoints(table) + [math.inf]
+    for lo, hi in zip(points, points[1:]):
+        if hi != math.inf and total(hi) <= target: continue
+        # total(lo) <= target < total(hi); the tax is linear on (lo, hi].
+        if hi == math.inf: x1, x2 = lo + 1, lo + 2
+        else: x1, x2 = lo + (hi - lo) / 3, lo + 2 * (hi - lo) / 3
+        f1, f2 = _continuous_total(table, x1), _continuous_total(table, x2)
+        slope = (f2 - f1) / (x2 - x1)
+        if slope <= 0: return math.inf
+        # int(total) <= target  <=>  total < target + 1
+        x = math.ceil(x1 + (target + 1 - f1) / slope) - 1
+        if hi != math.inf: x = min(x, math.ceil(hi) - 1)
+        x = max(math.floor(lo), x)
+        # Nudge past float error in the solve and the int() truncation.
+        while x > 0 and total(x) > target: x -= 1
+        while total(x + 1) <= target: x += 1
+        return x
+    return math.inf
+
+def _max_income_with_gains(target, gains, age, regime, fy):
+    """`max_income_for_tax` with capital gains folded in: bisect on the (monotone) total."""
+    from capital_gains import tax_with_gains  # only loaded when a trade ledger is in play
+    total = lambda x: tax_with_gains(x, gains, age, regime, fy)["total"]
+    if total(0) > target: return None
+    lo, hi = 0, 1
+    while total(hi) <= target:
+        if hi > 10 ** 12: return math.inf
+        lo, hi = hi, hi * 2
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if total(mid) <= target: lo = mid
+        else: hi = mid
+    return lo
+
+def _tax_fns(age, fy, gains):
+    """(total(income, regime), max_income(target, regime)) with or without capital gains."""
+    if not gains:
+        return (lambda x, r: compute_tax_breakdown(x, age, r, fy)["total"],
+                lambda t, r: max_income_for_tax(t, age, r, fy))
+    from capital_gains import tax_with_gains
+    return (lambda x, r: tax_with_gains(x, gains, age, r, fy)["total"],
+            lambda t, r: _max_income_with_gains(t, gains, age, r, fy))
+
+# --- 2. OPTIMIZER ---
+
+def section_headroom(age, inv_80c, med_80d, home_loan, nps):
+    limit_80d = 50000 if age >= 60 else 25000  # self & family
+    return {
+        "80c": max(0, 150000 - inv_80c),
+        "nps": max(0, 50000 - nps),
+        "med80d": max(0, limit_80d - med_80d),
+        "home_loan": max(0, 200000 - home_loan),
+    }
+
+def optimize_deductions(age, salary, business_income, rent_paid, hra_received, inv_80c, med_80d, home_loan, nps, edu_loan, donations, savings_int, other_deductions, custom_basic=0, budget=None, fy=DEFAULT_FY, gains=None):
+    """
+    Cheapest tax plan for a taxpayer with `budget` rupees of extra investable cash
+    (None = unlimited). Returns current taxes, the suggested per-section top-up
+    (`invest` of it from cash, the rest unclaimed home-loan interest), the
+    resulting taxes and the old-vs-new break-even point. `gains` is a
+    capital_gains summary; all taxes then include it.
+    """
+    res = calculate_tax_detailed(age, salary, business_income, rent_paid, hra_received, inv_80c, med_80d, home_loan, nps, edu_loan, donations, savings_int, other_deductions, custom_basic, fy)
+    total, max_income = _tax_fns(age, fy, gains)
+    net_old = res["old"]["net"]
+    new_total = total(res["new"]["net"], "new")
+    old_total = total(net_old, "old")
+
+    headroom = section_headroom(age, inv_80c, med_80d, home_loan, nps)
+    # Deductions stop helping once old-regime tax hits its floor (0, or the special-rate tax on gains)
+    floor_income = max_income(total(0, "old"), "old")
+    useful = max(0, math.ceil(net_old - floor_income))
+    cash = sum(headroom[k] for k in INVESTABLE)
+    if budget is not None: cash = min(cash, budget)
+    spend = min(cash + headroom["home_loan"], useful)
+
+    # A spend that leaves the old regime still worse than the new one is wasted.
+    opt_old_total = total(max(0, net_old - spend), "old")
+    if opt_old_total >= new_total:
+        spend, opt_old_total = 0, old_total
+
+    allocation, left = {}, min(spend, cash)
+    for key in INVESTABLE:
+        allocation[key] = int(min(headroom[key], left)); left -= allocation[key]
+    allocation["home_loan"] = int(spend - sum(allocation.values()))
+
+    breakeven_income = max_income(new_total, "old")
+    extra_to_breakeven = max(0, math.ceil(net_old - breakeven_income)) if breakeven_income is not None else None
+    reachable = extra_to_breakeven is not None and extra_to_breakeven <= sum(headroom.values())
+
+    best_regime = "new" if new_total <= opt_old_total else "old"
+    return {
+        "current": {"new": new_total, "old": old_total},
+        "headroom": headroom,
+        "allocation": allocation,
+        "spend": int(spend),
+        "invest": int(spend) - allocation["home_loan"],
+        "optimized": {"new": new_total, "old": opt_old_total},
+        "best_regime": best_regime,
+        "tax_saved": min(new_total, old_total) - min(new_total, opt_old_total),
+        "breakeven": {"old_taxable_income": breakeven_income, "extra_deductions_needed": extra_to_breakeven, "reachable": reachable},
+        "marginal_rate": _marginal_rate(net_old + (gains["slab_income"] if gains else 0), age, fy),
+    }
+
+def _marginal_rate(income, age, fy):
+    table = get_rule_table(fy, "old", age)
+    i = bisect_right(table["thresholds"], income) - 1
+    rate = table["rates"][i] if i >= 0 else 0.0
+    return rate * (1 + surcharge_rate(table, income)) * (1 + table["cess"])
+
+def format_plan(plan):
+    """Short markdown summary for the chat UI."""
+    labels = dict(SECTIONS)
+    cur, opt = plan["current"], plan["optimized"]
+    lines = []
+    if plan["spend"] > 0:
+        loan = plan["allocation"].get("home_loan", 0)
+        action = " and ".join(filter(None, [f"Investing **₹{plan['invest']:,}** more" if plan["invest"] else "",
+                                            f"claiming ₹{loan:,} more home loan interest" if loan else ""]))
+        lines.append(f"💡 {action[0].upper() + action[1:]} could cut your Old Regime tax from ₹{cur['old']:,} to **₹{opt['old']:,}**:")
+        lines += [f"- {labels[k]}: ₹{v:,}" for k, v in plan["allocation"].items() if v]
+    elif plan["best_regime"] == "old":
+        lines.append("💡 Your Old Regime deductions are already fully used for this income.")
+    else:
+        lines.append(f"💡 The **New Regime** stays cheaper (₹{cur['new']:,}); extra 80C/NPS/80D/Home Loan deductions won't reduce your tax.")
+    extra = plan["breakeven"]["extra_deductions_needed"]
+    if extra and plan["breakeven"].get("reachable", True):
+        lines.append(f"⚖️ Break-even: the Old Regime matches the New one after ₹{extra:,} of additional deductions.")
+    elif extra:
+        lines.append(f"⚖️ Break-even: the Old Regime can't match the New one, even using all ₹{sum(plan['headroom'].values()):,} of remaining deduction room.")
+    return "\n".join(lines)
@@ -0,0 +1,133 @@
+"""
+Local vector index over the ingested tax-rule chunks.
+
+Embeddings live in a `.npy` file as an L2-normalized float32 matrix that is
+memory-mapped on load, so every Streamlit worker shares the same OS page cache
+instead of unpickling its own copy. Chunk text and metadata sit in a JSONL
+sidecar (one line per matrix row). A top-k cosine query is a single mat-vec
+product plus argpartition.
+
+Each write produces a new generation (`<prefix>.<gen>.npy` / `.jsonl`) and
+then swaps the `<prefix>.json` manifest naming it, so a reader always opens
+a matching pair. Indexes from before the manifest (`<prefix>.npy` /
+`<prefix>.jsonl`) are still read.
+"""
+import glob
+import json
+import os
+import pickle
+import time
+
+import numpy as np
+
+import tracing
+
+DEFAULT_INDEX = "knowledge_index"
+LEGACY_PICKLE = "manual_memory.pkl"
+RETRIEVAL_MARKER = "\n\n---\nReference excerpts"  # separates a user question from injected chunks
+PERSONA_FILES = {"SALARY": "salary_rules.pdf", "BUSINESS": "freelancer_rules.pdf", "CAPITAL_GAINS": "capital_gains.pdf"}
+
+# --- 1. BUILD / CONVERT ---
+
+def _normalize(m):
+    m = np.asarray(m, dtype=np.float32)
+    norms = np.linalg.norm(m, axis=-1, keepdims=True)
+    return m / np.where(norms == 0, 1, norms)
+
+def index_files(prefix):
+    """(matrix path, chunks path) of the current generation, or None if no index has been written."""
+    try:
+        with open(prefix + ".json", encoding="utf-8") as f: manifest = json.load(f)
+        base = os.path.dirname(prefix)
+        return os.path.join(base, manifest["npy"]), os.path.join(base, manifest["jsonl"])
+    except (OSError, ValueError, KeyError): pass
+    if os.path.exists(prefix + ".npy") and os.path.exists(prefix + ".jsonl"):
+        return prefix + ".npy", prefix + ".jsonl"  # pre-manifest layout
+    return None
+
+def write_index(prefix, docs, vectors, metadata=None):
+    """Write docs + vectors as a new generation, then point `<prefix>.json` at it (one atomic rename)."""
+    matrix = _normalize(vectors).reshape(len(docs), -1)
+    metadata = metadata or [{} for _ in docs]
+    gen = f"{prefix}.{time.time_ns():x}{os.getpid():x}"
+    np.save(gen + ".npy", matrix)
+    with open(gen + ".jsonl", "w", encoding="utf-8") as f:
+        for doc, meta in zip(docs, metadata):
+            f.write(json.dumps(dict(meta, text=doc), ensure_ascii=False) + "\n")
+    tmp = f"{prefix}.json.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"npy": os.path.basename(gen + ".npy"), "jsonl": os.path.basename(gen + ".jsonl"), "count": len(docs)}, f)
+    os.replace(tmp, prefix + ".json")
+    _remove_old_generations(prefix, gen)
+
+def _remove_old_generations(prefix, keep):
+    # Open readers keep their mapping on POSIX; on Windows a mapped file can't be removed and waits for the next write
+    old = [p for p in glob.glob(glob.escape(prefix) + ".*.npy") + glob.glob(glob.escape(prefix) + ".*.jsonl")
+           if not p.startswith(keep + ".") and ".ckpt." not in p]
+    for path in old + [prefix + ".npy", prefix + ".jsonl"]:
+        try: os.remove(path)
+        except OSError: pass
+
+def index_from_pickle(pickle_path=LEGACY_PICKLE, prefix=DEFAULT_INDEX):
+    """Convert the {"docs", "vectors"} pickle written by the old ingest.py."""
+    with open(pickle_path, "rb") as f:
+        data = pickle.load(f)
+    write_index(prefix, data["docs"], data["vectors"], [{"source": "tax_rules.txt", "chunk": i} for i in range(len(data["docs"]))])
+
+# --- 2. QUERY ---
+
+class VectorIndex:
+    def __init__(self, prefix=DEFAULT_INDEX, attempts=3):
+        self.prefix = prefix
+        for attempt in range(attempts):
+            files = index_files(prefix)
+            if files is None: raise FileNotFoundError(f"No index at {prefix}")
+            try:
+                self.matrix = np.load(files[0], mmap_mode="r")
+                with open(files[1], encoding="utf-8") as f:
+                    self.chunks = [json.loads(line) for line in f if line.strip()]
+                break
+            except FileNotFoundError:  # a writer swapped generations and removed this one: read the manifest again
+                if attempt == attempts - 1: raise
+        if len(self.chunks) != self.matrix.shape[0]:
+            raise ValueError(f"{prefix}: {self.matrix.shape[0]} vectors but {len(self.chunks)} chunks")
+        self._personas = np.array([c.get("persona") or "" for c in self.chunks])
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def has_persona(self, persona):
+        return bool(persona) and bool((self._personas == persona).any())
+
+    def search(self, query_vector, k=4, persona=None, min_score=None):
+        """Top-k chunks by cosine similarity, best first. `persona` restricts to that persona's chunks."""
+        if not len(self.chunks): return []
+        with tracing.span("retrieval.search", k=k, persona=persona or "", chunks=len(self.chunks)):
+            return self._search(query_vector, k, persona, min_score)
+
+    def _search(self, query_vector, k, persona, min_score):
+        q = _normalize(query_vector)
+        scores = self.matrix @ q
+        if persona and self.has_persona(persona):
+            scores = np.where(self._personas == persona, scores, -np.inf)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            dict(self.chunks[i], score=float(scores[i])) for i in top
+            if np.isfinite(scores[i]) and (min_score is None or scores[i] >= min_score)
+        ]
+
+def load_index(prefix=DEFAULT_INDEX, pickle_path=LEGACY_PICKLE):
+    """Open the index, converting the legacy pickle first if no index has been built yet."""
+    if index_files(prefix) is None and os.path.exists(pickle_path):
+        index_from_pickle(pickle_path, prefix)
+    return VectorIndex(prefix)
+
+def format_context(hits):
+    """Render retrieved chunks as a compact, citable block for the prompt."""
+    lines = []
+    for h in hits:
+        where = h.get("source", "knowledge base") + (f", p.{h['page']}" if h.get("page") else "")
+        lines.append(f"[Source: {where}]\n{h['text'].strip()}")
+    return "\n\n".join(lines)
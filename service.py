@@ -0,0 +1,197 @@
+"""
+JSON-over-HTTP service for the headless engine (no Streamlit, no API key).
+
+    python service.py --port 8080 --workers 4
+
+    GET  /health
+    GET  /metrics       Prometheus text: p50/p95 per span, tokens, cache hits, errors
+    POST /v1/calculate  {"inputs": {"salary": "15L", "rent": 25000}, "fy": "2025-26"}
+    POST /v1/optimize   {"inputs": {...}, "budget": 100000}
+    POST /v1/parse      {"text": "Salary 15L, rent 25k, 80C 1.5L"}
+    POST /v1/math       {"expression": "slab_tax(15L, 'old')"}
+    POST /v1/batch      {"rows": [{"salary": 1500000}, ...], "fy": "2025-26"}
+    POST /v1/capital_gains  {"csv": "<broker trade ledger>", "fy": "2025-26"}
+
+/v1/calculate and /v1/optimize also take "capital_gains": <summary from /v1/capital_gains>.
+
+One asyncio loop serves every connection (HTTP/1.1 keep-alive). Single
+calculations take microseconds and run inline; batch requests are split into
+chunks and fanned out over a process pool, and bodies over `INLINE_JSON`
+bytes are decoded on a worker thread, so a large payroll never stalls other
+callers. Errors come back as {"error": "..."} with a 4xx/5xx status; bad
+inputs (unknown fields, malformed objects, wrong types) are 400s.
+Every /v1 request is traced (tracing.py) and its spans appended to the JSONL
+trace file.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import engine
+import tracing
+from tax_rules import DEFAULT_FY
+
+MAX_BODY = 64 * 1024 * 1024
+INLINE_JSON = 256 * 1024       # larger bodies are parsed off the event loop
+MAX_BATCH_ROWS = 1_000_000
+BATCH_CHUNK = 20_000
+READ_TIMEOUT = 30
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+# --- 1. HANDLERS ---
+
+def _inputs(body):
+    inputs = body.get("inputs", {})
+    if not isinstance(inputs, dict): raise HTTPError(400, "'inputs' must be an object")
+    return inputs
+
+def _gains(body):
+    gains = body.get("capital_gains")
+    if gains is None: return None
+    if not (isinstance(gains, dict) and isinstance(gains.get("special"), list) and {"slab_income", "special_surcharge_cap"} <= gains.keys()):
+        raise HTTPError(400, "'capital_gains' must be a summary returned by /v1/capital_gains")
+    return gains
+
+async def handle_calculate(body, pool):
+    return engine.calculate(_inputs(body), fy=body.get("fy", DEFAULT_FY), plan=body.get("plan", True), gains=_gains(body))
+
+async def handle_optimize(body, pool):
+    return engine.optimize(_inputs(body), budget=body.get("budget"), fy=body.get("fy", DEFAULT_FY), gains=_gains(body))
+
+async def handle_parse(body, pool):
+    intent = engine.parse_intent(str(body.get("text", "")))
+    return dict(intent, inputs=engine.normalize_inputs(intent["fields"]))
+
+async def handle_math(body, pool):
+    return {"result": engine.evaluate(str(body.get("expression", "")))}
+
+async def handle_batch(body, pool):
+    rows, fy = body.get("rows"), body.get("fy", DEFAULT_FY)
+    if not isinstance(rows, list) or not all(isinstance(r, dict) for r in rows): raise HTTPError(400, "'rows' must be a list of objects")
+    if len(rows) > MAX_BATCH_ROWS: raise HTTPError(413, f"At most {MAX_BATCH_ROWS:,} rows per request")
+    loop = asyncio.get_running_loop()
+    chunks = [rows[i:i + BATCH_CHUNK] for i in range(0, len(rows), BATCH_CHUNK)]
+    with tracing.span("batch.pool", rows=len(rows), chunks=len(chunks)):
+        parts = await asyncio.gather(*(loop.run_in_executor(pool, engine.calculate_batch, c, fy) for c in chunks))
+    return {"fy": fy, "count": len(rows), "results": [r for part in parts for r in part]}
+
+def _capital_gains(text, fy):
+    from capital_gains import compute_capital_gains
+    return compute_capital_gains(text.splitlines(), fy)
+
+async def handle_capital_gains(body, pool):
+    if not isinstance(body.get("csv"), str): raise HTTPError(400, "'csv' must be the ledger text")
+    with tracing.span("capital_gains.pool", bytes=len(body["csv"])):
+        return await asyncio.get_running_loop().run_in_executor(pool, _capital_gains, body["csv"], body.get("fy", DEFAULT_FY))
+
+ROUTES = {
+    "/v1/calculate": handle_calculate,
+    "/v1/optimize": handle_optimize,
+    "/v1/parse": handle_parse,
+    "/v1/math": handle_math,
+    "/v1/batch": handle_batch,
+    "/v1/capital_gains": handle_capital_gains,
+}
+
+# --- 2. HTTP PLUMBING ---
+
+async def _read_request(reader):
+    """(method, path, headers, body) or None when the client closed the connection."""
+    line = await asyncio.wait_for(reader.readline(), READ_TIMEOUT)
+    if not line: return None
+    try: method, target, _ = line.decode("latin-1").split(" ", 2)
+    except ValueError: raise HTTPError(400, "Malformed request line")
+    headers = {}
+    while True:
+        h = await asyncio.wait_for(reader.readline(), READ_TIMEOUT)
+        if h in (b"\r\n", b"\n", b""): break
+        k, _, v = h.decode("latin-1").partition(":")
+        headers[k.strip().lower()] = v.strip()
+    length = int(headers.get("content-length") or 0)
+    if length > MAX_BODY: raise HTTPError(413, f"Body larger than {MAX_BODY} bytes")
+    body = await asyncio.wait_for(reader.readexactly(length), READ_TIMEOUT) if length else b""
+    return method.upper(), target.split("?", 1)[0], headers, body
+
+def _response(status, payload, keep_alive):
+    if isinstance(payload, str): data, ctype = payload.encode(), "text/plain; version=0.0.4; charset=utf-8"
+    else: data, ctype = json.dumps(payload, separators=(",", ":")).encode(), "application/json"
+    head = (f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+            f"Content-Type: {ctype}\r\nContent-Length: {len(data)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode() + data
+
+async def dispatch(method, path, body, pool):
+    if path == "/health":
+        return 200, {"status": "ok", "fy": DEFAULT_FY}
+    if path == "/metrics":
+        return 200, tracing.metrics.prometheus()
+    handler = ROUTES.get(path)
+    if handler is None: raise HTTPError(404, f"No route {path}")
+    if method != "POST": raise HTTPError(405, "Use POST with a JSON body")
+    try:
+        if len(body) > INLINE_JSON:
+            with tracing.span("http.parse_json", bytes=len(body)):
+                payload = await asyncio.get_running_loop().run_in_executor(None, json.loads, body)
+        else:
+            payload = json.loads(body or b"{}")
+    except ValueError as e: raise HTTPError(400, f"Invalid JSON: {e}")
+    if not isinstance(payload, dict): raise HTTPError(400, "Body must be a JSON object")
+    try: return 200, await handler(payload, pool)
+    except HTTPError: raise
+    except (ValueError, ArithmeticError) as e: raise HTTPError(400, str(e))  # bad inputs, unknown FY, bad expression
+    except KeyError as e: raise HTTPError(400, f"Missing field {e} in the request")  # e.g. an incomplete nested object
+    except TypeError as e: raise HTTPError(400, f"Invalid input: {e}")  # wrong type, e.g. comparing text with a number
+
+def make_handler(pool):
+    async def handle_connection(reader, writer):
+        try:
+            while True:
+                keep_alive, root = False, tracing.NOOP
+                try:
+                    request = await _read_request(reader)
+                    if request is None: break
+                    method, path, headers, body = request
+                    keep_alive = headers.get("connection", "").lower() != "close"
+                    if path in ROUTES: root = tracing.start_trace(f"http {path}", method=method)
+                    status, payload = await dispatch(method, path, body, pool)
+                except HTTPError as e:
+                    status, payload = e.status, {"error": str(e)}
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except Exception as e:
+                    status, payload = 500, {"error": f"{type(e).__name__}: {e}"}
+                tracing.end_trace(root.set(status=status))
+                writer.write(_response(status, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive: break
+        finally:
+            writer.close()
+    return handle_connection
+
+async def serve(host="127.0.0.1", port=8080, workers=None):
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        server = await asyncio.start_server(make_handler(pool), host, port)
+        print(f"✅ TaxGuide engine listening on http://{host}:{port}", file=sys.stderr)
+        async with server:
+            await server.serve_forever()
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="HTTP/JSON service for the TaxGuide calculators.")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8080)
+    p.add_argument("--workers", type=int, default=None, help="Processes for /v1/batch (default: CPU count)")
+    args = p.parse_args(argv)
+    try: asyncio.run(serve(args.host, args.port, args.workers))
+    except KeyboardInterrupt: pass
+
+if __name__ == "__main__":
+    main()
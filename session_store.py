@@ -0,0 +1,168 @@
+"""
+Externalized chat sessions, so any worker or replica can serve any user.
+
+A session is a small JSON document: mode, loaded persona, the compacted model
+history (text parts plus file references), the display transcript (calculator
+turns keep only their inputs; results are recomputed on load) and a version
+number that increases on every save.
+
+- `SessionStore` is the interface: load / save / delete / version on plain
+  dicts. A networked store (Redis, Postgres, ...) only needs those four.
+- `SQLiteSessionStore` is the local implementation.
+- `CachedSessionStore` keeps the most recently used sessions in memory and
+  only re-reads one from the backend when another worker has saved a newer
+  version.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from chat_context import compact_history
+
+SESSION_PATH = os.path.join(".taxguide_cache", "sessions.sqlite")
+SESSION_TTL = 7 * 24 * 3600
+HOT_SESSIONS = int(os.getenv("TAXGUIDE_HOT_SESSIONS", "256"))
+
+def new_session_id():
+    return uuid.uuid4().hex
+
+# --- 1. SERIALIZATION ---
+
+def _serialize_part(part):
+    if isinstance(part, str): return part
+    if isinstance(part, dict): return part
+    text = getattr(part, "text", "")
+    if text: return text
+    fd = getattr(part, "file_data", None)
+    if fd is not None and getattr(fd, "file_uri", ""):
+        return {"file_data": {"mime_type": fd.mime_type, "file_uri": fd.file_uri}}
+    return None
+
+def serialize_history(history):
+    """JSON-safe [{"role", "parts"}] for a ChatSession history (dicts or protos)."""
+    out = []
+    for msg in history:
+        role, parts = (msg.get("role"), msg.get("parts", [])) if isinstance(msg, dict) else (msg.role, msg.parts)
+        parts = [p for p in map(_serialize_part, parts) if p is not None]
+        if parts: out.append({"role": role, "parts": parts})
+    return out
+
+def snapshot(history, transcript, **fields):
+    """Session document for the store: compacted history, transcript without recomputable results."""
+    compact, _ = compact_history(history)
+    return dict(fields,
+                history=serialize_history(compact),
+                transcript=[{k: v for k, v in item.items() if k != "res"} for item in transcript])
+
+# --- 2. STORES ---
+
+class SessionStore:
+    """Interface for session backends. Values are JSON-serializable dicts."""
+
+    def load(self, session_id):
+        raise NotImplementedError
+
+    def save(self, session_id, state):
+        """Persist `state`; returns the new version number."""
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        raise NotImplementedError
+
+    def version(self, session_id):
+        """Current version of a session (None if unknown). Override with something cheaper than a full load."""
+        state = self.load(session_id)
+        return state["version"] if state else None
+
+class SQLiteSessionStore(SessionStore):
+    def __init__(self, path=SESSION_PATH, ttl=SESSION_TTL):
+        self.ttl = ttl
+        if path != ":memory:": os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, version INTEGER, state TEXT, updated REAL)")
+
+    def load(self, session_id):
+        with self._lock:
+            row = self._db.execute("SELECT version, state, updated FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if row is None or time.time() - row[2] > self.ttl: return None
+        return dict(json.loads(row[1]), version=row[0])
+
+    def version(self, session_id):
+        with self._lock:
+            row = self._db.execute("SELECT version, updated FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if row is None or time.time() - row[1] > self.ttl: return None
+        return row[0]
+
+    def save(self, session_id, state):
+        now = time.time()
+        data = json.dumps({k: v for k, v in state.items() if k != "version"}, separators=(",", ":"))
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO sessions VALUES (?, 1, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET version = version + 1, state = excluded.state, updated = excluded.updated",
+                (session_id, data, now))
+            version = self._db.execute("SELECT version FROM sessions WHERE id = ?", (session_id,)).fetchone()[0]
+            self._db.execute("DELETE FROM sessions WHERE updated < ?", (now - self.ttl,))
+        return version
+
+    def delete(self, session_id):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+class CachedSessionStore(SessionStore):
+    """In-memory LRU of hot sessions in front of a shared backend (write-through)."""
+
+    def __init__(self, backend, max_hot=HOT_SESSIONS):
+        self.backend, self.max_hot = backend, max_hot
+        self._hot = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, session_id, state):
+        with self._lock:
+            self._hot[session_id] = state
+            self._hot.move_to_end(session_id)
+            while len(self._hot) > self.max_hot: self._hot.popitem(last=False)
+
+    def load(self, session_id):
+        with self._lock:
+            hot = self._hot.get(session_id)
+        # Another worker may have saved since; a version check is much cheaper than a full load
+        if hot is not None and hot["version"] == self.backend.version(session_id):
+            with self._lock: self._hot.move_to_end(session_id)
+            return hot
+        state = self.backend.load(session_id)
+        if state is None:
+            with self._lock: self._hot.pop(session_id, None)
+            return None
+        self._remember(session_id, state)
+        return state
+
+    def save(self, session_id, state):
+        version = self.backend.save(session_id, state)
+        self._remember(session_id, dict(state, version=version))
+        return version
+
+    def delete(self, session_id):
+        self.backend.delete(session_id)
+        with self._lock: self._hot.pop(session_id, None)
+
+    def version(self, session_id):
+        return self.backend.version(session_id)
+
+_store = None
+
+def get_session_store():
+    global _store
+    if _store is None: _store = CachedSessionStore(SQLiteSessionStore())
+    return _store
+
+def set_session_store(store):
+    global _store
+    _store = store
@@ -0,0 +1,68 @@
+"""
+Deterministic tax calculators shared by the Streamlit app and the batch engine.
+"""
+from tax_rules import DEFAULT_FY, get_rule_table, slab_tax, apply_rebate, surcharge_rate
+
+def calculate_hra_exemption(basic_annual, rent_annual, hra_received_annual, metro=True):
+    cond1 = hra_received_annual
+    cond2 = rent_annual - (0.10 * basic_annual)
+    cond3 = (0.50 if metro else 0.40) * basic_annual
+    exemption = max(0, min(cond1, cond2, cond3))
+    return int(exemption)
+
+def calculate_tax_detailed(age, salary, business_income, rent_paid, hra_received, inv_80c, med_80d, home_loan, nps, edu_loan, donations, savings_int, other_deductions, custom_basic=0, fy=DEFAULT_FY):
+    std_deduction_new = get_rule_table(fy, "new")["std_deduction"]
+    std_deduction_old = get_rule_table(fy, "old")["std_deduction"]
+    
+    basic = 0
+    if custom_basic > 0:
+        if custom_basic < 100: basic = salary * (custom_basic / 100.0)
+        else: basic = custom_basic
+    else:
+        basic = salary * 0.50 
+
+    final_hra_received = hra_received
+    if hra_received == 0:
+        final_hra_received = basic * 0.40
+
+    final_rent = rent_paid
+    if rent_paid > 0 and rent_paid < (salary * 0.15):
+        final_rent = rent_paid * 12 
+
+    hra_exemption = calculate_hra_exemption(basic, final_rent, final_hra_received, metro=True) 
+    
+    limit_80tta = 50000 if age >= 60 else 10000
+    deduction_80tta = min(savings_int, limit_80tta)
+    
+    deductions_old = (
+        std_deduction_old + hra_exemption + min(inv_80c, 150000) + med_80d + 
+        min(home_loan, 200000) + min(nps, 50000) + edu_loan + 
+        donations + deduction_80tta + other_deductions
+    )
+    
+    net_old = max(0, (salary + business_income * 0.5) - deductions_old)
+    net_new = max(0, (salary + business_income * 0.5) - std_deduction_new)
+
+    bd_new = compute_tax_breakdown(net_new, age, "new", fy)
+    bd_old = compute_tax_breakdown(net_old, age, "old", fy)
+    
+    return {
+        "new": {"breakdown": bd_new, "net": net_new},
+        "old": {
+            "breakdown": bd_old, 
+            "net": net_old, 
+            "deductions": {
+                "std": std_deduction_old, "hra": hra_exemption, "80c": min(inv_80c, 150000), 
+                "med80d": med_80d, "home_loan": min(home_loan, 200000), "nps": min(nps, 50000),
+                "80e": edu_loan, "80g": donations, "80tta": deduction_80tta, "other": other_deductions
+            }, 
+            "assumptions": {"basic": basic, "rent_annual": final_rent, "hra_received": final_hra_received}
+        }
+    }
+
+def compute_tax_breakdown(income, age, regime, fy=DEFAULT_FY):
+    table = get_rule_table(fy, regime, age)
+    tax = apply_rebate(table, income, slab_tax(table, income))
+    surcharge = tax * surcharge_rate(table, income)
+    cess = (tax + surcharge) * table["cess"]
+    return {"base": int(tax), "surcharge": int(surcharge), "cess": int(cess), "total": int(tax + surcharge + cess)}
@@ -0,0 +1,138 @@
+"""
+Year-versioned income tax rule tables (slabs, 87A rebate, surcharge, cess).
+
+Each table precomputes the cumulative tax at every slab threshold, so tax on
+any income is one bisect plus one multiply-add. To support a new financial
+year, add an entry to RULES; nothing else needs to change.
+"""
+from bisect import bisect_left, bisect_right
+
+DEFAULT_FY = "2025-26"
+
+# --- 1. RULE SPECS ---
+# slabs_by_age: {minimum age: [(slab start, marginal rate), ...]}
+# surcharge: [(income above, rate), ...] on the slab tax after rebate
+_OLD_REGIME = {
+    "std_deduction": 50000,
+    "slabs_by_age": {
+        0: [(0, 0.0), (250000, 0.05), (500000, 0.20), (1000000, 0.30)],
+        60: [(0, 0.0), (300000, 0.05), (500000, 0.20), (1000000, 0.30)],
+        80: [(0, 0.0), (500000, 0.20), (1000000, 0.30)],
+    },
+    "rebate": {"limit": 500000, "max": 12500, "marginal_relief": False},
+    "surcharge": [(5000000, 0.10), (10000000, 0.15), (20000000, 0.25), (50000000, 0.37)],
+    "cess": 0.04,
+}
+
+RULES = {
+    "2024-25": {
+        "new": {
+            "std_deduction": 75000,
+            "slabs_by_age": {
+                0: [(0, 0.0), (300000, 0.05), (700000, 0.10), (1000000, 0.15), (1200000, 0.20), (1500000, 0.30)],
+            },
+            "rebate": {"limit": 700000, "max": 25000, "marginal_relief": True},
+            "surcharge": [(5000000, 0.10), (10000000, 0.15), (20000000, 0.25)],
+            "cess": 0.04,
+        },
+        "old": _OLD_REGIME,
+    },
+    "2025-26": {
+        "new": {
+            "std_deduction": 75000,
+            "slabs_by_age": {
+                0: [(0, 0.0), (400000, 0.05), (800000, 0.10), (1200000, 0.15), (1600000, 0.20), (2000000, 0.25), (2400000, 0.30)],
+            },
+            "rebate": {"limit": 1200000, "max": 60000, "marginal_relief": True},
+            "surcharge": [(5000000, 0.10), (10000000, 0.15), (20000000, 0.25)],
+            "cess": 0.04,
+        },
+        "old": _OLD_REGIME,
+    },
+}
+
+# --- 2. COMPILED TABLES ---
+
+def build_table(spec, slabs):
+    """Compile one slab list into a lookup table with cumulative tax at each threshold."""
+    thresholds, rates, cum = [], [], []
+    for start, rate in slabs:
+        if thresholds and start == thresholds[-1]:
+            rates[-1] = rate  # zero-width slab (e.g. super senior 5% band)
+            continue
+        cum.append(cum[-1] + (start - thresholds[-1]) * rates[-1] if thresholds else 0.0)
+        thresholds.append(start); rates.append(rate)
+    return {
+        "thresholds": thresholds, "rates": rates, "cum": cum,
+        "std_deduction": spec["std_deduction"], "rebate": spec["rebate"], "cess": spec["cess"],
+        "surcharge_thresholds": [t for t, _ in spec["surcharge"]],
+        "surcharge_rates": [r for _, r in spec["surcharge"]],
+    }
+
+_TABLES = {}
+for _fy, _regimes in RULES.items():
+    for _regime, _spec in _regimes.items():
+        _bands = sorted(_spec["slabs_by_age"].items(), reverse=True)
+        _TABLES[(_fy, _regime)] = [(min_age, build_table(_spec, slabs)) for min_age, slabs in _bands]
+
+def get_rule_table(fy=DEFAULT_FY, regime="new", age=0):
+    """Return the compiled table for a financial year, regime and taxpayer age."""
+    try:
+        bands = _TABLES[(fy, regime)]
+    except KeyError:
+        raise ValueError(f"No tax rules for FY {fy} / {regime} regime. Known years: {', '.join(RULES)}")
+    for min_age, table in bands:
+        if age >= min_age:
+            return table
+    return bands[-1][1]
+
+def get_age_bands(fy=DEFAULT_FY, regime="new"):
+    """[(min_age, table), ...] from oldest band down, for callers that vectorize over age."""
+    get_rule_table(fy, regime)
+    return _TABLES[(fy, regime)]
+
+# --- 3. LOOKUPS ---
+
+def slab_tax(table, income):
+    i = bisect_right(table["thresholds"], income) - 1
+    if i < 0: return 0.0
+    return table["cum"][i] + (income - table["thresholds"][i]) * table["rates"][i]
+
+def apply_rebate(table, income, tax):
+    """Section 87A rebate, with marginal relief just above the limit where the regime allows it."""
+    rebate = table["rebate"]
+    if income <= rebate["limit"]:
+        return max(0, tax - rebate["max"])
+    if rebate["marginal_relief"]:
+        return min(tax, income - rebate["limit"])
+    return tax
+
+def surcharge_rate(table, income):
+    i = bisect_left(table["surcharge_thresholds"], income) - 1
+    return table["surcharge_rates"][i] if i >= 0 else 0.0
+
+# --- 4. CAPITAL GAINS ---
+# rates: [(first sale date, {bucket: rate}), ...]; a year can change rates mid-way (Budget, 23 Jul 2024).
+# stcg_111a: listed equity held <= equity_months; ltcg_112a: listed equity held longer (above the exemption);
+# ltcg_112: other assets held > other_months (no indexation). Other short-term gains are taxed at slab rates.
+CAPITAL_GAINS_RULES = {
+    "2024-25": {
+        "equity_months": 12, "other_months": 24, "exemption_112a": 125000, "special_surcharge_cap": 0.15,
+        "rates": [
+            ("2024-04-01", {"stcg_111a": 0.15, "ltcg_112a": 0.10, "ltcg_112": 0.20}),
+            ("2024-07-23", {"stcg_111a": 0.20, "ltcg_112a": 0.125, "ltcg_112": 0.125}),
+        ],
+    },
+    "2025-26": {
+        "equity_months": 12, "other_months": 24, "exemption_112a": 125000, "special_surcharge_cap": 0.15,
+        "rates": [
+            ("2025-04-01", {"stcg_111a": 0.20, "ltcg_112a": 0.125, "ltcg_112": 0.125}),
+        ],
+    },
+}
+
+def get_capital_gains_rules(fy=DEFAULT_FY):
+    try:
+        return CAPITAL_GAINS_RULES[fy]
+    except KeyError:
+        raise ValueError(f"No capital gains rules for FY {fy}. Known years: {', '.join(CAPITAL_GAINS_RULES)}")
@@ -0,0 +1,122 @@
+"""
+Tool-call protocol for the chat model.
+
+The model writes calls inline, e.g.
+
+    LOAD(SALARY)
+    SEARCH_WEB(tuition reimbursement taxable)
+    CALCULATE(salary=1500000, rent=25000)
+
+`parse_tool_calls` finds every call in a reply (balanced parentheses, quotes
+allowed), `ToolRegistry.run` executes independent calls concurrently, and
+`format_tool_results` packs all outputs into a single follow-up message, so
+one model round trip can use several tools.
+"""
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import tracing
+
+_CALL_START = re.compile(r"\b([A-Z][A-Z_]*)\(")
+
+# --- 1. PARSER ---
+
+def _read_args(text, start):
+    """Index just past the ')' closing the call opened at text[start - 1], or None if unbalanced."""
+    depth, quote = 1, None
+    for i in range(start, len(text)):
+        ch = text[i]
+        if quote:
+            if ch == quote: quote = None
+        elif ch in "\"`": quote = ch  # not ', which shows up in plain words
+        elif ch == "(": depth += 1
+        elif ch == ")":
+            depth -= 1
+            if depth == 0: return i + 1
+    return None
+
+def _clean(args):
+    args = args.strip()
+    if len(args) >= 2 and args[0] == args[-1] and args[0] in "\"'`": args = args[1:-1]
+    return args.strip()
+
+def parse_tool_calls(text, names):
+    """[{"name", "args", "raw"}] for every call to one of `names`, in order, without exact duplicates."""
+    calls, seen, pos = [], set(), 0
+    while True:
+        m = _CALL_START.search(text, pos)
+        if not m: break
+        if m.group(1) not in names:
+            pos = m.end(); continue
+        end = _read_args(text, m.end())
+        if end is None:  # unclosed call: take the rest of the line
+            end = text.find("\n", m.end()); end = len(text) if end < 0 else end
+            args = text[m.end():end].rstrip().rstrip(")")
+        else:
+            args = text[m.end():end - 1]
+        call = {"name": m.group(1), "args": _clean(args), "raw": text[m.start():end].strip()}
+        if (call["name"], call["args"]) not in seen:
+            seen.add((call["name"], call["args"])); calls.append(call)
+        pos = end
+    return calls
+
+_RESULT_LINE = re.compile(r"^[ \t]*(?:Tool Results|(?:Search |Math )?Result(?: shown)?):.*(?:\n|$)", re.M)
+
+def strip_tool_calls(text, names):
+    """`text` without tool calls or echoed result lines, for showing to the user."""
+    for call in parse_tool_calls(text, names):
+        text = text.replace(call["raw"], "")
+    text = _RESULT_LINE.sub("", text)
+    return re.sub(r"\n{3,}", "\n\n", text).strip()
+
+# --- 2. REGISTRY & EXECUTION ---
+
+class ToolRegistry:
+    def __init__(self, max_workers=4):
+        self.tools = {}
+        self.max_workers = max_workers
+
+    def register(self, name, handler, followup=True, description=""):
+        """
+        `handler(args, ctx)` returns {"output": text for the model, "data": anything for the UI}.
+        followup=False marks tools whose result is shown directly and needs no model reply.
+        """
+        self.tools[name] = {"handler": handler, "followup": followup, "description": description}
+
+    def names(self):
+        return list(self.tools)
+
+    def parse(self, text):
+        return parse_tool_calls(text, self.tools)
+
+    def strip(self, text):
+        return strip_tool_calls(text, self.tools)
+
+    def _run_one(self, call, ctx):
+        tool = self.tools[call["name"]]
+        with tracing.span(f"tool.{call['name']}", args=call["args"][:120]) as sp:
+            try:
+                result = tool["handler"](call["args"], ctx) or {}
+            except Exception as e:
+                result = {"output": f"Tool error: {e}", "error": str(e)}
+                sp.set(error=str(e)[:200])
+        return dict(call, followup=tool["followup"], **result)
+
+    def run(self, calls, ctx=None):
+        """Execute `calls` concurrently; results come back in call order."""
+        if len(calls) <= 1:
+            return [self._run_one(c, ctx) for c in calls]
+        run_one = tracing.bind(lambda c: self._run_one(c, ctx))  # tool spans stay under the turn's span
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(calls))) as pool:
+            return list(pool.map(run_one, calls))
+
+def needs_followup(results):
+    return any(r["followup"] for r in results)
+
+def format_tool_results(results):
+    """One follow-up message carrying every tool output."""
+    lines = ["Tool Results:"]
+    for i, r in enumerate(results, 1):
+        lines.append(f"[{i}] {r['raw']}\n{r.get('output', '')}")
+    lines.append("Answer the user's question using all results above. Cite sources (PDF name or URL).")
+    return "\n\n".join(lines)
@@ -0,0 +1,325 @@
+"""
+Per-turn tracing and metrics for the chat app and the HTTP service.
+
+A trace is a tree of spans: the root is one chat turn (or one HTTP request),
+children are model calls, retry back-offs, tool runs, searches, uploads,
+cache lookups and rendering. Instrumented code just opens spans:
+
+    with tracing.span("search.query", query=q) as sp:
+        ...
+        sp.set(cache="hit")
+
+Outside a trace `span` returns a shared no-op, so library code costs
+(almost) nothing when nobody is tracing. The current span lives in a
+contextvar; `bind(fn)` carries it into worker threads.
+
+When a trace ends its spans are
+- appended to a JSONL file, one span per line (TAXGUIDE_TRACE_PATH),
+- folded into process-wide metrics: per-span-name p50/p95 durations over a
+  sliding window, plus counters for tokens, rate limits, retry sleep, cache
+  hits/misses and errors,
+- written out in Prometheus text format (TAXGUIDE_METRICS_PATH, at most once
+  per second) for a node-exporter textfile collector; service.py also serves
+  it on GET /metrics.
+
+    python tracing.py summary .taxguide_cache/traces.jsonl               # p50/p95 per span across workers
+    python tracing.py summary .taxguide_cache/traces.jsonl --prometheus
+
+Set TAXGUIDE_TRACING=0 to switch everything off.
+"""
+import argparse
+import contextvars
+import json
+import math
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+ENABLED = os.getenv("TAXGUIDE_TRACING", "1") != "0"
+TRACE_PATH = os.getenv("TAXGUIDE_TRACE_PATH", os.path.join(".taxguide_cache", "traces.jsonl"))
+METRICS_PATH = os.getenv("TAXGUIDE_METRICS_PATH", os.path.join(".taxguide_cache", "metrics.prom"))
+TRACE_MAX_BYTES = 50 * 1024 * 1024  # then rotated to <path>.1
+METRICS_WINDOW = 2048               # recent durations kept per span name for percentiles
+METRICS_FLUSH_INTERVAL = 1.0
+
+_current = contextvars.ContextVar("taxguide_span", default=None)
+
+# --- 1. SPANS ---
+
+class Span:
+    __slots__ = ("trace", "id", "parent_id", "name", "attrs", "start", "end", "_token")
+
+    def __init__(self, name, trace=None, parent_id=None, attrs=None):
+        self.name, self.parent_id, self.attrs = name, parent_id, attrs or {}
+        self.id = os.urandom(8).hex()
+        self.trace = trace if trace is not None else {"id": self.id, "wall": time.time(), "spans": []}
+        self.trace["spans"].append(self)
+        self.start, self.end, self._token = time.perf_counter(), None, None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+        return self
+
+    def add(self, key, amount):
+        """Accumulate a numeric attribute (token counts, sleep seconds, ...)."""
+        self.attrs[key] = self.attrs.get(key, 0) + amount
+        return self
+
+    def child(self, name, **attrs):
+        """A started child span that is not made current (for generators and manual timing); call `finish`."""
+        return Span(name, self.trace, self.id, attrs)
+
+    def finish(self, **attrs):
+        if attrs: self.attrs.update(attrs)
+        if self.end is None: self.end = time.perf_counter()
+        return self
+
+    @property
+    def duration(self):
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+class _NoopSpan:
+    """Stand-in returned outside a trace; every method is a cheap no-op."""
+    attrs = {}
+    duration = 0.0
+    def set(self, **attrs): return self
+    def add(self, key, amount): return self
+    def child(self, name, **attrs): return self
+    def finish(self, **attrs): return self
+
+NOOP = _NoopSpan()
+
+def current():
+    return _current.get()
+
+@contextmanager
+def span(name, **attrs):
+    """Child of the current span, made current for the block; a no-op outside a trace."""
+    parent = _current.get()
+    if parent is None:
+        yield NOOP
+        return
+    s = parent.child(name, **attrs)
+    token = _current.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.set(error=f"{type(e).__name__}: {e}"[:200])
+        raise
+    finally:
+        _current.reset(token)
+        s.finish()
+
+def start(name, **attrs):
+    """Started child of the current span without making it current (safe across generator yields)."""
+    parent = _current.get()
+    return parent.child(name, **attrs) if parent is not None else NOOP
+
+def bind(fn):
+    """Wrap `fn` so it runs under the caller's current span, e.g. before handing it to a thread pool."""
+    parent = _current.get()
+    if parent is None: return fn
+    def bound(*args, **kwargs):
+        token = _current.set(parent)
+        try: return fn(*args, **kwargs)
+        finally: _current.reset(token)
+    return bound
+
+# --- 2. TRACES ---
+
+def start_trace(name, **attrs):
+    """Begin a new trace (always a root, whatever is current) and make its root span current."""
+    if not ENABLED: return NOOP
+    root = Span(name, attrs=attrs)
+    root._token = _current.set(root)
+    return root
+
+def end_trace(root, export=True):
+    """Finish `root`, restore the previous current span and export the trace. Returns the span tree (or None)."""
+    if root is NOOP: return None
+    root.finish()
+    try: _current.reset(root._token)
+    except ValueError: _current.set(None)  # ended from a different context
+    if not export: return None
+    spans = [s for s in root.trace["spans"] if s.end is not None]
+    metrics.observe_trace(spans)
+    if TRACE_PATH: _write_jsonl(root.trace, spans)
+    if METRICS_PATH: metrics.flush(METRICS_PATH)
+    return tree(root)
+
+def _json_attrs(attrs):
+    return {k: (v if isinstance(v, (str, int, float, bool)) or v is None else str(v)) for k, v in attrs.items()}
+
+def span_record(trace, s):
+    root = trace["spans"][0]
+    return {"trace_id": trace["id"], "span_id": s.id, "parent_id": s.parent_id, "name": s.name,
+            "start": round(trace["wall"] + (s.start - root.start), 6), "duration_ms": round(s.duration * 1e3, 3),
+            "attrs": _json_attrs(s.attrs)}
+
+_write_lock = threading.Lock()
+
+def _write_jsonl(trace, spans, path=None):
+    path = path or TRACE_PATH
+    lines = "".join(json.dumps(span_record(trace, s), ensure_ascii=False) + "\n" for s in spans)
+    try:
+        with _write_lock:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            if os.path.exists(path) and os.path.getsize(path) > TRACE_MAX_BYTES: os.replace(path, path + ".1")
+            with open(path, "a", encoding="utf-8") as f: f.write(lines)
+    except OSError:
+        pass  # tracing must never break a turn
+
+def tree(root):
+    """Nested {"name", "at_ms", "ms", "attrs", "children"} view of a finished trace, children in start order."""
+    spans = sorted(root.trace["spans"], key=lambda s: s.start)
+    nodes = {s.id: {"name": s.name, "at_ms": round((s.start - root.start) * 1e3, 2), "ms": round(s.duration * 1e3, 2),
+                    "attrs": _json_attrs(s.attrs), "children": []} for s in spans}
+    for s in spans:
+        if s.parent_id in nodes: nodes[s.parent_id]["children"].append(nodes[s.id])
+    return nodes[root.id]
+
+def flatten(node, depth=0):
+    """(depth, node) pairs in display order."""
+    yield depth, node
+    for c in node["children"]: yield from flatten(c, depth + 1)
+
+def turn_breakdown(node):
+    """Where a turn's time went: model, queueing, retry sleep, tools, uploads and rendering (ms), plus tokens and cache results."""
+    out = dict.fromkeys(("model_ms", "queue_ms", "retry_sleep_ms", "tools_ms", "upload_ms", "render_ms", "prompt_tokens", "output_tokens",
+                         "cache_hits", "cache_misses"), 0)
+    out["total_ms"] = node["ms"]
+    for _, n in flatten(node):
+        name, a = n["name"], n["attrs"]
+        consumer = a.get("consumer_s", 0) * 1e3  # caller time inside a streamed reply, i.e. rendering
+        if name == "llm.attempt": out["model_ms"] += n["ms"]
+        elif name.startswith("llm."):
+            out["model_ms"] -= consumer; out["render_ms"] += consumer
+            out["queue_ms"] += a.get("queue_s", 0) * 1e3; out["retry_sleep_ms"] += a.get("retry_sleep_s", 0) * 1e3
+            out["prompt_tokens"] += a.get("prompt_tokens", 0); out["output_tokens"] += a.get("output_tokens", 0)
+        elif name == "tools": out["tools_ms"] += n["ms"]
+        elif name == "knowledge.get_file": out["upload_ms"] += n["ms"]
+        elif name.startswith("render."): out["render_ms"] += n["ms"]
+        if a.get("cache") == "hit": out["cache_hits"] += 1
+        elif a.get("cache") == "miss": out["cache_misses"] += 1
+    return {k: round(v, 2) if isinstance(v, float) else v for k, v in out.items()}
+
+# --- 3. METRICS ---
+
+# Numeric span attributes that also feed counters: attr -> (metric, extra labels)
+COUNTERS = {
+    "prompt_tokens": ("taxguide_llm_tokens_total", {"kind": "prompt"}),
+    "output_tokens": ("taxguide_llm_tokens_total", {"kind": "output"}),
+    "rate_limited": ("taxguide_rate_limited_total", {}),
+    "retry_sleep_s": ("taxguide_retry_sleep_seconds_total", {}),
+}
+HELP = {
+    "taxguide_span_duration_seconds": ("summary", "Span duration by span name (sliding window quantiles)"),
+    "taxguide_llm_tokens_total": ("counter", "Gemini tokens reported in usage metadata"),
+    "taxguide_rate_limited_total": ("counter", "Calls answered with a rate-limit error, by span"),
+    "taxguide_retry_sleep_seconds_total": ("counter", "Seconds slept in retry back-off, by span"),
+    "taxguide_cache_requests_total": ("counter", "Cache lookups by cache and result"),
+    "taxguide_span_errors_total": ("counter", "Spans that ended with an error, by span"),
+}
+
+def percentile(values, q):
+    s = sorted(values)
+    return s[max(0, math.ceil(q * len(s)) - 1)] if s else 0.0  # nearest rank
+
+class Metrics:
+    def __init__(self, window=METRICS_WINDOW):
+        self.window = window
+        self.durations, self.counts, self.sums = {}, {}, {}
+        self.counters = {}  # (metric, ((label, value), ...)) -> value
+        self._lock = threading.Lock()
+        self._flushed = 0.0
+
+    def observe(self, name, seconds, attrs):
+        with self._lock:
+            if name not in self.durations: self.durations[name] = deque(maxlen=self.window)
+            self.durations[name].append(seconds)
+            self.counts[name] = self.counts.get(name, 0) + 1
+            self.sums[name] = self.sums.get(name, 0.0) + seconds
+            for attr, (metric, labels) in COUNTERS.items():
+                if isinstance(attrs.get(attr), (int, float)) and attrs[attr]:
+                    self._inc(metric, attrs[attr], dict(labels, span=name) if not labels else labels)
+            if attrs.get("cache") in ("hit", "miss"): self._inc("taxguide_cache_requests_total", 1, {"cache": name, "result": attrs["cache"]})
+            if attrs.get("error"): self._inc("taxguide_span_errors_total", 1, {"span": name})
+
+    def _inc(self, metric, amount, labels):
+        key = (metric, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe_trace(self, spans):
+        for s in spans: self.observe(s.name, s.duration, s.attrs)
+
+    def summary(self):
+        """{span name: {"count", "p50_ms", "p95_ms", "max_ms"}} over the sliding window."""
+        with self._lock:
+            return {name: {"count": self.counts[name], "p50_ms": percentile(d, 0.5) * 1e3, "p95_ms": percentile(d, 0.95) * 1e3,
+                           "max_ms": max(d) * 1e3} for name, d in sorted(self.durations.items())}
+
+    def prometheus(self):
+        """Prometheus text exposition (format 0.0.4)."""
+        def labels(pairs): return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}" if pairs else ""
+        with self._lock:
+            out, metric = [], "taxguide_span_duration_seconds"
+            if self.durations: out += [f"# HELP {metric} {HELP[metric][1]}", f"# TYPE {metric} {HELP[metric][0]}"]
+            for name, d in sorted(self.durations.items()):
+                for q in (0.5, 0.95):
+                    out.append(f"{metric}{labels([('span', name), ('quantile', q)])} {percentile(d, q):.6f}")
+                out.append(f"{metric}_sum{labels([('span', name)])} {self.sums[name]:.6f}")
+                out.append(f"{metric}_count{labels([('span', name)])} {self.counts[name]}")
+            for metric in sorted({m for m, _ in self.counters}):
+                out += [f"# HELP {metric} {HELP[metric][1]}", f"# TYPE {metric} {HELP[metric][0]}"]
+                out += [f"{metric}{labels(lab)} {v:g}" for (m, lab), v in sorted(self.counters.items()) if m == metric]
+        return "\n".join(out) + "\n"
+
+    def flush(self, path, force=False):
+        """Write the Prometheus text atomically, at most once per METRICS_FLUSH_INTERVAL unless forced."""
+        now = time.monotonic()
+        if not force and now - self._flushed < METRICS_FLUSH_INTERVAL: return
+        self._flushed = now
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f: f.write(self.prometheus())
+            os.replace(tmp, path)
+        except OSError:
+            pass
+
+def _escape(v):
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+metrics = Metrics()
+
+def metrics_from_jsonl(path, window=None):
+    """Metrics rebuilt from an exported trace file (e.g. to aggregate several workers)."""
+    m = Metrics(window or sys.maxsize)
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                rec = json.loads(line)
+                m.observe(rec["name"], rec["duration_ms"] / 1e3, rec.get("attrs", {}))
+    return m
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Summarize exported TaxGuide traces.")
+    sub = p.add_subparsers(dest="command", required=True)
+    s = sub.add_parser("summary", help="p50/p95 per span name")
+    s.add_argument("path", nargs="?", default=TRACE_PATH)
+    s.add_argument("--prometheus", action="store_true", help="Print Prometheus text instead of a table")
+    args = p.parse_args(argv)
+    if not os.path.exists(args.path): p.error(f"no trace file at {args.path} (run the app or service first)")
+    m = metrics_from_jsonl(args.path)
+    if args.prometheus:
+        sys.stdout.write(m.prometheus())
+        return
+    print(f"{'span':<28} {'count':>7} {'p50 ms':>10} {'p95 ms':>10} {'max ms':>10}")
+    for name, row in m.summary().items():
+        print(f"{name:<28} {row['count']:>7} {row['p50_ms']:>10.2f} {row['p95_ms']:>10.2f} {row['max_ms']:>10.2f}")
+
+if __name__ == "__main__":
+    main()
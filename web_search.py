@@ -0,0 +1,143 @@
+"""
+Cached, fan-out web search for Indian tax rulings.
+
+One lookup expands into a few query variants that run concurrently; results
+are merged and de-duplicated by URL. Each variant's results are kept in a
+SQLite-backed LRU+TTL cache keyed on the normalized query, so popular
+questions don't touch the network again. The search backend is pluggable
+(`set_search_backend`) so tests can swap DuckDuckGo for a local fake.
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import tracing
+
+CACHE_PATH = os.path.join(".taxguide_cache", "search.sqlite")
+CACHE_TTL = 7 * 24 * 3600
+CACHE_MAX_ENTRIES = 5000
+
+# --- 1. BACKENDS ---
+
+class DDGSBackend:
+    name = "ddgs"
+
+    def text(self, query, max_results=3):
+        from duckduckgo_search import DDGS
+        return DDGS().text(query, max_results=max_results) or []
+
+_backend = DDGSBackend()
+
+def set_search_backend(backend):
+    """Swap the search provider; anything with `.text(query, max_results)` returning [{title, body, href}] works."""
+    global _backend
+    _backend = backend
+
+# --- 2. DISK CACHE (LRU + TTL) ---
+
+def normalize_query(query):
+    return re.sub(r"\s+", " ", re.sub(r"[^\w\s:.]", " ", query.lower())).strip()
+
+class SearchCache:
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES):
+        self.ttl, self.max_entries = ttl, max_entries
+        if path != ":memory:": os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT, created REAL, accessed REAL)")
+
+    def get(self, key):
+        now = time.time()
+        with self._lock, self._db:
+            row = self._db.execute("SELECT value, created FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None: return None
+            if now - row[1] > self.ttl:
+                self._db.execute("DELETE FROM results WHERE key = ?", (key,))
+                return None
+            self._db.execute("UPDATE results SET accessed = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)", (key, json.dumps(value), now, now))
+            self._db.execute(
+                "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,))
+
+_cache = None
+
+def get_cache():
+    global _cache
+    if _cache is None: _cache = SearchCache()
+    return _cache
+
+def set_search_cache(cache):
+    global _cache
+    _cache = cache
+
+# --- 3. FAN-OUT SEARCH ---
+
+def query_variants(query):
+    """Indian-tax-scoped variants of one question (the first keeps the original app wording)."""
+    return [
+        f"{query} India Income Tax Act rules latest",
+        f"{query} income tax India section",
+        f"{query} site:incometax.gov.in",
+    ]
+
+def cached_search(query, max_results=3):
+    key = f"{_backend.name}|{max_results}|{normalize_query(query)}"
+    with tracing.span("search.query", backend=_backend.name, query=query[:120]) as sp:
+        hit = get_cache().get(key)
+        if hit is not None:
+            sp.set(cache="hit", results=len(hit))
+            return hit
+        sp.set(cache="miss")
+        results = [{"title": r.get("title", ""), "body": r.get("body", ""), "href": r.get("href", "")} for r in _backend.text(query, max_results=max_results)]
+        get_cache().put(key, results)
+        sp.set(results=len(results))
+        return results
+
+def _url_key(href):
+    return re.sub(r"^https?://(www\.)?", "", href.split("#")[0]).rstrip("/").lower()
+
+def search_many(queries, max_results=3, workers=4):
+    """Run `queries` concurrently; merged results in query order, de-duplicated by URL. Raises only if every query failed."""
+    @tracing.bind
+    def run(q):
+        try: return cached_search(q, max_results), None
+        except Exception as e: return [], e
+    with ThreadPoolExecutor(max_workers=min(workers, len(queries)) or 1) as pool:
+        outcomes = list(pool.map(run, queries))
+    errors = [e for _, e in outcomes if e is not None]
+    if errors and len(errors) == len(outcomes): raise errors[0]
+    merged, seen = [], set()
+    for results, _ in outcomes:
+        for r in results:
+            k = _url_key(r["href"])
+            if k and k not in seen:
+                seen.add(k); merged.append(r)
+    return merged
+
+def search_indian_tax_rules(query, max_results=5):
+    """
+    Performs a live web search restricted to Indian Income Tax context.
+    """
+    try:
+        # Force "India" context to prevent US/Global answers
+        results = search_many(query_variants(query))[:max_results]
+        if not results:
+            return "No specific Indian tax ruling found online."
+
+        summary = "Search Results:\n"
+        for res in results:
+            summary += f"- {res['title']}: {res['body']} (Source: {res['href']})\n"
+        return summary
+    except Exception as e:
+        return f"Search Error: {str(e)}"